@@ -0,0 +1,221 @@
+import asyncio
+import json
+import os
+import threading
+from contextlib import aclosing
+from typing import Optional
+
+import anyio
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+load_dotenv()
+
+import rate_limit
+import telemetry
+from chatbot import achat, chat_stream
+from chatbot_cloud import achat_cloud, chat_cloud_stream
+from session_store import Session, get_session_store
+
+# Zustandsloser Chat-Service fuer mehrere Worker-Prozesse:
+#   uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+# Der Client schickt Historie, Bestaetigungs-Flag und state mit und bekommt
+# den neuen Stand zurueck, daher kann jeder Worker jede Anfrage bedienen.
+# Alternativ haelt der Server den Verlauf: session_id mitschicken, dann kommen
+# Historie und state aus dem Session-Store (bei mehreren Workern SESSION_STORE=sqlite).
+# Alle Worker (und app.py) koennen dieselbe Outbox leeren: Eintraege werden
+# mit Besitzer und Zeitstempel beansprucht, fremde Ansprueche erst nach
+# OUTBOX_CLAIM_LEASE uebernommen. Voraussetzung: OUTBOX_PATH liegt auf einer
+# lokalen Platte (SQLite-WAL geht nicht ueber Netzlaufwerke).
+# Lasttest ohne echtes Modell: LLM_BACKEND=fake FAKE_LATENCY=0.5
+# /chat laeuft async mit Fristen (DEADLINE_* in chat_core); trennt der Client
+# die Verbindung, wird der Turn samt Modell-Aufruf abgebrochen.
+# Zu viele Anfragen pro IP/Session (RATE_LIMIT_* in rate_limit) bekommen
+# sofort 429 mit Retry-After und der ueblichen Antwort-Struktur.
+
+API_WORKERS = int(os.getenv("API_WORKERS", "4"))
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "0.5"))
+
+telemetry.configure_logging()
+
+app = FastAPI(title="DocBot Chat API")
+
+
+class ChatRequest(BaseModel):
+    message: str
+    conversation_history: list = Field(default_factory=list)
+    awaiting_confirmation: bool = False
+    state: dict = Field(default_factory=dict)
+    mode: str = "cloud"  # "cloud" -> chat_cloud, "local" -> chat
+    session_id: Optional[str] = None
+
+
+class ChatResponse(BaseModel):
+    response: str
+    conversation_history: list
+    awaiting_confirmation: bool
+    state: dict
+
+
+def _handlers(mode):
+    if mode == "local":
+        return achat, chat_stream
+    return achat_cloud, chat_cloud_stream
+
+
+async def _cancel_on_disconnect(http_request, coroutine):
+    """
+    Fuehrt coroutine aus und bricht sie ab, sobald der Client weg ist
+    """
+    task = asyncio.ensure_future(coroutine)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await http_request.is_disconnected():
+            task.cancel()
+            telemetry.count("docbot_client_disconnects_total")
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            # Antwort geht ohnehin niemandem mehr zu
+            raise asyncio.CancelledError()
+
+
+def _rejected(http_request, request, history, awaiting, state):
+    """
+    429-Antwort, falls IP oder Session ihr Kontingent aufgebraucht haben, sonst None
+    """
+    peer = http_request.client.host if http_request.client else None
+    try:
+        rate_limit.admit(request.session_id, rate_limit.client_ip(http_request.headers, peer))
+    except rate_limit.RateLimited as e:
+        content = {
+            "response": rate_limit.RATE_LIMITED_RESPONSE,
+            "conversation_history": history,
+            "awaiting_confirmation": awaiting,
+            "state": state,
+        }
+        return JSONResponse(content, status_code=429,
+                            headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    return None
+
+
+def _load_session(request):
+    """
+    (session, history, awaiting_confirmation, state) aus dem Store oder dem Request
+    """
+    if not request.session_id:
+        return None, request.conversation_history, request.awaiting_confirmation, request.state
+    session = get_session_store().get(request.session_id) or Session(request.session_id)
+    return session, session.history(), session.awaiting_confirmation, session.state
+
+
+def _save_session(session, message, response, history, awaiting):
+    if session is not None:
+        session.record_turn(message, response, history, awaiting)
+        get_session_store().save(session)
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus-Scrape; mit mehreren Workern liefert jeder nur seine eigenen Zahlen
+    return telemetry.render_prometheus()
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat_endpoint(request: ChatRequest, http_request: Request):
+    handler, _ = _handlers(request.mode)
+    session, history, awaiting, state = _load_session(request)
+    rejected = _rejected(http_request, request, history, awaiting, state)
+    if rejected is not None:
+        return rejected
+    response, history, awaiting = await _cancel_on_disconnect(
+        http_request, handler(request.message, history, awaiting, state)
+    )
+    await run_in_threadpool(_save_session, session, request.message, response, history, awaiting)
+    return ChatResponse(
+        response=response,
+        conversation_history=history,
+        awaiting_confirmation=awaiting,
+        state=state,
+    )
+
+
+_END = object()
+
+
+async def _iterate_closing(stream):
+    """
+    Wie iterate_in_threadpool, schliesst den Generator aber auch bei Abbruch.
+    Beim Disconnect haengt meist noch ein next() im Worker-Thread (wartet auf das
+    naechste Token); close() wartet per Lock darauf und laeuft dann ebenfalls im
+    Threadpool, statt mit "generator already executing" zu scheitern.
+    """
+    lock = threading.Lock()
+
+    def _next():
+        with lock:
+            return next(stream, _END)
+
+    def _close():
+        with lock:
+            stream.close()
+
+    try:
+        while True:
+            delta = await run_in_threadpool(_next)
+            if delta is _END:
+                return
+            yield delta
+    finally:
+        # Abgeschirmt, sonst wuerde das await nach dem Abbruch sofort wieder abgebrochen
+        with anyio.CancelScope(shield=True):
+            await anyio.to_thread.run_sync(_close)
+
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    NDJSON-Stream: {"delta": "..."} pro Text-Stueck, zum Schluss eine Zeile
+    mit done=true und dem neuen Session-Stand
+    """
+    _, handler = _handlers(request.mode)
+    session, history, awaiting, state = _load_session(request)
+    rejected = _rejected(http_request, request, history, awaiting, state)
+    if rejected is not None:
+        return rejected
+    result = {}
+
+    async def _lines():
+        # Client weg: Generator schliessen, damit Modell-Platz und Backend-Stream frei werden
+        async with aclosing(_iterate_closing(handler(request.message, history, awaiting, result, state))) as deltas:
+            async for delta in deltas:
+                yield json.dumps({"delta": delta}, ensure_ascii=False) + "\n"
+        await run_in_threadpool(_save_session, session, request.message, result["response"],
+                                result["conversation_history"], result["awaiting_confirmation"])
+        yield json.dumps({
+            "done": True,
+            "response": result["response"],
+            "conversation_history": result["conversation_history"],
+            "awaiting_confirmation": result["awaiting_confirmation"],
+            "state": state,
+        }, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("api:app", host=os.getenv("API_HOST", "0.0.0.0"), port=int(os.getenv("API_PORT", "8000")),
+                workers=API_WORKERS)
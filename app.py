@@ -1,13 +1,87 @@
 import streamlit as st
-import sys
 import os
-
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import uuid
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from chatbot_cloud import chat_cloud
+import telemetry
+telemetry.configure_logging()
+
+import rate_limit
+from session_store import Session, get_session_store
+
+# Mit CHAT_API_URL (z.B. http://localhost:8000) ist die App nur noch ein
+# Frontend fuer api.py, sonst laeuft der Chat wie bisher im Streamlit-Prozess.
+# Die App begrenzt pro Session und Browser-IP selbst (RATE_LIMIT_* in
+# rate_limit) und reicht die IP als X-Forwarded-For weiter; die API dafuer
+# mit RATE_LIMIT_TRUST_FORWARDED=1 starten, sonst zaehlen alle Nutzer als eine IP.
+CHAT_API_URL = os.getenv("CHAT_API_URL")
+
+
+@st.cache_resource
+def load_chat():
+    """
+    Chat-Module und LLM-Client erst bei der ersten Nachricht laden, danach
+    ueber alle Reruns und Sessions aus dem Cache. Die Seite steht vorher.
+    """
+    from chatbot_cloud import _backend, chat_cloud_stream
+
+    _backend()
+    return chat_cloud_stream
+
+
+@st.cache_resource
+def load_store():
+    return get_session_store()
+
+
+def client_ip():
+    """
+    IP des Browsers, soweit Streamlit sie kennt (st.context ab 1.37)
+    """
+    context = getattr(st, "context", None)
+    if context is None:
+        return None
+    return rate_limit.client_ip(getattr(context, "headers", None), getattr(context, "ip_address", None))
+
+
+def api_chat_stream(user_message, conversation_history, awaiting_confirmation, result, state):
+    """
+    Gleiche Schnittstelle wie chat_cloud_stream, aber ueber den Chat-Service
+    """
+    import httpx
+    import json
+
+    payload = {
+        "message": user_message,
+        "conversation_history": conversation_history,
+        "awaiting_confirmation": awaiting_confirmation,
+        "state": state,
+    }
+    ip = client_ip()
+    headers = {"X-Forwarded-For": ip} if ip else None
+    with httpx.stream("POST", f"{CHAT_API_URL}/chat/stream", json=payload, headers=headers,
+                      timeout=120) as response:
+        if response.status_code == 429:
+            # Abgelehnt: freundliche Antwort, Stand bleibt unveraendert
+            response.read()
+            data = response.json()
+            result.update(data)
+            yield data["response"]
+            return
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            if data.get("done"):
+                result.update(data)
+                # Server-Stand uebernehmen (state wird dort aktualisiert)
+                state.clear()
+                state.update(data["state"])
+            else:
+                yield data["delta"]
 
 # ---------- Page Config ----------
 
@@ -161,24 +235,27 @@ st.markdown("""
 
 # ---------- Session State ----------
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-if "conversation_history" not in st.session_state:
-    st.session_state.conversation_history = []
-if "awaiting_confirmation" not in st.session_state:
-    st.session_state.awaiting_confirmation = False
-if "welcome_shown" not in st.session_state:
-    st.session_state.welcome_shown = False
-
 WELCOME_MESSAGE = (
     "Willkommen in der Zahnarztpraxis Dr. Mueller! "
     "Ich bin Ihr virtueller Assistent und helfe Ihnen gerne bei der Terminvereinbarung.\n\n"
     "Nennen Sie mir einfach Ihren Namen, und wir legen los."
 )
 
-if not st.session_state.welcome_shown:
-    st.session_state.messages.append({"role": "assistant", "content": WELCOME_MESSAGE})
-    st.session_state.welcome_shown = True
+# Der Chat-Verlauf liegt serverseitig im Session-Store, in st.session_state
+# steht nur noch die Session-ID. Inaktive Sessions laufen nach SESSION_TTL ab.
+store = load_store()
+
+
+def new_session():
+    session = Session(uuid.uuid4().hex)
+    # Begruessung nur anzeigen, nicht ans Modell schicken
+    session.add("assistant", WELCOME_MESSAGE, context=False)
+    store.save(session)
+    st.session_state.session_id = session.session_id
+    return session
+
+
+session = store.get(st.session_state.get("session_id", "")) or new_session()
 
 # ---------- Sidebar ----------
 
@@ -234,9 +311,8 @@ with st.sidebar:
     st.markdown("---")
 
     if st.button("Neue Konversation"):
-        st.session_state.messages = [{"role": "assistant", "content": WELCOME_MESSAGE}]
-        st.session_state.conversation_history = []
-        st.session_state.awaiting_confirmation = False
+        store.delete(session.session_id)
+        new_session()
         st.rerun()
 
 # ---------- Header ----------
@@ -250,38 +326,48 @@ st.markdown("""
 
 # ---------- Chat Messages ----------
 
-for msg in st.session_state.messages:
-    with st.chat_message(msg["role"]):
-        st.write(msg["content"])
+for turn in session.turns:
+    with st.chat_message(turn.role):
+        st.write(turn.content)
 
 # ---------- User Input ----------
 
 if user_input := st.chat_input("Ihre Nachricht..."):
-    st.session_state.messages.append({"role": "user", "content": user_input})
     with st.chat_message("user"):
         st.write(user_input)
 
     with st.chat_message("assistant"):
-        with st.spinner("Einen Moment bitte..."):
-            try:
-                response, new_history, new_confirmation = chat_cloud(
-                    user_input,
-                    list(st.session_state.conversation_history),
-                    st.session_state.awaiting_confirmation,
-                )
-            except Exception as e:
-                response = (
-                    "Entschuldigung, ein unerwarteter Fehler ist aufgetreten. "
-                    "Bitte versuchen Sie es erneut oder rufen Sie uns an: 0521-12345678"
-                )
-                new_history = st.session_state.conversation_history
-                new_confirmation = False
-
-        st.write(response)
-
-    st.session_state.messages.append({"role": "assistant", "content": response})
-    st.session_state.conversation_history = new_history
-    st.session_state.awaiting_confirmation = new_confirmation
+        result = {}
+        try:
+            rate_limit.admit(session.session_id, client_ip())
+            # Antwort Token fuer Token anzeigen statt Spinner bis zum Ende
+            stream = api_chat_stream if CHAT_API_URL else load_chat()
+            st.write_stream(stream(
+                user_input,
+                session.history(),
+                session.awaiting_confirmation,
+                result,
+                session.state,
+            ))
+            response = result["response"]
+            new_history = result["conversation_history"]
+            new_confirmation = result["awaiting_confirmation"]
+        except rate_limit.RateLimited:
+            response = rate_limit.RATE_LIMITED_RESPONSE
+            new_history = session.history()
+            new_confirmation = session.awaiting_confirmation
+            st.write(response)
+        except Exception as e:
+            response = (
+                "Entschuldigung, ein unerwarteter Fehler ist aufgetreten. "
+                "Bitte versuchen Sie es erneut oder rufen Sie uns an: 0521-12345678"
+            )
+            new_history = session.history()
+            new_confirmation = False
+            st.write(response)
+
+    session.record_turn(user_input, response, new_history, new_confirmation)
+    store.save(session)
 
     # Balloons bei erfolgreichem Email-Versand
     if "erfolgreich weitergeleitet" in response.lower():
@@ -0,0 +1,151 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import telemetry
+from extract_info import extract_appointment_info
+from llm_backends import get_backend
+
+# Nachträgliche Extraktion archivierter Konversationen, z.B.:
+#   python batch_extract.py archiv.jsonl termine.jsonl --workers 8
+#
+# Eingabe: eine Konversation pro Zeile,
+#   {"id": "...", "conversation_history": [{"role": "user", "content": "..."}, ...]}
+# Ausgabe: eine Zeile pro Konversation, sofort geschrieben,
+#   {"id": "...", "status": "ok", "record": {...}, "elapsed_ms": ...}
+#   {"id": "...", "status": "error", "error": "...", "elapsed_ms": ...}
+#
+# Die Ausgabedatei ist zugleich der Checkpoint: bei einem Neustart werden alle
+# ids übersprungen, die dort schon stehen (mit --retry-failed nur die "ok").
+# Fehler werden als Fehler protokolliert, nicht als leerer Datensatz mit Notiz.
+#
+# Parallelität: Ollama bedient gleichzeitige Anfragen bis OLLAMA_NUM_PARALLEL,
+# Cloud-Backends per HTTP-Pool. Die Regeln erledigen viele Konversationen
+# ganz ohne Modellaufruf.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+
+logger = logging.getLogger(__name__)
+
+
+def read_conversations(path):
+    """
+    (id, conversation_history) pro Zeile; ohne id zählt die Zeilennummer
+    """
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            yield str(item.get("id", line_number)), item["conversation_history"]
+
+
+def load_checkpoint(path, retry_failed=False):
+    """
+    ids, die in einer früheren Ausgabe schon erledigt sind
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # Abgebrochene letzte Zeile nach einem Absturz
+                continue
+            if item.get("status") == "ok" or not retry_failed:
+                done.add(item["id"])
+            else:
+                done.discard(item["id"])
+    return done
+
+
+def _extract_one(conversation_id, history, backend, use_rules):
+    start = time.perf_counter()
+    try:
+        record = extract_appointment_info(history, use_rules=use_rules, backend=backend, strict=True)
+        result = {"id": conversation_id, "status": "ok", "record": record}
+    except Exception as e:
+        result = {"id": conversation_id, "status": "error", "error": f"{type(e).__name__}: {e}"}
+    result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+def run_batch(input_path, output_path, workers=BATCH_WORKERS, backend=None, use_rules=True, retry_failed=False,
+              limit=None):
+    """
+    Extrahiert alle noch offenen Konversationen mit höchstens `workers`
+    gleichzeitigen Aufrufen und gibt einen Durchsatz-Bericht zurück
+    """
+    backend = backend or get_backend()
+    done = load_checkpoint(output_path, retry_failed)
+    stats = {"processed": 0, "ok": 0, "errors": 0, "skipped": 0}
+    latencies = []
+
+    def _write(out, future):
+        result = future.result()
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+        stats["processed"] += 1
+        stats["ok" if result["status"] == "ok" else "errors"] += 1
+        latencies.append(result["elapsed_ms"])
+        if stats["processed"] % 100 == 0:
+            logger.info("%d Konversationen extrahiert (%d Fehler)", stats["processed"], stats["errors"])
+
+    start = time.perf_counter()
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        # Nur ein paar Aufträge pro Worker vorhalten, die Eingabe wird gestreamt
+        pending = set()
+        for conversation_id, history in read_conversations(input_path):
+            if conversation_id in done:
+                stats["skipped"] += 1
+                continue
+            if limit is not None and stats["processed"] + len(pending) >= limit:
+                break
+            pending.add(pool.submit(_extract_one, conversation_id, history, backend, use_rules))
+            if len(pending) >= 2 * workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    _write(out, future)
+        for future in pending:
+            _write(out, future)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        **stats,
+        "workers": workers,
+        "backend": backend.name,
+        "elapsed_s": round(elapsed, 3),
+        "conversations_per_s": round(stats["processed"] / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Termindaten aus archivierten Konversationen extrahieren")
+    parser.add_argument("input", help="JSONL mit id und conversation_history pro Zeile")
+    parser.add_argument("output", help="JSONL-Ausgabe, zugleich Checkpoint")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--backend", help="LLM-Backend (Default: LLM_BACKEND)")
+    parser.add_argument("--no-rules", action="store_true", help="nur LLM, ohne Regel-Extraktor")
+    parser.add_argument("--retry-failed", action="store_true", help="Fehler aus der Ausgabe erneut versuchen")
+    parser.add_argument("--limit", type=int, help="höchstens so viele Konversationen in diesem Lauf")
+    args = parser.parse_args()
+
+    telemetry.configure_logging()
+    report = run_batch(args.input, args.output, args.workers, get_backend(args.backend), not args.no_rules,
+                       args.retry_failed, args.limit)
+    json.dump(report, sys.stdout, indent=2, ensure_ascii=False)
+    print()
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
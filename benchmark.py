@@ -0,0 +1,1812 @@
+import argparse
+import json
+import logging
+import random
+import socketserver
+import statistics
+import threading
+import time
+
+# Benchmarks fuer DocBot. Aufruf z.B.:
+#   python benchmark.py extraction --n 200            (Regeln + LLM vs. nur LLM, braucht Ollama)
+#   python benchmark.py extraction --n 200 --no-llm   (nur Regel-Extraktor)
+#   python benchmark.py backends --backends ollama,openai,fake --n 20
+#   python benchmark.py context --turns 60
+#   python benchmark.py prefix --patients 3            (braucht Ollama)
+#   python benchmark.py moderation --sizes 12,1000,10000
+#   python benchmark.py slots --turns 200
+#   python benchmark.py sessions --sessions 1000
+#   python benchmark.py load --patients 200 --concurrency 20 --latency 0.2 --jitter 0.1 --out load.json
+#   python benchmark.py telemetry --conversations 200
+#   python benchmark.py json --n 500
+#   python benchmark.py templates --n 5000
+#   python benchmark.py speculation --n 20 --latency 0.2 --think 0.5
+#   python benchmark.py deadlines --turns 50 --slow 2 --deadline 0.3
+#   python benchmark.py router --n 400 --concurrency 8
+#   python benchmark.py startup --budget-ms 150       (Exit-Code 1 bei Budget-Überschreitung)
+#   python benchmark.py api --url http://localhost:8000 --conversations 200 --concurrency 50
+#       (Server vorher mit LLM_BACKEND=fake FAKE_LATENCY=0.5 uvicorn api:app --workers 4 starten)
+
+FIRST_NAMES = ["Max", "Anna", "Lena", "Jonas", "Mehmet", "Sophie", "Lukas", "Marie", "Paul", "Emma", "Hannah", "Felix"]
+LAST_NAMES = ["Mustermann", "Schmidt", "Müller", "Yilmaz", "Becker", "Hoffmann", "Schulz", "Wagner", "Neumann", "Krüger"]
+TIMES = [
+    "Nächste Woche Dienstag",
+    "Montag um 10 Uhr",
+    "Donnerstag nachmittags",
+    "morgen vormittag",
+    "am Freitag ab 14:30",
+    "kommende Woche Mittwoch früh",
+    "am 12.03. um 9 Uhr",
+]
+REASONS = [
+    ("Ich hätte gerne eine Zahnreinigung", "Zahnreinigung"),
+    ("Ich habe seit Tagen Schmerzen unten links", "Schmerzen"),
+    ("Nur zur Kontrolle", "Kontrolle"),
+    ("Mir ist eine Füllung rausgefallen", "Füllung"),
+    ("Ein Zahn ist abgebrochen", "Zahn abgebrochen"),
+    ("Mein Zahnfleisch blutet oft", "Zahnfleischprobleme"),
+    # Ohne Schluesselwort: das kann nur das LLM
+    ("Mein Backenzahn pocht die ganze Nacht", "Schmerzen"),
+]
+
+
+def synthetic_conversation(rng):
+    """
+    Eine zufaellige, aber realistische Buchungs-Konversation samt Soll-Daten
+    """
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    use_email = rng.random() < 0.6
+    email = f"{name.split()[0].lower()}.{rng.randint(1, 99)}@example.de"
+    phone = f"0{rng.randint(150, 179)} {rng.randint(1000000, 9999999)}"
+    when = rng.choice(TIMES)
+    reason_text, reason = rng.choice(REASONS)
+
+    # Kleingeschriebene Namen erkennt der Regel-Extraktor absichtlich nicht
+    name_line = rng.choice([name, f"Ich heiße {name}", f"Mein Name ist {name}", f"hier ist {name.lower()}"])
+    contact_line = rng.choice([
+        "{}", "Erreichbar unter {}", "Sie erreichen mich unter {} gerne auch abends", "Meine Nummer ist {}.",
+        "Unter {}!",
+    ]).format(email if use_email else phone)
+    # Satzzeichen am Ende gehören nicht zum Terminwunsch
+    when_line = when + rng.choice(["", ".", "!"])
+
+    history = [
+        {"role": "user", "content": rng.choice(["Hallo, ich brauche einen Termin", "Guten Tag", "Hi"])},
+        {"role": "assistant", "content": "Gerne! Wie ist Ihr Name?"},
+        {"role": "user", "content": name_line},
+        {"role": "assistant", "content": "Wie können wir Sie erreichen, per Email oder Telefon?"},
+        {"role": "user", "content": contact_line},
+        {"role": "assistant", "content": "Wann hätten Sie Zeit?"},
+        {"role": "user", "content": when_line},
+        {"role": "assistant", "content": "Worum geht es bei dem Termin?"},
+        {"role": "user", "content": reason_text},
+    ]
+    truth = {
+        "patient_name": name,
+        "patient_email": email if use_email else None,
+        "patient_phone": None if use_email else phone,
+        "appointment_request": when,
+        "reason": reason,
+    }
+    return history, truth
+
+
+def synthetic_corpus(n, seed=42):
+    rng = random.Random(seed)
+    return [synthetic_conversation(rng) for _ in range(n)]
+
+
+def _normalize(value):
+    return " ".join(str(value).lower().replace(",", " ").split()) if value else ""
+
+
+def field_correct(field, predicted, expected):
+    if not expected:
+        return not predicted
+    if not predicted:
+        return False
+    if field == "patient_phone":
+        return "".join(c for c in predicted if c.isdigit()) == "".join(c for c in expected if c.isdigit())
+    if field in ("appointment_request", "reason"):
+        # Modelle formulieren frei um: Soll-Begriffe muessen enthalten sein
+        return all(word in _normalize(predicted) for word in _normalize(expected).split())
+    return _normalize(predicted) == _normalize(expected)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _latency_summary(latencies):
+    return {
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def _run_extractor(name, extract, corpus):
+    latencies = []
+    correct = {field: 0 for field in corpus[0][1]}
+    for history, truth in corpus:
+        start = time.perf_counter()
+        data = extract(history)
+        latencies.append(time.perf_counter() - start)
+        for field, expected in truth.items():
+            correct[field] += field_correct(field, data.get(field), expected)
+
+    return {
+        "extractor": name,
+        "conversations": len(corpus),
+        **_latency_summary(latencies),
+        "accuracy": {field: round(hits / len(corpus), 3) for field, hits in correct.items()},
+    }
+
+
+def bench_extraction(n=100, seed=42, llm=True):
+    from extract_info import extract_appointment_info, extract_rules, missing_fields
+
+    corpus = synthetic_corpus(n, seed)
+    results = [_run_extractor("rules", extract_rules, corpus)]
+    results[0]["llm_calls_needed"] = sum(1 for history, _ in corpus if missing_fields(extract_rules(history)))
+
+    if llm:
+        results.append(_run_extractor("rules+llm", extract_appointment_info, corpus))
+        results.append(_run_extractor(
+            "llm", lambda history: extract_appointment_info(history, use_rules=False), corpus
+        ))
+    return results
+
+
+def bench_backends(names, n=20, seed=42):
+    """
+    Gleiche Chat-Turns gegen mehrere Backends: Gesamtlatenz und Time-to-first-token
+    """
+    from chat_core import SYSTEM_PROMPT
+    from llm_backends import get_backend
+
+    corpus = synthetic_corpus(n, seed)
+    results = []
+    for name in names:
+        backend = get_backend(name)
+        latencies, first_token = [], []
+        errors = 0
+        for history, _ in corpus:
+            # Turn mitten in der Konversation: System-Prompt + bisherige Historie
+            messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history[:5]
+            try:
+                start = time.perf_counter()
+                backend.chat(messages, max_tokens=128)
+                latencies.append(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for _ in backend.chat(messages, max_tokens=128, stream=True):
+                    first_token.append(time.perf_counter() - start)
+                    break
+            except Exception as e:
+                print(f"FEHLER bei {name}: {e}")
+                errors += 1
+        results.append({
+            "backend": name,
+            "turns": n,
+            "errors": errors,
+            **(_latency_summary(latencies) if latencies else {}),
+            "ttft_p50_ms": round(percentile(first_token, 50) * 1000, 3),
+        })
+    return results
+
+
+RAMBLING = [
+    "Also wissen Sie, ich war schon lange nicht mehr beim Zahnarzt, das letzte Mal vor drei Jahren glaube ich.",
+    "Mein Nachbar hat mir Ihre Praxis empfohlen, der war sehr zufrieden mit der Behandlung.",
+    "Ich arbeite im Schichtdienst, deshalb ist das mit den Terminen immer etwas schwierig bei mir.",
+    "Eigentlich habe ich auch ein bisschen Angst vor dem Bohren, ehrlich gesagt.",
+]
+
+
+def bench_context(turns=60, seed=42):
+    """
+    Prompt-Größe pro Turn mit und ohne Fenster bei langen Konversationen.
+    Bricht ab, falls ein Prompt das Budget überschreitet.
+    """
+    from chat_core import SYSTEM_PROMPT
+    from context_window import CONTEXT_TOKEN_BUDGET, build_context, count_message_tokens
+    from extract_info import extract_rules
+    from slot_tracker import SlotTracker, missing_slots_hint
+
+    rng = random.Random(seed)
+    history, truth = synthetic_conversation(rng)
+    while len(history) < 2 * turns:
+        history += [
+            {"role": "assistant", "content": "Verstehe. Darf ich noch etwas fragen?"},
+            {"role": "user", "content": rng.choice(RAMBLING)},
+        ]
+
+    full, windowed, build_times = [], [], []
+    # Tokens am Prompt-Anfang, die byte-gleich schon im vorigen Prompt standen (KV-Cache)
+    reused, previous = 0, []
+    tracker = SlotTracker()
+    for i in range(1, len(history), 2):
+        past, message = history[:i - 1], history[i - 1]["content"]
+        full.append(count_message_tokens(
+            [{"role": "system", "content": SYSTEM_PROMPT}] + past + [{"role": "user", "content": message}]
+        ))
+        record = extract_rules(past)
+        hint = missing_slots_hint(tracker.missing()) if past else None
+        start = time.perf_counter()
+        messages = build_context(SYSTEM_PROMPT, past, message, record, hint=hint)
+        build_times.append(time.perf_counter() - start)
+        windowed.append(count_message_tokens(messages))
+        assert windowed[-1] <= CONTEXT_TOKEN_BUDGET, f"Turn {i // 2}: {windowed[-1]} > {CONTEXT_TOKEN_BUDGET}"
+        shared = 0
+        while shared < min(len(messages), len(previous)) and messages[shared] == previous[shared]:
+            shared += 1
+        reused += count_message_tokens(messages[:shared])
+        previous = messages
+        tracker.update(message)
+
+    return {
+        "turns": len(full),
+        "token_budget": CONTEXT_TOKEN_BUDGET,
+        "full_prompt_tokens_last": full[-1],
+        "full_prompt_tokens_total": sum(full),
+        "windowed_prompt_tokens_max": max(windowed),
+        "windowed_prompt_tokens_total": sum(windowed),
+        "prefix_reuse": round(reused / sum(windowed), 3),
+        "build_context_mean_ms": round(statistics.mean(build_times) * 1000, 3),
+    }
+
+
+def bench_prefix(patients=3, gap=0.0, seed=42):
+    """
+    Prompt-Eval pro Turn gegen Ollama: altes Layout (System-Prompt als
+    User-Nachricht, Ollama-Default keep_alive) gegen stabilen System-Praefix
+    mit gepinntem Modell
+    """
+    from chat_core import SYSTEM_PROMPT
+    from context_window import build_context
+    from llm_backends import OllamaBackend
+
+    layouts = {
+        "before": OllamaBackend(system_role="user", keep_alive="5m"),
+        "after": OllamaBackend(),
+    }
+    corpus = synthetic_corpus(patients, seed)
+    results = []
+    for layout, backend in layouts.items():
+        if layout == "after":
+            backend.warmup(SYSTEM_PROMPT)
+        per_turn = []
+        for history, _ in corpus:
+            for i in range(0, len(history), 2):
+                messages = build_context(SYSTEM_PROMPT, history[:i], history[i]["content"])
+                backend.chat(messages, max_tokens=64)
+                stats = backend.last_stats
+                per_turn.append({
+                    "prompt_eval_count": stats.get("prompt_eval_count") or 0,
+                    "prompt_eval_ms": round((stats.get("prompt_eval_duration") or 0) / 1e6, 1),
+                    "load_ms": round((stats.get("load_duration") or 0) / 1e6, 1),
+                })
+            # Pause zwischen zwei Patienten
+            time.sleep(gap)
+        results.append({
+            "layout": layout,
+            "turns": len(per_turn),
+            "prompt_eval_count_mean": round(statistics.mean(t["prompt_eval_count"] for t in per_turn), 1),
+            "prompt_eval_ms_mean": round(statistics.mean(t["prompt_eval_ms"] for t in per_turn), 1),
+            "prompt_eval_ms_p95": percentile([t["prompt_eval_ms"] for t in per_turn], 95),
+            "load_ms_total": round(sum(t["load_ms"] for t in per_turn), 1),
+            "per_turn": per_turn,
+        })
+    return results
+
+
+def _legacy_check(text, keywords):
+    # Alte Variante zum Vergleich: eine Python-Schleife pro Begriff
+    text_lower = text.lower()
+    for keyword in keywords:
+        if keyword in text_lower:
+            return True
+    return False
+
+
+def bench_moderation(sizes=(12, 1000, 10000), n=2000, seed=42):
+    """
+    Mikrobenchmark Inhaltsfilter: Schleife pro Begriff vs. vorkompilierter Matcher
+    """
+    from moderation import BLACKLIST_KEYWORDS, TermMatcher
+
+    rng = random.Random(seed)
+    messages = [msg["content"] for history, _ in synthetic_corpus(n // 5 + 1, seed) for msg in history
+                if msg["role"] == "user"][:n]
+    alphabet = "abcdefghijklmnopqrstuvwxyz"
+
+    results = []
+    for size in sizes:
+        # Zufallsbegriffe, die in normalen Nachrichten nicht vorkommen
+        terms = list(BLACKLIST_KEYWORDS) + [
+            "".join(rng.choice(alphabet) for _ in range(rng.randint(6, 12))) + "q"
+            for _ in range(max(0, size - len(BLACKLIST_KEYWORDS)))
+        ]
+        plain = [t.rstrip("*") for t in terms]
+
+        start = time.perf_counter()
+        matcher = TermMatcher(terms)
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            _legacy_check(message, plain)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for message in messages:
+            matcher.find(message)
+        compiled = time.perf_counter() - start
+
+        results.append({
+            "terms": len(terms),
+            "messages": len(messages),
+            "build_ms": round(build * 1000, 3),
+            "legacy_us_per_message": round(legacy / len(messages) * 1e6, 2),
+            "matcher_us_per_message": round(compiled / len(messages) * 1e6, 2),
+        })
+    return results
+
+
+def _legacy_check_if_complete(conversation_history):
+    # Alte Variante zum Vergleich: ganze Konversation verketten und neu scannen
+    import re
+
+    conv_text = " ".join([msg['content'] for msg in conversation_history if msg['role'] == 'user'])
+    has_name = bool(re.search(r'\b[A-ZÄÖÜ][a-zäöüß]+\s+[A-ZÄÖÜ][a-zäöüß]+', conv_text))
+    has_contact = bool(re.search(r'(@|\.de|\.com|\d{4,})', conv_text))
+    has_time = bool(re.search(
+        r'(montag|dienstag|mittwoch|donnerstag|freitag|samstag|sonntag|\d{1,2}:\d{2}|\d{1,2}\s?uhr|vormittag|nachmittag|morgen|heute)',
+        conv_text.lower()))
+    return has_name and has_contact and has_time
+
+
+def bench_slots(turns=200, seed=42):
+    """
+    Vollständigkeits-Check pro Turn: alles neu verketten und scannen
+    (alte check_if_complete) vs. SlotTracker, der nur die neue Nachricht scannt
+    """
+    from slot_tracker import SlotTracker
+
+    rng = random.Random(seed)
+    history = []
+    while len(history) < 2 * turns:
+        history += [
+            {"role": "user", "content": rng.choice(RAMBLING)},
+            {"role": "assistant", "content": "Verstehe. Darf ich noch etwas fragen?"},
+        ]
+    # Die eigentlichen Daten kommen erst am Ende
+    history += synthetic_conversation(rng)[0]
+    user_turns = [i for i, msg in enumerate(history) if msg["role"] == "user"]
+
+    start = time.perf_counter()
+    full = [_legacy_check_if_complete(history[:i + 1]) for i in user_turns]
+    rescan = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tracker, state, incremental = SlotTracker(), None, []
+    for i in user_turns:
+        # Mit Serialisierung wie in der Session
+        tracker = SlotTracker.from_dict(state).update(history[i]["content"])
+        state = tracker.to_dict()
+        incremental.append(tracker.is_complete())
+    tracked = time.perf_counter() - start
+
+    assert full == incremental, "SlotTracker weicht von check_if_complete ab"
+    return {
+        "user_turns": len(user_turns),
+        "rescan_total_ms": round(rescan * 1000, 3),
+        "rescan_per_turn_us": round(rescan / len(user_turns) * 1e6, 2),
+        "tracker_total_ms": round(tracked * 1000, 3),
+        "tracker_per_turn_us": round(tracked / len(user_turns) * 1e6, 2),
+    }
+
+
+def _legacy_session(history, state):
+    # Bisheriger st.session_state: Anzeige und Historie als zwei Listen von Dicts
+    # (die Texte selbst teilen sich beide Listen)
+    messages = [{"role": "assistant", "content": _fresh("Willkommen!")}]
+    conversation_history = []
+    for msg in history:
+        content = _fresh(msg["content"])
+        messages.append({"role": msg["role"], "content": content})
+        conversation_history.append({"role": msg["role"], "content": content})
+    return {
+        "messages": messages,
+        "conversation_history": conversation_history,
+        "awaiting_confirmation": True,
+        "chat_state": state,
+    }
+
+
+def _fresh(text):
+    # Eigene String-Kopie, damit tracemalloc die Texte jeder Session mitzählt
+    return text.encode("utf-8").decode("utf-8")
+
+
+def _measure_memory(build, n):
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = [build(i) for i in range(n)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objects
+    return (after - before) / n
+
+
+def bench_sessions(sessions=1000, seed=42):
+    """
+    Speicher pro aktiver Session: zwei Dict-Listen (alt) vs. Session mit
+    __slots__-Turns, dazu Größe und Zugriffszeit im SQLite-Store
+    """
+    import os
+    import tempfile
+
+    from extract_info import empty_record
+    from session_store import MemorySessionStore, Session, SQLiteSessionStore
+
+    corpus = synthetic_corpus(sessions, seed)
+
+    def _state(i):
+        record = {**empty_record(), **{key: value and _fresh(value) for key, value in corpus[i][1].items()}}
+        return {"appointment": record, "slots": {"filled": ["contact", "name", "time"], "tail": ""}}
+
+    def _session(i):
+        session = Session(f"s{i}")
+        session.add("assistant", _fresh("Willkommen!"), context=False)
+        for msg in corpus[i][0]:
+            session.add(msg["role"], _fresh(msg["content"]))
+        session.state = _state(i)
+        session.awaiting_confirmation = True
+        return session
+
+    legacy = _measure_memory(lambda i: _legacy_session(corpus[i][0], _state(i)), sessions)
+    compact = _measure_memory(_session, sessions)
+
+    # Ablauf inaktiver Sessions mit künstlicher Uhr
+    now = [0.0]
+    memory = MemorySessionStore(maxsize=sessions, ttl=60, clock=lambda: now[0])
+    for i in range(sessions):
+        now[0] = i * 0.01
+        memory.save(_session(i))
+    now[0] = 60 + sessions * 0.005
+    expired = memory.purge_expired()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SQLiteSessionStore(os.path.join(tmp, "sessions.sqlite3"))
+        start = time.perf_counter()
+        for i in range(sessions):
+            store.save(_session(i))
+        save = time.perf_counter() - start
+        start = time.perf_counter()
+        for i in range(sessions):
+            store.get(f"s{i}")
+        load = time.perf_counter() - start
+        with store._connect() as conn:
+            stored = conn.execute("SELECT AVG(LENGTH(CAST(data AS BLOB))) FROM sessions").fetchone()[0]
+        store.close()
+
+    return {
+        "sessions": sessions,
+        "legacy_bytes_per_session": round(legacy),
+        "session_bytes_per_session": round(compact),
+        "memory_saving": round(1 - compact / legacy, 3),
+        "memory_store_expired": expired,
+        "memory_store_active": len(memory),
+        "sqlite_bytes_per_session": round(stored),
+        "sqlite_save_us": round(save / sessions * 1e6, 1),
+        "sqlite_get_us": round(load / sessions * 1e6, 1),
+    }
+
+
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    # Minimales SMTP: nimmt alles an, ohne TLS und Login
+
+    def _reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        self.server.sink.sessions += 1
+        self._reply("220 docbot-sink ESMTP")
+        for line in self.rfile:
+            command = line.decode("ascii", "replace").strip().upper()
+            if command.startswith("EHLO"):
+                self._reply("250-docbot-sink")
+                self._reply("250 8BITMIME")
+            elif command.startswith("DATA"):
+                self._reply("354 Ende mit <CRLF>.<CRLF>")
+                lines = []
+                for data in self.rfile:
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    lines.append(data[1:] if data.startswith(b"..") else data)
+                self.server.sink.receive(b"".join(lines))
+                self._reply("250 OK")
+            elif command.startswith("QUIT"):
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("250 OK")
+
+
+class SMTPSink:
+    """
+    Lokaler SMTP-Empfänger für Lasttests, merkt sich Zeitpunkt und Text jeder Mail
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = socketserver.ThreadingTCPServer((host, port), _SMTPSinkHandler)
+        self.server.daemon_threads = True
+        self.server.sink = self
+        self.host, self.port = self.server.server_address
+        self.sessions = 0
+        self.messages = []  # (Empfangszeit, Text aller Teile)
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def receive(self, raw):
+        import email
+
+        message = email.message_from_bytes(raw)
+        text = " ".join(
+            part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", "replace")
+            for part in message.walk() if not part.is_multipart()
+        )
+        with self._lock:
+            self.messages.append((time.perf_counter(), text))
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _load_patient(i, history, truth):
+    # Eindeutiger Kontakt pro Patient, damit sich die Mail in der Senke zuordnen lässt
+    old = truth["patient_email"] or truth["patient_phone"]
+    new = f"patient{i}@example.de" if truth["patient_email"] else f"0170 {1000000 + i}"
+    messages = [msg["content"].replace(old, new) for msg in history if msg["role"] == "user"]
+    return messages + ["Ja, bitte weiterleiten"], new
+
+
+def bench_load(patients=200, concurrency=20, latency=0.2, jitter=0.1, extractions=100, seed=42,
+               delivery_timeout=60.0, delivery="immediate", digest_window=5.0, digest_size=20):
+    """
+    Lasttest des ganzen Buchungsablaufs ohne echtes Modell und ohne Gmail:
+    Patienten-Konversationen über chat und chat_cloud plus Extraktionen,
+    alles parallel gegen das FakeBackend, Versand über die Outbox an eine
+    lokale SMTP-Senke (einzeln oder als Digest)
+    """
+    import os
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    corpus = synthetic_corpus(max(patients, extractions), seed)
+    with SMTPSink() as sink, tempfile.TemporaryDirectory() as tmp:
+        # Vor dem ersten Import der Chat-Module setzen, die lesen ihre Konfiguration beim Import
+        os.environ.update({
+            "LLM_BACKEND": "fake",
+            "FAKE_LATENCY": str(latency),
+            "FAKE_JITTER": str(jitter),
+            "SMTP_HOST": sink.host,
+            "SMTP_PORT": str(sink.port),
+            "SMTP_STARTTLS": "0",
+            "GMAIL_ADDRESS": "docbot@example.de",
+            "GMAIL_APP_PASSWORD": "",
+            "PRAXIS_EMAIL": "praxis@example.de",
+            "OUTBOX_PATH": os.path.join(tmp, "outbox.sqlite3"),
+            "OUTBOX_DELIVERY": delivery,
+            "DIGEST_WINDOW": str(digest_window),
+            "DIGEST_MAX_SIZE": str(digest_size),
+            "OUTBOX_POLL_INTERVAL": "0.2",
+        })
+        from chatbot import chat
+        from chatbot_cloud import chat_cloud
+        from extract_info import extract_appointment_info
+
+        entrypoints = {"chat": chat, "chat_cloud": chat_cloud}
+        turns = {name: [] for name in entrypoints}
+        extraction_latencies = []
+        bookings = {}  # Kontakt -> (Start, Bestätigung)
+
+        def _patient(i):
+            name = "chat" if i % 2 else "chat_cloud"
+            messages, contact = _load_patient(i, *corpus[i])
+            history, awaiting, state = [], False, {}
+            started = time.perf_counter()
+            for message in messages:
+                start = time.perf_counter()
+                response, history, awaiting_after = entrypoints[name](message, history, awaiting, state)
+                turns[name].append(time.perf_counter() - start)
+                if awaiting and not history:
+                    bookings[contact] = (started, time.perf_counter())
+                awaiting = awaiting_after
+
+        def _extraction(i):
+            start = time.perf_counter()
+            extract_appointment_info(corpus[i][0])
+            extraction_latencies.append(time.perf_counter() - start)
+
+        jobs = [(_patient, i) for i in range(patients)] + [(_extraction, i) for i in range(extractions)]
+        random.Random(seed).shuffle(jobs)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(job, i) for job, i in jobs]:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        def _delivered():
+            texts = [text for _, text in sink.messages]
+            return sum(1 for contact in bookings if any(contact in text for text in texts))
+
+        # Digest: die letzten Buchungen warten bis zum Ablauf des Fensters
+        deadline = time.perf_counter() + delivery_timeout + (digest_window if delivery == "digest" else 0)
+        while _delivered() < len(bookings) and time.perf_counter() < deadline:
+            time.sleep(0.05)
+
+        booking_times, delivery_times = [], []
+        for contact, (started, confirmed) in bookings.items():
+            booking_times.append(confirmed - started)
+            received = [at for at, text in sink.messages if contact in text]
+            if received:
+                delivery_times.append(min(received) - started)
+
+    all_turns = [latency for values in turns.values() for latency in values]
+    return {
+        "patients": patients,
+        "extractions": extractions,
+        "concurrency": concurrency,
+        "fake_latency_s": latency,
+        "fake_jitter_s": jitter,
+        "elapsed_s": round(elapsed, 3),
+        "turns": len(all_turns),
+        "turns_per_s": round(len(all_turns) / elapsed, 2),
+        "turn_latency": _latency_summary(all_turns),
+        "turn_latency_by_entrypoint": {name: _latency_summary(values) for name, values in turns.items() if values},
+        "extraction_latency": _latency_summary(extraction_latencies) if extraction_latencies else {},
+        "bookings_confirmed": len(bookings),
+        "bookings_per_s": round(len(bookings) / elapsed, 2),
+        "booking_time": _latency_summary(booking_times) if booking_times else {},
+        "delivery": delivery,
+        "emails_received": len(sink.messages),
+        "bookings_per_email": round(len(delivery_times) / len(sink.messages), 2) if sink.messages else 0.0,
+        "smtp_sessions": sink.sessions,
+        "end_to_end_delivery": _latency_summary(delivery_times) if delivery_times else {},
+    }
+
+
+def bench_telemetry(conversations=200, seed=42, spans_file=None):
+    """
+    Kosten der Instrumentierung pro Turn: Telemetrie aus vs. an
+    (FakeBackend ohne Latenz, damit nur der Overhead übrig bleibt)
+    """
+    import os
+
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ["FAKE_LATENCY"] = "0"
+    os.environ["FAKE_JITTER"] = "0"
+    import telemetry
+    from chatbot import chat
+
+    corpus = synthetic_corpus(conversations, seed)
+
+    def _run():
+        turns = 0
+        start = time.perf_counter()
+        for history, _ in corpus:
+            conversation, state = [], {}
+            # Ohne Bestätigung, damit nur Chat-Turns gemessen werden
+            for message in _patient_messages(history)[:-1]:
+                _, conversation, _ = chat(message, conversation, False, state)
+                turns += 1
+        return (time.perf_counter() - start) / turns, turns
+
+    _run()  # Aufwärmen (Imports, Caches)
+    telemetry.enable(False)
+    disabled, turns = _run()
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        with telemetry.span("noop"):
+            pass
+    noop = (time.perf_counter() - start) / n
+    telemetry.enable(True, spans_file)
+    telemetry.get_metrics().reset()
+    enabled, _ = _run()
+    telemetry.enable(False)
+
+    stages = {}
+    for (name, labels), counts in telemetry.get_metrics().histograms.items():
+        if name == "docbot_stage_duration_seconds":
+            calls = sum(counts[:-1])
+            stages[dict(labels)["stage"]] = {"calls": calls, "mean_us": round(counts[-1] / calls * 1e6, 2)}
+    return {
+        "turns": turns,
+        "disabled_per_turn_us": round(disabled * 1e6, 2),
+        "enabled_per_turn_us": round(enabled * 1e6, 2),
+        "overhead_per_turn_us": round((enabled - disabled) * 1e6, 2),
+        "disabled_span_ns": round(noop * 1e9, 1),
+        "stages": stages,
+    }
+
+
+class NoisyJSONBackend:
+    """
+    Simuliertes Extraktionsmodell: antwortet mit den Soll-Daten, aber mit den
+    typischen Fehlern kleiner Modelle ohne Schema (Markdown-Block, Komma am
+    Ende, bei max_tokens abgeschnitten, falsches Feldformat, gar kein JSON)
+    """
+    name = "noisy"
+
+    # (Anteil, Fehlerart)
+    FAULTS = [(0.55, None), (0.12, "fence"), (0.08, "trailing_comma"), (0.12, "truncated"),
+              (0.08, "bad_field"), (0.05, "prose")]
+
+    def __init__(self, seed=0):
+        self._rng = random.Random(seed)
+        self.truth = {}
+        self.calls = 0
+
+    def _fault(self):
+        roll, total = self._rng.random(), 0.0
+        for share, fault in self.FAULTS:
+            total += share
+            if roll < total:
+                return fault
+        return None
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        self.calls += 1
+        fields = list(schema["properties"]) if schema else list(self.truth)
+        data = {field: self.truth.get(field) for field in fields}
+        fault = self._fault()
+        if fault == "bad_field":
+            field = self._rng.choice(fields)
+            data[field] = ["?"] if field != "patient_email" else "keine Angabe"
+        text = json.dumps(data, ensure_ascii=False, indent=1)
+        if fault == "fence":
+            text = f"Hier sind die Daten:\n```json\n{text}\n```"
+        elif fault == "trailing_comma":
+            text = text[:text.rfind("\n}")] + ",\n}"
+        elif fault == "truncated":
+            text = text[:self._rng.randint(len(text) // 3, len(text) - 2)]
+        elif fault == "prose":
+            text = "Der Patient möchte einen Termin, die Daten stehen oben."
+        return text
+
+
+def _legacy_extract_json(conversation_text, backend, count):
+    # Bisher: json.loads auf die rohe Antwort, bei Fehler alles noch einmal
+    from extract_info import EXTRACTION_PROMPT
+
+    prompt = EXTRACTION_PROMPT.format(conversation=conversation_text)
+    for attempt in range(2):
+        text = backend.generate_json(prompt, max_tokens=512)
+        count(prompt, text)
+        try:
+            return json.loads(text), attempt
+        except ValueError:
+            continue
+    return None, 2
+
+
+def bench_json(n=500, seed=42):
+    """
+    Parse-Fehlerquote und Token-Verbrauch der LLM-Extraktion: json.loads plus
+    komplette Wiederholung (alt) vs. Reparatur plus Nachfrage nur der
+    ungültigen Felder (neu), gegen ein simuliertes fehleranfälliges Modell
+    """
+    import extract_info
+    from context_window import count_tokens
+
+    corpus = synthetic_corpus(n, seed)
+    tokens = {"legacy": 0, "schema": 0}
+
+    class _Counting:
+        # Zählt Prompt- und Antwort-Tokens der neuen Extraktion mit
+        name = "noisy"
+
+        def __init__(self, backend):
+            self.backend = backend
+
+        def generate_json(self, prompt, max_tokens=256, schema=None):
+            text = self.backend.generate_json(prompt, max_tokens, schema)
+            tokens["schema"] += count_tokens(prompt) + count_tokens(text)
+            return text
+
+    def _count_legacy(prompt, text):
+        tokens["legacy"] += count_tokens(prompt) + count_tokens(text)
+
+    legacy_backend, schema_backend = NoisyJSONBackend(seed), NoisyJSONBackend(seed)
+    counting = _Counting(schema_backend)
+    legacy = {"first_try_failures": 0, "failures_after_retry": 0, "retries": 0}
+    correct = {"legacy": 0, "schema": 0}
+    fields = 0
+
+    extract_info.reset_extraction_stats()
+    for history, truth in corpus:
+        full_truth = {**extract_info.empty_record(), **truth}
+        legacy_backend.truth = schema_backend.truth = full_truth
+        text = extract_info.format_conversation(history)
+
+        data, attempts = _legacy_extract_json(text, legacy_backend, _count_legacy)
+        legacy["first_try_failures"] += attempts > 0
+        legacy["retries"] += min(attempts, 1)
+        legacy["failures_after_retry"] += data is None
+        # Alter Fallback: alles null
+        data = data or {}
+
+        try:
+            new = extract_info.extract_appointment_info(history, use_rules=False, backend=counting, strict=True)
+        except ValueError:
+            new = {}
+
+        for field, expected in truth.items():
+            fields += 1
+            correct["legacy"] += field_correct(field, data.get(field), expected)
+            correct["schema"] += field_correct(field, new.get(field), expected)
+
+    stats = extract_info.extraction_stats()
+    return {
+        "conversations": n,
+        "legacy": {
+            "parse_failure_rate": round(legacy["first_try_failures"] / n, 4),
+            "failure_rate_after_full_retry": round(legacy["failures_after_retry"] / n, 4),
+            "full_retries": legacy["retries"],
+            "tokens": tokens["legacy"],
+            "field_accuracy": round(correct["legacy"] / fields, 4),
+        },
+        "schema": {
+            "raw_parse_failure_rate": stats["raw_failure_rate"],
+            "parse_failure_rate_after_repair": stats["failure_rate"],
+            "responses": stats["responses"],
+            "repaired": stats["repaired"],
+            "field_retries": stats["retries"],
+            "retried_fields": stats["retried_fields"],
+            "unresolved_fields": stats["unresolved_fields"],
+            "tokens": tokens["schema"],
+            "field_accuracy": round(correct["schema"] / fields, 4),
+        },
+        "tokens_saved": tokens["legacy"] - tokens["schema"],
+        "tokens_saved_pct": round(1 - tokens["schema"] / tokens["legacy"], 4),
+    }
+
+
+def _legacy_build_message(appointment_data, sender_email, receiver_email):
+    # Bisheriges build_appointment_message: HTML-f-String pro Email, ohne Escaping
+    from datetime import datetime
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    # HTML Email (schön formatiert)
+    html_content = f"""
+    <html>
+    <head>
+        <style>
+            body {{ 
+                font-family: Arial, sans-serif; 
+                line-height: 1.6; 
+                color: #333;
+            }}
+            .header {{ 
+                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+                color: white; 
+                padding: 20px; 
+                border-radius: 8px 8px 0 0;
+            }}
+            .content {{ 
+                padding: 20px; 
+                background: #ffffff;
+            }}
+            .info-box {{ 
+                background: #f5f5f5; 
+                padding: 15px; 
+                margin: 10px 0; 
+                border-left: 4px solid #667eea; 
+                border-radius: 4px;
+            }}
+            .label {{ 
+                font-weight: bold; 
+                color: #667eea; 
+            }}
+            .footer {{
+                margin-top: 30px;
+                padding-top: 20px;
+                border-top: 1px solid #ddd;
+                color: #666;
+                font-size: 12px;
+            }}
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h2>Neue Terminanfrage</h2>
+            <p>Eingegangen am {datetime.now().strftime('%d.%m.%Y um %H:%M Uhr')}</p>
+        </div>
+
+        <div class="content">
+            <h3>Patienteninformationen:</h3>
+            <div class="info-box">
+                <p><span class="label">Name:</span> {appointment_data.get('patient_name') or 'Nicht angegeben'}</p>
+                <p><span class="label">Email:</span> {appointment_data.get('patient_email') or 'Nicht angegeben'}</p>
+                <p><span class="label">Telefon:</span> {appointment_data.get('patient_phone') or 'Nicht angegeben'}</p>
+            </div>
+
+            <h3>Termindetails:</h3>
+            <div class="info-box">
+                <p><span class="label">Terminwunsch:</span> {appointment_data.get('appointment_request') or 'Nicht spezifiziert'}</p>
+                <p><span class="label">Grund:</span> {appointment_data.get('reason') or 'Nicht angegeben'}</p>
+            </div>
+
+            {f'<h3>Zusätzliche Notizen:</h3><div class="info-box"><p>{appointment_data.get("notes")}</p></div>' if appointment_data.get('notes') else ''}
+
+            <div class="footer">
+                <p>Diese Anfrage wurde automatisch vom virtuellen Praxis-Assistenten erstellt.</p>
+                <p>Bitte kontaktieren Sie den Patienten zeitnah.</p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+
+    # Plain-Text Fallback
+    text_content = f"""
+NEUE TERMINANFRAGE - {datetime.now().strftime('%d.%m.%Y %H:%M Uhr')}
+
+PATIENTENINFORMATIONEN:
+Name: {appointment_data.get('patient_name') or 'Nicht angegeben'}
+Email: {appointment_data.get('patient_email') or 'Nicht angegeben'}
+Telefon: {appointment_data.get('patient_phone') or 'Nicht angegeben'}
+
+TERMINDETAILS:
+Terminwunsch: {appointment_data.get('appointment_request') or 'Nicht spezifiziert'}
+Grund: {appointment_data.get('reason') or 'Nicht angegeben'}
+Notizen: {appointment_data.get('notes') or 'Keine'}
+
+---
+Automatisch erstellt vom Praxis-Assistenten
+Bitte kontaktieren Sie den Patienten zeitnah
+    """
+
+    # Email zusammenbauen
+    message = MIMEMultipart("alternative")
+    message["Subject"] = f"Terminanfrage: {appointment_data.get('patient_name', 'Neuer Patient')}"
+    message["From"] = f"Praxis-Assistent <{sender_email}>"
+    message["To"] = receiver_email
+
+    # Text und HTML anhängen
+    part1 = MIMEText(text_content, "plain", "utf-8")
+    part2 = MIMEText(html_content, "html", "utf-8")
+    message.attach(part1)
+    message.attach(part2)
+
+    return message
+
+
+def bench_templates(n=5000, digest_size=20, seed=42):
+    """
+    Render-Durchsatz: alter f-String vs. vorkompilierte Vorlagen,
+    jeweils nur Text+HTML und als fertige MIME-Nachricht, plus Digest
+    """
+    from email_sender import build_appointment_message, build_digest_message
+    from email_templates import render_appointment, render_digest
+
+    records = [{**truth, "notes": None} for _, truth in synthetic_corpus(n, seed)]
+    records[0]["notes"] = "Angst vor dem Bohren"
+
+    def _rate(render, items):
+        start = time.perf_counter()
+        for item in items:
+            render(item)
+        elapsed = time.perf_counter() - start
+        return {"per_s": round(len(items) / elapsed), "us_each": round(elapsed / len(items) * 1e6, 2)}
+
+    digests = [records[i:i + digest_size] for i in range(0, n - digest_size + 1, digest_size)]
+    return {
+        "emails": n,
+        "legacy_mime": _rate(lambda data: _legacy_build_message(data, "a@example.de", "b@example.de"), records),
+        "compiled_render": _rate(render_appointment, records),
+        "compiled_mime": _rate(lambda data: build_appointment_message(data, "a@example.de", "b@example.de"), records),
+        "compiled_mime_as_string": _rate(
+            lambda data: build_appointment_message(data, "a@example.de", "b@example.de").as_string(), records
+        ),
+        "legacy_mime_as_string": _rate(
+            lambda data: _legacy_build_message(data, "a@example.de", "b@example.de").as_string(), records
+        ),
+        "digest_size": digest_size,
+        "digest_render": _rate(render_digest, digests),
+        "digest_mime": _rate(lambda batch: build_digest_message(batch, "a@example.de", "b@example.de"), digests),
+    }
+
+
+def _summary_backend(latency):
+    """
+    FakeBackend, das auf Wunsch (summarize=True) nach der Weiterleitung fragt
+    und bei gesetztem extracted diesen Datensatz als Extraktion liefert
+    """
+    from llm_backends import FakeBackend
+
+    class SummaryBackend(FakeBackend):
+        summarize = False
+        extracted = None
+
+        def _reply(self, messages):
+            if self.summarize:
+                return "Vielen Dank, ich habe alles notiert. Soll ich diese Anfrage weiterleiten?"
+            return "Vielen Dank! Was kann ich noch notieren?"
+
+        def generate_json(self, prompt, max_tokens=256, schema=None):
+            reply = super().generate_json(prompt, max_tokens, schema)
+            return json.dumps(self.extracted, ensure_ascii=False) if self.extracted else reply
+
+    return SummaryBackend(latency=latency)
+
+
+def _incomplete_conversations(n, seed, incomplete=True):
+    # Kleingeschriebener Name: die Regeln verpassen ihn, die Bestätigung muss extrahieren.
+    # incomplete=False: nur Konversationen, bei denen die Regeln den Namen finden
+    rng = random.Random(seed)
+    corpus = []
+    while len(corpus) < n:
+        history, truth = synthetic_conversation(rng)
+        if history[2]["content"].startswith("hier ist") == incomplete:
+            corpus.append((_patient_messages(history), truth))
+    return corpus
+
+
+def bench_speculation(n=20, latency=0.2, think=0.5, seed=42):
+    """
+    Latenz des Bestätigungs-Turns mit und ohne spekulative Extraktion, getrennt
+    nach Konversationen, bei denen die Regeln den Namen verpassen
+    (kleingeschrieben, nach dem "ja" ist noch zu extrahieren), und solchen, bei
+    denen sie ihn finden (Spekulation startet trotzdem mit der Bestätigungsfrage)
+    """
+    import os
+    import tempfile
+
+    os.environ["OUTBOX_PATH"] = os.path.join(tempfile.mkdtemp(), "outbox.sqlite3")
+    import chat_core
+    import dedup
+    import outbox
+    import speculation
+
+    # Versand ist hier nicht Gegenstand der Messung
+    outbox.start_worker = lambda: None
+    chat_core.start_worker = outbox.start_worker
+    sent = []
+    send_request = chat_core._send_request
+
+    def _capture(record, *args):
+        sent.append(record)
+        return send_request(record, *args)
+
+    chat_core._send_request = _capture
+
+    backend = _summary_backend(latency)
+    corpora = {
+        "name_missed": _incomplete_conversations(n, seed),
+        "name_found": _incomplete_conversations(n, seed, incomplete=False),
+    }
+
+    # Sonst beantwortet die Dedup-Schicht die zweite Runde ohne Extraktion
+    dedup.enable(False)
+    results = {}
+    try:
+        for name, corpus in corpora.items():
+            results[name] = {}
+            for enabled in (False, True):
+                speculation.enable(enabled)
+                hits = speculation.get_speculator().stats["hits"]
+                summary_turns, confirmation_turns = [], []
+                del sent[:]
+                for messages, _ in corpus:
+                    history, awaiting, state = [], False, {}
+                    for i, message in enumerate(messages[:-1]):
+                        backend.summarize = i == len(messages) - 2
+                        start = time.perf_counter()
+                        _, history, awaiting = chat_core.run_turn(backend, message, history, awaiting, state)
+                    summary_turns.append(time.perf_counter() - start)
+                    if not awaiting:
+                        continue
+                    time.sleep(think)  # Patient liest die Zusammenfassung
+                    start = time.perf_counter()
+                    chat_core.run_turn(backend, messages[-1], history, awaiting, state)
+                    confirmation_turns.append(time.perf_counter() - start)
+                results[name]["speculative" if enabled else "sequential"] = {
+                    "summary_turn": _latency_summary(summary_turns),
+                    "confirmation_turn": _latency_summary(confirmation_turns),
+                    "speculation_hits": speculation.get_speculator().stats["hits"] - hits,
+                    "fields_sent_mean": round(statistics.mean(
+                        sum(1 for value in record.values() if value) for record in sent
+                    ), 2) if sent else 0,
+                }
+    finally:
+        chat_core._send_request = send_request
+        dedup.enable(True)
+    return {"conversations": n, "fake_latency_s": latency, "think_s": think, **results,
+            "speculation": speculation.metrics()}
+
+
+def bench_deadlines(turns=50, slow=2.0, fast=0.05, deadline=0.3, seed=42):
+    """
+    Async-Pipeline gegen ein hängendes Modell (FakeBackend mit slow Sekunden):
+    Fallback auf ein schnelles Backend, fester Text ohne Fallback, Abbruch
+    laufender Turns - jeweils turns gleichzeitige Erstnachrichten
+    """
+    import asyncio
+
+    import chat_core
+    from llm_backends import FakeBackend
+
+    chat_core.DEADLINE_LLM = deadline
+    chat_core.DEADLINE_FALLBACK = deadline
+    chat_core.DEADLINE_EXTRACTION = deadline
+    logging.getLogger("chat_core").setLevel(logging.ERROR)
+    corpus = synthetic_corpus(turns, seed)
+    # Zweiter Turn (Name), damit weder FAQ noch Antwort-Cache greifen
+    messages = [(history[:2], history[2]["content"]) for history, _ in corpus]
+
+    async def _turns(primary, fallback):
+        async def _one(message):
+            start = time.perf_counter()
+            response, _, _ = await chat_core.arun_turn(primary, message[1], list(message[0]), False, {}, fallback)
+            return time.perf_counter() - start, response
+
+        return await asyncio.gather(*[_one(message) for message in messages])
+
+    def _summary(results):
+        latencies = [latency for latency, _ in results]
+        canned = sum(1 for _, response in results if response == chat_core.DEADLINE_RESPONSE)
+        return {**_latency_summary(latencies), "canned_replies": canned, "model_replies": len(results) - canned}
+
+    async def _cancel():
+        primary = FakeBackend(latency=slow)
+        tasks = [
+            asyncio.ensure_future(chat_core.arun_turn(primary, message, list(history), False, {}))
+            for history, message in messages
+        ]
+        await asyncio.sleep(deadline / 3)
+        start = time.perf_counter()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {
+            "cancelled": sum(1 for task in tasks if task.cancelled()),
+            "cancel_ms": round((time.perf_counter() - start) * 1000, 3),
+        }
+
+    start = time.perf_counter()
+    chat_core.run_turn(FakeBackend(latency=slow), messages[0][1], list(messages[0][0]), False, {})
+    sync_single = time.perf_counter() - start
+
+    return {
+        "turns": turns,
+        "slow_model_s": slow,
+        "deadline_s": deadline,
+        "sync_single_turn_s": round(sync_single, 3),
+        "fallback": _summary(asyncio.run(_turns(FakeBackend(latency=slow), FakeBackend(latency=fast)))),
+        "no_fallback": _summary(asyncio.run(_turns(FakeBackend(latency=slow), None))),
+        "healthy": _summary(asyncio.run(_turns(FakeBackend(latency=fast), None))),
+        "cancellation": asyncio.run(_cancel()),
+    }
+
+
+def _tail_backend(latency, tail=0.0, tail_rate=0.0, fail_rate=0.0, seed=0):
+    """
+    FakeBackend mit seltenen Ausreißern (tail Sekunden mit Wahrscheinlichkeit tail_rate)
+    """
+    from llm_backends import FakeBackend
+
+    class TailBackend(FakeBackend):
+        def _delay(self):
+            delay, fail = super()._delay()
+            with self._lock:
+                if self._rng.random() < tail_rate:
+                    delay += tail
+            return delay, fail
+
+    return TailBackend(latency=latency, jitter=latency * 0.2, seed=seed, fail_rate=fail_rate)
+
+
+def bench_router(n=400, concurrency=8, latency=0.05, tail=1.0, tail_rate=0.02, seed=42):
+    """
+    Router gegen FakeBackends mit Ausreißern und Ausfällen: ein Backend
+    allein, Router ohne/mit Hedging (sync und async) und Circuit Breaker
+    bei einem dauerhaft fehlerhaften Backend
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from router import RouterBackend
+
+    logging.getLogger("router").setLevel(logging.ERROR)
+    messages = [{"role": "user", "content": "Hallo, ich brauche einen Termin"}]
+
+    def _run(backend):
+        latencies, errors = [], 0
+
+        def _one(_):
+            nonlocal errors
+            start = time.perf_counter()
+            try:
+                backend.chat(messages)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(_one, range(n)))
+        return {**_latency_summary(latencies), "errors": errors}
+
+    def _arun(backend):
+        latencies = []
+
+        async def _one(semaphore):
+            async with semaphore:
+                start = time.perf_counter()
+                await backend.achat(messages)
+                latencies.append(time.perf_counter() - start)
+
+        async def _all():
+            semaphore = asyncio.Semaphore(concurrency)
+            await asyncio.gather(*[_one(semaphore) for _ in range(n)])
+
+        asyncio.run(_all())
+        return _latency_summary(latencies)
+
+    def _pair(seed_offset):
+        # Schnell mit Ausreißern vs. doppelt so langsam, aber gleichmäßig
+        return [_tail_backend(latency, tail, tail_rate, seed=seed + seed_offset),
+                _tail_backend(latency * 2, seed=seed + seed_offset + 1)]
+
+    results = {"requests": n, "concurrency": concurrency, "latency_s": latency, "tail_s": tail,
+               "tail_rate": tail_rate}
+    results["single_backend"] = _run(_tail_backend(latency, tail, tail_rate, seed=seed))
+
+    router = RouterBackend(_pair(10), hedge=False)
+    results["router_no_hedge"] = {**_run(router), **router.counters}
+
+    router = RouterBackend(_pair(20), hedge=True)
+    results["router_hedge"] = {**_run(router), **router.counters}
+
+    router = RouterBackend(_pair(30), hedge=True)
+    results["router_hedge_async"] = {**_arun(router), **router.counters}
+
+    broken = _tail_backend(latency / 5, fail_rate=1.0, seed=seed + 40)
+    router = RouterBackend([broken, _tail_backend(latency, seed=seed + 41)], hedge=True, failures=5, cooldown=60)
+    results["circuit_breaker"] = {
+        **_run(router),
+        **router.counters,
+        "calls_to_broken_backend": broken.calls,
+        "broken_backend": router.snapshot()["backends"]["fake"],
+    }
+    return results
+
+
+def bench_ratelimit(seconds=60, abuser_rate=10.0, users=20, user_interval=15.0, turns=64, max_concurrency=4,
+                    queue=16, latency=0.2, queue_timeout=1.0, seed=42):
+    """
+    Zugangskontrolle: Token-Buckets mit simulierter Uhr (ein Skript gegen
+    normale Nutzer) und die globale Modell-Schlange mit gleichzeitigen
+    Turns gegen ein FakeBackend (sync und async)
+    """
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    import chat_core
+    import rate_limit
+    from llm_backends import FakeBackend
+
+    rng = random.Random(seed)
+
+    class FakeClock:
+        now = 0.0
+
+        def __call__(self):
+            return self.now
+
+    clock = FakeClock()
+    sessions = rate_limit.KeyedLimiter(rate_limit.RATE_LIMIT_SESSION_RATE, rate_limit.RATE_LIMIT_SESSION_BURST,
+                                       clock=clock)
+    ips = rate_limit.KeyedLimiter(rate_limit.RATE_LIMIT_IP_RATE, rate_limit.RATE_LIMIT_IP_BURST, clock=clock)
+
+    # (Zeitpunkt, Client): das Skript feuert gleichmäßig, Nutzer mit Lesepausen
+    events = [(i / abuser_rate, "abuser") for i in range(int(seconds * abuser_rate))]
+    for user in range(users):
+        at = rng.uniform(0, user_interval)
+        while at < seconds:
+            events.append((at, f"user{user}"))
+            at += rng.uniform(0.5, 1.5) * user_interval
+    events.sort()
+    buckets = {"abuser": [0, 0], "users": [0, 0]}
+    for at, client in events:
+        clock.now = at
+        admitted = not ips.check(f"ip-{client}") and not sessions.check(f"session-{client}")
+        buckets["abuser" if client == "abuser" else "users"][0 if admitted else 1] += 1
+
+    class CountingBackend(FakeBackend):
+        def __init__(self):
+            super().__init__(latency=latency)
+            self.in_flight = self.peak = 0
+            self._count_lock = threading.Lock()
+
+        def _enter(self):
+            with self._count_lock:
+                self.in_flight += 1
+                self.peak = max(self.peak, self.in_flight)
+
+        def _exit(self):
+            with self._count_lock:
+                self.in_flight -= 1
+
+        def chat(self, *args, **kwargs):
+            self._enter()
+            try:
+                return super().chat(*args, **kwargs)
+            finally:
+                self._exit()
+
+        async def achat(self, *args, **kwargs):
+            self._enter()
+            try:
+                return await super().achat(*args, **kwargs)
+            finally:
+                self._exit()
+
+    logging.getLogger("chat_core").setLevel(logging.ERROR)
+    corpus = synthetic_corpus(turns, seed)
+    # Zweiter Turn (Name), damit weder FAQ noch Antwort-Cache greifen
+    messages = [(history[:2], history[2]["content"]) for history, _ in corpus]
+
+    def _summary(results, backend):
+        rejected = sum(1 for _, response in results if response == rate_limit.RATE_LIMITED_RESPONSE)
+        served = [latency for latency, response in results if response != rate_limit.RATE_LIMITED_RESPONSE]
+        return {**(_latency_summary(served) if served else {}), "served": len(served), "rejected": rejected,
+                "peak_model_calls": backend.peak}
+
+    def _sync():
+        backend = CountingBackend()
+
+        def _one(message):
+            start = time.perf_counter()
+            response, _, _ = chat_core.run_turn(backend, message[1], list(message[0]), False, {})
+            return time.perf_counter() - start, response
+
+        with ThreadPoolExecutor(max_workers=turns) as pool:
+            return _summary(list(pool.map(_one, messages)), backend)
+
+    def _async():
+        backend = CountingBackend()
+
+        async def _one(message):
+            start = time.perf_counter()
+            response, _, _ = await chat_core.arun_turn(backend, message[1], list(message[0]), False, {})
+            return time.perf_counter() - start, response
+
+        async def _all():
+            return await asyncio.gather(*[_one(message) for message in messages])
+
+        return _summary(asyncio.run(_all()), backend)
+
+    def _limited(run):
+        rate_limit._model_limiter = rate_limit.ConcurrencyLimiter(max_concurrency, queue, queue_timeout)
+        result = run()
+        result["max_queue_depth"] = rate_limit._model_limiter.stats["max_queue_depth"]
+        return result
+
+    rate_limit.enable(False)
+    unlimited = _sync()
+    rate_limit.enable(True)
+    return {
+        "simulated_s": seconds,
+        "buckets": {
+            "abuser_admitted": buckets["abuser"][0],
+            "abuser_rejected": buckets["abuser"][1],
+            "users_admitted": buckets["users"][0],
+            "users_rejected": buckets["users"][1],
+        },
+        "turns": turns,
+        "max_concurrency": max_concurrency,
+        "queue": queue,
+        "unlimited": unlimited,
+        "limited_sync": _limited(_sync),
+        "limited_async": _limited(_async),
+    }
+
+
+def bench_dedup(n=20, latency=0.05, seed=42):
+    """
+    Doppelte Bestätigungen derselben Buchung mit und ohne Dedup-Schicht:
+    zwei gleichzeitige "ja" (Doppelklick), ein wiederholter Request mit
+    altem Stand (Client-Retry) und dieselbe Buchung aus einer neuen Session
+    """
+    import copy
+    import os
+    import sqlite3
+    import tempfile
+    from concurrent.futures import ThreadPoolExecutor
+
+    tmp = tempfile.mkdtemp()
+    os.environ["OUTBOX_PATH"] = os.path.join(tmp, "outbox.sqlite3")
+    import chat_core
+    import dedup
+    import outbox
+    import speculation
+
+    # Gezählt werden Outbox-Einträge, nicht Emails
+    outbox.start_worker = lambda: None
+    chat_core.start_worker = outbox.start_worker
+    # Extraktion soll in der Bestätigung passieren, nicht vorab im Hintergrund
+    speculation.enable(False)
+
+    backend = _summary_backend(latency)
+    corpus = _incomplete_conversations(n, seed)
+
+    def _summarized(messages):
+        # Laufende Updates finden den Namen nicht, erst die Bestätigung extrahiert ihn
+        backend.extracted = None
+        history, awaiting, state = [], False, {}
+        for i, message in enumerate(messages[:-1]):
+            backend.summarize = i == len(messages) - 2
+            _, history, awaiting = chat_core.run_turn(backend, message, history, awaiting, state)
+        return history, awaiting, state
+
+    def _confirm(message, snapshot, truth):
+        history, awaiting, state = copy.deepcopy(snapshot)
+        backend.extracted = truth
+        calls = backend.calls
+        start = time.perf_counter()
+        chat_core.run_turn(backend, message, history, awaiting, state)
+        return time.perf_counter() - start, backend.calls - calls
+
+    results = {}
+    for enabled in (False, True):
+        dedup.enable(enabled)
+        dedup._index = dedup.DedupIndex(is_failed=dedup._outbox_failed)
+        outbox.OUTBOX_PATH = os.path.join(tmp, f"outbox-{enabled}.sqlite3")
+        confirmations, latencies, extraction_calls = 0, [], 0
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            for messages, truth in corpus:
+                snapshot = _summarized(messages)
+                if not snapshot[1]:
+                    continue
+                # Doppelklick, dann Client-Retry mit dem alten Stand
+                runs = list(pool.map(_confirm, [messages[-1]] * 2, [snapshot] * 2, [truth] * 2))
+                runs.append(_confirm(messages[-1], snapshot, truth))
+                # Dieselbe Buchung mit anderer Begrüßung in neuer Session
+                replay = [f"Guten Tag! {messages[0]}"] + messages[1:]
+                runs.append(_confirm(replay[-1], _summarized(replay), truth))
+                confirmations += len(runs)
+                latencies += [latency for latency, _ in runs]
+                extraction_calls += sum(calls for _, calls in runs)
+        with sqlite3.connect(outbox.OUTBOX_PATH) as conn:
+            queued = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        results["dedup" if enabled else "no_dedup"] = {
+            "confirmations": confirmations,
+            "outbox_entries": queued,
+            "extraction_calls": extraction_calls,
+            "confirmation_turn": _latency_summary(latencies),
+        }
+    results["index"] = dedup.metrics()
+    return {"bookings": n, "fake_latency_s": latency, **results}
+
+
+# Module, die beim Start nicht geladen sein sollen (erst beim ersten Aufruf)
+DEFERRED_IMPORTS = ("asyncio", "smtplib", "ssl", "email.mime.multipart", "ollama", "huggingface_hub", "httpx",
+                    "tiktoken", "email_sender")
+
+
+def _import_profile(module):
+    """
+    Ein frischer Interpreter mit -X importtime: (Import-Zeit des Moduls in s,
+    Wandzeit des Prozesses in s, {Modul: Eigenzeit in s}, geladene DEFERRED_IMPORTS)
+    """
+    import os
+    import subprocess
+    import sys
+
+    code = (f"import sys; import {module}; "
+            f"print(','.join(m for m in {DEFERRED_IMPORTS!r} if m in sys.modules))")
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+    wall = time.perf_counter() - start
+
+    total, self_times = 0.0, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        if own.strip().isdigit():
+            self_times[name.strip()] = int(own) / 1e6
+            if name.strip() == module:
+                total = int(cumulative) / 1e6
+    loaded = [m for m in proc.stdout.strip().split(",") if m]
+    return total, wall, self_times, loaded
+
+
+def bench_startup(modules=("telemetry", "session_store", "chat_core", "chatbot", "chatbot_cloud"), runs=5,
+                  budget_ms=150.0, top=10):
+    """
+    Kaltstart: Import-Zeit der Chat-Module je in einem frischen Prozess
+    (Median über runs), die teuersten Einzel-Imports und ob schwere
+    Bibliotheken schon beim Import statt beim ersten Aufruf geladen werden
+    """
+    import subprocess
+    import sys
+
+    baseline = statistics.median(
+        _timed(lambda: subprocess.run([sys.executable, "-c", "pass"], check=True)) for _ in range(runs)
+    )
+    results = {}
+    for module in modules:
+        profiles = [_import_profile(module) for _ in range(runs)]
+        import_s = statistics.median(p[0] for p in profiles)
+        self_times = profiles[-1][2]
+        results[module] = {
+            "import_ms": round(import_s * 1000, 2),
+            "process_ms": round(statistics.median(p[1] for p in profiles) * 1000, 2),
+            "slowest_imports_ms": {
+                name: round(value * 1000, 2)
+                for name, value in sorted(self_times.items(), key=lambda item: -item[1])[:top]
+            },
+            "eager_heavy_imports": profiles[-1][3],
+        }
+
+    worst = max(entry["import_ms"] for entry in results.values())
+    eager = sorted({name for entry in results.values() for name in entry["eager_heavy_imports"]})
+    return {
+        "runs": runs,
+        "interpreter_ms": round(baseline * 1000, 2),
+        "modules": results,
+        "budget_ms": budget_ms,
+        "worst_import_ms": worst,
+        "eager_heavy_imports": eager,
+        "within_budget": worst <= budget_ms and not eager,
+    }
+
+
+def _timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def _patient_messages(history):
+    return [msg["content"] for msg in history if msg["role"] == "user"] + ["Ja, bitte weiterleiten"]
+
+
+def bench_api(url, conversations=100, concurrency=20, mode="cloud", seed=42):
+    """
+    Lasttest gegen api.py: parallele Patienten, jeder Turn ein POST /chat
+    """
+    import asyncio
+    import httpx
+
+    corpus = synthetic_corpus(conversations, seed)
+    latencies, errors = [], 0
+
+    async def _patient(client, history, semaphore):
+        nonlocal errors
+        async with semaphore:
+            payload = {"conversation_history": [], "awaiting_confirmation": False, "state": {}, "mode": mode}
+            for message in _patient_messages(history):
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json={**payload, "message": message})
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+                data = response.json()
+                payload.update(conversation_history=data["conversation_history"],
+                               awaiting_confirmation=data["awaiting_confirmation"], state=data["state"])
+
+    async def _run():
+        semaphore = asyncio.Semaphore(concurrency)
+        limits = httpx.Limits(max_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+            await asyncio.gather(*[_patient(client, history, semaphore) for history, _ in corpus])
+
+    start = time.perf_counter()
+    asyncio.run(_run())
+    elapsed = time.perf_counter() - start
+    return {
+        "url": url,
+        "conversations": conversations,
+        "concurrency": concurrency,
+        "turns": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "turns_per_s": round(len(latencies) / elapsed, 2),
+        **(_latency_summary(latencies) if latencies else {}),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DocBot Benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    extraction = sub.add_parser("extraction", help="Regel-Extraktor vs. LLM-Extraktion")
+    extraction.add_argument("--n", type=int, default=100)
+    extraction.add_argument("--seed", type=int, default=42)
+    extraction.add_argument("--no-llm", action="store_true", help="nur den Regel-Extraktor messen")
+
+    backends = sub.add_parser("backends", help="LLM-Backends gegeneinander messen")
+    backends.add_argument("--backends", default="ollama,hf", help="kommagetrennt, siehe llm_backends.BACKENDS")
+    backends.add_argument("--n", type=int, default=20)
+    backends.add_argument("--seed", type=int, default=42)
+
+    context = sub.add_parser("context", help="Prompt-Größe mit/ohne Kontextfenster")
+    context.add_argument("--turns", type=int, default=60)
+    context.add_argument("--seed", type=int, default=42)
+
+    prefix = sub.add_parser("prefix", help="Prompt-Eval pro Turn vor/nach Praefix-Layout (Ollama)")
+    prefix.add_argument("--patients", type=int, default=3)
+    prefix.add_argument("--gap", type=float, default=0.0, help="Sekunden Pause zwischen Patienten")
+    prefix.add_argument("--seed", type=int, default=42)
+
+    moderation = sub.add_parser("moderation", help="Inhaltsfilter: Schleife vs. Matcher")
+    moderation.add_argument("--sizes", default="12,1000,10000", help="Anzahl Begriffe, kommagetrennt")
+    moderation.add_argument("--n", type=int, default=2000)
+    moderation.add_argument("--seed", type=int, default=42)
+
+    slots = sub.add_parser("slots", help="Vollständigkeits-Check: Rescan vs. Slot-Tracker")
+    slots.add_argument("--turns", type=int, default=200)
+    slots.add_argument("--seed", type=int, default=42)
+
+    sessions = sub.add_parser("sessions", help="Speicher pro Session: Dict-Listen vs. Session-Store")
+    sessions.add_argument("--sessions", type=int, default=1000)
+    sessions.add_argument("--seed", type=int, default=42)
+
+    load = sub.add_parser("load", help="Lasttest Buchungsablauf mit FakeBackend und lokaler SMTP-Senke")
+    load.add_argument("--patients", type=int, default=200)
+    load.add_argument("--concurrency", type=int, default=20)
+    load.add_argument("--latency", type=float, default=0.2, help="Fake-LLM-Latenz in Sekunden")
+    load.add_argument("--jitter", type=float, default=0.1, help="zusätzliche zufällige Latenz (0..jitter)")
+    load.add_argument("--extractions", type=int, default=100)
+    load.add_argument("--delivery", default="immediate", choices=["immediate", "digest"])
+    load.add_argument("--digest-window", type=float, default=5.0, help="Sekunden bis zum Digest-Versand")
+    load.add_argument("--digest-size", type=int, default=20, help="Buchungen pro Digest höchstens")
+    load.add_argument("--seed", type=int, default=42)
+
+    tele = sub.add_parser("telemetry", help="Overhead der Spans/Metriken pro Chat-Turn")
+    tele.add_argument("--conversations", type=int, default=200)
+    tele.add_argument("--spans-file", help="Spans zusätzlich als JSONL schreiben")
+    tele.add_argument("--seed", type=int, default=42)
+
+    json_parser = sub.add_parser("json", help="JSON-Extraktion: Parse-Fehler und Tokens alt vs. Schema+Reparatur")
+    json_parser.add_argument("--n", type=int, default=500)
+    json_parser.add_argument("--seed", type=int, default=42)
+
+    templates = sub.add_parser("templates", help="Email-Rendering: f-String vs. kompilierte Vorlagen")
+    templates.add_argument("--n", type=int, default=5000)
+    templates.add_argument("--digest-size", type=int, default=20)
+    templates.add_argument("--seed", type=int, default=42)
+
+    spec = sub.add_parser("speculation", help="Bestätigungs-Turn mit/ohne spekulative Extraktion")
+    spec.add_argument("--n", type=int, default=20)
+    spec.add_argument("--latency", type=float, default=0.2, help="Fake-LLM-Latenz in Sekunden")
+    spec.add_argument("--think", type=float, default=0.5, help="Lesezeit des Patienten vor dem \"ja\"")
+    spec.add_argument("--seed", type=int, default=42)
+
+    deadlines = sub.add_parser("deadlines", help="Async-Pipeline: Fristen, Fallback und Abbruch bei hängendem Modell")
+    deadlines.add_argument("--turns", type=int, default=50)
+    deadlines.add_argument("--slow", type=float, default=2.0, help="Latenz des hängenden Modells in Sekunden")
+    deadlines.add_argument("--fast", type=float, default=0.05, help="Latenz des Fallbacks in Sekunden")
+    deadlines.add_argument("--deadline", type=float, default=0.3, help="Frist pro Stufe in Sekunden")
+    deadlines.add_argument("--seed", type=int, default=42)
+
+    router = sub.add_parser("router", help="Router: Hedging und Circuit Breaker gegen FakeBackends")
+    router.add_argument("--n", type=int, default=400)
+    router.add_argument("--concurrency", type=int, default=8)
+    router.add_argument("--latency", type=float, default=0.05)
+    router.add_argument("--tail", type=float, default=1.0, help="Dauer eines Ausreißers in Sekunden")
+    router.add_argument("--tail-rate", type=float, default=0.02)
+    router.add_argument("--seed", type=int, default=42)
+
+    dedup_parser = sub.add_parser("dedup", help="Doppelte Bestätigungen mit/ohne Dedup-Schicht")
+    dedup_parser.add_argument("--n", type=int, default=20)
+    dedup_parser.add_argument("--latency", type=float, default=0.05)
+    dedup_parser.add_argument("--seed", type=int, default=42)
+
+    ratelimit = sub.add_parser("ratelimit", help="Rate-Limits pro Session/IP und globale Modell-Schlange")
+    ratelimit.add_argument("--seconds", type=float, default=60, help="simulierte Dauer für die Token-Buckets")
+    ratelimit.add_argument("--abuser-rate", type=float, default=10.0, help="Anfragen pro Sekunde des Skripts")
+    ratelimit.add_argument("--users", type=int, default=20)
+    ratelimit.add_argument("--turns", type=int, default=64, help="gleichzeitige Turns gegen die Modell-Schlange")
+    ratelimit.add_argument("--max-concurrency", type=int, default=4)
+    ratelimit.add_argument("--queue", type=int, default=16)
+    ratelimit.add_argument("--latency", type=float, default=0.2)
+    ratelimit.add_argument("--queue-timeout", type=float, default=1.0)
+    ratelimit.add_argument("--seed", type=int, default=42)
+
+    startup = sub.add_parser("startup", help="Kaltstart: Import-Zeit der Chat-Module (-X importtime)")
+    startup.add_argument("--modules", default="telemetry,session_store,chat_core,chatbot,chatbot_cloud")
+    startup.add_argument("--runs", type=int, default=5)
+    startup.add_argument("--budget-ms", type=float, default=150.0, help="höchstens so viel Import-Zeit pro Modul")
+
+    api = sub.add_parser("api", help="Lasttest gegen den Chat-Service (api.py)")
+    api.add_argument("--url", default="http://localhost:8000")
+    api.add_argument("--conversations", type=int, default=100)
+    api.add_argument("--concurrency", type=int, default=20)
+    api.add_argument("--mode", default="cloud", choices=["cloud", "local"])
+    api.add_argument("--seed", type=int, default=42)
+
+    for command in sub.choices.values():
+        command.add_argument("--out", help="Ergebnisse zusaetzlich als JSON-Datei schreiben")
+    args = parser.parse_args()
+
+    if args.command == "extraction":
+        results = bench_extraction(args.n, args.seed, llm=not args.no_llm)
+    elif args.command == "backends":
+        results = bench_backends(args.backends.split(","), args.n, args.seed)
+    elif args.command == "context":
+        results = bench_context(args.turns, args.seed)
+    elif args.command == "prefix":
+        results = bench_prefix(args.patients, args.gap, args.seed)
+    elif args.command == "moderation":
+        results = bench_moderation([int(size) for size in args.sizes.split(",")], args.n, args.seed)
+    elif args.command == "slots":
+        results = bench_slots(args.turns, args.seed)
+    elif args.command == "sessions":
+        results = bench_sessions(args.sessions, args.seed)
+    elif args.command == "load":
+        results = bench_load(args.patients, args.concurrency, args.latency, args.jitter, args.extractions, args.seed,
+                             delivery=args.delivery, digest_window=args.digest_window,
+                             digest_size=args.digest_size)
+    elif args.command == "telemetry":
+        results = bench_telemetry(args.conversations, args.seed, args.spans_file)
+    elif args.command == "json":
+        results = bench_json(args.n, args.seed)
+    elif args.command == "templates":
+        results = bench_templates(args.n, args.digest_size, args.seed)
+    elif args.command == "speculation":
+        results = bench_speculation(args.n, args.latency, args.think, args.seed)
+    elif args.command == "deadlines":
+        results = bench_deadlines(args.turns, args.slow, args.fast, args.deadline, args.seed)
+    elif args.command == "router":
+        results = bench_router(args.n, args.concurrency, args.latency, args.tail, args.tail_rate, args.seed)
+    elif args.command == "dedup":
+        results = bench_dedup(args.n, args.latency, args.seed)
+    elif args.command == "ratelimit":
+        results = bench_ratelimit(args.seconds, args.abuser_rate, args.users, turns=args.turns,
+                                  max_concurrency=args.max_concurrency, queue=args.queue, latency=args.latency,
+                                  queue_timeout=args.queue_timeout, seed=args.seed)
+    elif args.command == "startup":
+        results = bench_startup(args.modules.split(","), args.runs, args.budget_ms)
+    elif args.command == "api":
+        results = bench_api(args.url, args.conversations, args.concurrency, args.mode, args.seed)
+
+    print(json.dumps(results, indent=2, ensure_ascii=False))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    # Nur startup hat ein Budget; andere Subkommandos liefern auch Listen
+    if isinstance(results, dict) and results.get("within_budget") is False:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
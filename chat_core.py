@@ -0,0 +1,577 @@
+import logging
+import os
+
+import telemetry
+from context_window import build_context, count_message_tokens, count_tokens
+from extract_info import (
+    aupdate_appointment_record, empty_record, extract_rules, record_has_core_fields, update_appointment_record,
+)
+import dedup
+import faq_cache
+import rate_limit
+import speculation
+from moderation import BLACKLIST_KEYWORDS, check_harmful_content
+from outbox import enqueue_appointment_email, start_worker
+from rate_limit import RATE_LIMITED_RESPONSE, RateLimited
+from slot_tracker import SlotTracker, check_if_complete, missing_slots_hint
+
+# Gemeinsamer Gesprächsablauf für chatbot.chat (lokal) und
+# chatbot_cloud.chat_cloud. Welches Modell antwortet, entscheidet das
+# übergebene Backend aus llm_backends.
+#
+# arun_turn ist dieselbe Pipeline mit asyncio: jede Stufe hat eine Frist,
+# ein abgebrochener Task (Client weg) bricht auch den laufenden Modell-Aufruf
+# ab. Verpasst das Modell seine Frist, antwortet das Fallback-Backend
+# (FALLBACK_BACKEND, Default das lokale Ollama), sonst ein fester Text.
+# asyncio wird erst in den async-Funktionen importiert (Kaltstart der Sync-App).
+DEADLINE_LLM = float(os.getenv("DEADLINE_LLM", "20"))
+DEADLINE_FALLBACK = float(os.getenv("DEADLINE_FALLBACK", "15"))
+DEADLINE_EXTRACTION = float(os.getenv("DEADLINE_EXTRACTION", "10"))
+FALLBACK_BACKEND = os.getenv("FALLBACK_BACKEND", "ollama")
+
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = """
+Du bist die virtuelle Assistenz der Zahnarztpraxis Dr. Müller in Lüneburg.
+
+WICHTIG: Merke dir ALLE Informationen die der Patient bereits genannt hat.
+Frage NIE zweimal nach der gleichen Information!
+
+SAMMLE diese 4 Informationen:
+1. Name des Patienten
+2. Email ODER Telefonnummer
+3. Terminwunsch (Tag/Uhrzeit)
+4. Grund (z.B. Zahnreinigung, Schmerzen)
+
+KONVERSATIONSFLUSS:
+- Frage freundlich nach fehlenden Informationen
+- Stelle MAXIMAL eine Frage pro Nachricht
+- Wenn der Patient etwas bereits gesagt hat, frage NICHT nochmal danach
+- Wenn du ALLE 4 Informationen hast, fasse kurz zusammen
+
+WICHTIG:
+- Wenn du die Zusammenfassung gibst, beende mit: "Soll ich diese Anfrage weiterleiten?"
+- Wenn der Patient zustimmt (ja, gerne, ok, etc.), sage NUR: "ANFRAGE_SENDEN"
+
+PRAXIS-INFOS:
+- Öffnungszeiten: Mo-Fr 8-12 und 14-18 Uhr, Mi Nachmittag geschlossen
+- Adresse: Musterstraße 123, 33602 Lüneburg
+- Telefon: 0521-12345678
+
+REGELN:
+- Keine medizinischen Diagnosen
+- Bei Notfällen → 112
+- Freundlich & professionell
+
+Antworte auf Deutsch.
+"""
+
+HARMFUL_RESPONSE = (
+    "Ich kann Ihnen bei dieser Anfrage nicht helfen. "
+    "Bitte wenden Sie sich mit zahnmedizinischen Fragen an mich."
+)
+
+API_ERROR_RESPONSE = (
+    "Entschuldigung, es gibt gerade ein technisches Problem. "
+    "Bitte versuchen Sie es erneut oder rufen Sie uns an: 0521-12345678"
+)
+
+DEADLINE_RESPONSE = (
+    "Entschuldigung, das dauert gerade ungewöhnlich lange. "
+    "Bitte versuchen Sie es gleich noch einmal oder rufen Sie uns an: 0521-12345678"
+)
+
+CONFIRMATION_WORDS = ['ja', 'gerne', 'ok', 'klar', 'weiter', 'senden', 'schicken', 'yes']
+
+
+def _handle_confirmation(backend, conversation_history, state=None):
+    """
+    Sendet die Terminanfrage an die Praxis. Die Daten stehen im laufenden
+    Datensatz (state['appointment']), eine Extraktion über die ganze
+    Konversation gibt es nur noch als Fallback.
+    """
+    logger.info("Email-Versand gestartet")
+
+    record = state.get('appointment') if state is not None else None
+    if record is None:
+        record = empty_record()
+    # Wiederholte Bestätigung derselben Buchung: weder extrahieren noch senden
+    claim, outbox_id = dedup.claim(conversation_history, record)
+    if outbox_id is not None:
+        return _booked(state, outbox_id, duplicate=True)
+    try:
+        # Meist schon während der Zusammenfassung im Hintergrund erledigt. Reicht
+        # der laufende Stand zum Senden, nur ein fertiges Ergebnis nehmen, nicht warten.
+        complete = record_has_core_fields(record)
+        completed = speculation.take(state, conversation_history, record, wait=0 if complete else None)
+        if completed is not None:
+            record = completed
+        elif not complete:
+            logger.info("Extrahiere fehlende Daten")
+            record = _complete_record(backend, record, conversation_history)
+    except BaseException:
+        dedup.release(claim)
+        raise
+    return _send_request(record, conversation_history, state, claim)
+
+
+def _booked(state, outbox_id, duplicate=False):
+    response = """
+Perfekt! Ihre Terminanfrage wurde erfolgreich weitergeleitet.
+
+Die Praxis wird sich in Kürze bei Ihnen melden.
+
+Gibt es noch etwas, bei dem ich Ihnen helfen kann?
+    """.strip()
+
+    if duplicate:
+        logger.info("Doppelte Terminanfrage, bereits in Outbox (id %s)", outbox_id)
+    else:
+        logger.info("Email in Outbox gespeichert (id %s)", outbox_id)
+
+    if state is not None:
+        speculation.discard(state)
+        state['appointment'] = empty_record()
+        state.pop('slots', None)
+    return response, [], False
+
+
+def _send_request(record, conversation_history, state, claim=None):
+    if state is not None:
+        state['appointment'] = record
+    appointment_data = dict(record)
+    logger.debug("Extrahierte Daten: %s", appointment_data)
+
+    # Dieselbe Buchung aus einer anderen Konversation
+    outbox_id = dedup.extend(claim, record)
+    if outbox_id is not None:
+        dedup.release(claim)
+        return _booked(state, outbox_id, duplicate=True)
+
+    # Versand läuft im Outbox-Worker, der Patient wartet nicht auf SMTP
+    try:
+        with telemetry.span("enqueue_appointment_email") as span:
+            result = enqueue_appointment_email(appointment_data, conversation_history)
+            span.set("success", result['success'])
+    except BaseException:
+        dedup.release(claim)
+        raise
+    start_worker()
+
+    if result['success']:
+        dedup.resolve(claim, result.get('id'))
+        return _booked(state, result.get('id'))
+    else:
+        dedup.release(claim)
+        response = f"""
+Entschuldigung, technisches Problem beim Versenden.
+
+Bitte rufen Sie direkt an: 0521-12345678
+
+Fehler: {result.get('error', 'Unbekannt')}
+        """.strip()
+
+        logger.error("Outbox fehlgeschlagen: %s", result.get('error', 'Unbekannt'))
+
+        return response, conversation_history, False
+
+
+async def _ahandle_confirmation(backend, conversation_history, state=None):
+    """
+    Wie _handle_confirmation. Braucht die Vervollständigung länger als
+    DEADLINE_EXTRACTION, geht die Anfrage mit dem bisherigen Stand raus.
+    """
+    import asyncio
+
+    logger.info("Email-Versand gestartet")
+
+    current = state.get('appointment') if state is not None else None
+    record = dict(current or empty_record())
+    # Wartet ggf. auf eine noch laufende erste Bestätigung, daher im Thread
+    claim, outbox_id = await asyncio.to_thread(dedup.claim, conversation_history, record)
+    if outbox_id is not None:
+        return _booked(state, outbox_id, duplicate=True)
+
+    async def _complete():
+        complete = record_has_core_fields(record)
+        completed = await asyncio.to_thread(speculation.take, state, conversation_history, current or record,
+                                            0 if complete else None)
+        if completed is not None:
+            record.update(completed)
+        elif not complete:
+            logger.info("Extrahiere fehlende Daten")
+            with telemetry.span("update_appointment_record", full_history=True):
+                await aupdate_appointment_record(record, conversation_history,
+                                                 rate_limit.alimited(backend.agenerate_json))
+
+    try:
+        await asyncio.wait_for(_complete(), DEADLINE_EXTRACTION)
+    except asyncio.TimeoutError:
+        telemetry.count("docbot_deadline_exceeded_total", stage="extraction")
+        logger.warning("Extraktion nach %.1fs abgebrochen, sende bisherigen Stand", DEADLINE_EXTRACTION)
+    except BaseException:
+        dedup.release(claim)
+        raise
+
+    # SQLite im Thread; einmal bestätigt, wird auch bei Abbruch noch eingereiht
+    return await asyncio.to_thread(_send_request, record, conversation_history, state, claim)
+
+
+def _complete_record(backend, record, conversation_history):
+    """
+    Fehlende Pflichtfelder aus der ganzen Konversation nachziehen (auf einer Kopie)
+    """
+    record = dict(record)
+    with telemetry.span("update_appointment_record", full_history=True):
+        update_appointment_record(record, conversation_history, rate_limit.limited(backend.generate_json))
+    return record
+
+
+def _speculate(backend, conversation_history, state):
+    # Solange der Patient die Zusammenfassung liest, den Datensatz schon über die
+    # ganze Konversation vervollständigen - fehlt nichts Wichtiges, kommen so
+    # noch Grund und Notizen dazu, sonst spart es die Extraktion nach dem "ja"
+    record = state['appointment']
+    speculation.start(state, conversation_history, record,
+                      _complete_record, backend, dict(record), list(conversation_history))
+
+
+def _build_messages(user_message, conversation_history, state=None):
+    # Nur die letzten Turns wörtlich, ältere stecken im Termin-Datensatz
+    record = state.get('appointment') if state is not None else None
+    hint = None
+    if state is not None and conversation_history:
+        # Gezielt nach dem fragen, was laut Slot-Tracker noch fehlt. Was der
+        # Termin-Datensatz schon kennt (z.B. frei formulierter Grund), zählt als da.
+        missing = SlotTracker.from_dict(state.get('slots')).missing()
+        if record:
+            known = {
+                "name": record.get("patient_name"),
+                "contact": record.get("patient_email") or record.get("patient_phone"),
+                "time": record.get("appointment_request"),
+                "reason": record.get("reason"),
+            }
+            missing = [slot for slot in missing if not known[slot]]
+        hint = missing_slots_hint(missing)
+    return build_context(SYSTEM_PROMPT, conversation_history, user_message, record, hint=hint)
+
+
+def _finish_turn(backend, user_message, assistant_message, conversation_history, state=None, model=True):
+    """
+    Hängt den Turn an die Historie an und prüft ob eine Bestätigung nötig ist.
+    model=False: Datensatz nur per Regeln aktualisieren (FAQ-Turns ohne Modell)
+    """
+    conversation_history.append({"role": "user", "content": user_message})
+    conversation_history.append({"role": "assistant", "content": assistant_message})
+
+    # Laufenden Datensatz nur mit dem neuen Turn aktualisieren
+    # (plus der Frage davor, damit "Max Mustermann" als Antwort auf die Namensfrage erkannt wird).
+    # Auch JSON-Aufrufe stehen in der Modell-Schlange; abgelehnt bleibt der Stand der Regeln.
+    if state is not None:
+        record = state.setdefault('appointment', empty_record())
+        generate = rate_limit.limited(backend.generate_json) if model else None
+        with telemetry.span("update_appointment_record"):
+            update_appointment_record(record, conversation_history[-3:], generate)
+
+    return _check_turn(backend, user_message, assistant_message, conversation_history, state)
+
+
+async def _afinish_turn(backend, user_message, assistant_message, conversation_history, state=None, model=True):
+    """
+    Wie _finish_turn, das Datensatz-Update mit Frist
+    """
+    import asyncio
+
+    conversation_history.append({"role": "user", "content": user_message})
+    conversation_history.append({"role": "assistant", "content": assistant_message})
+
+    if state is not None:
+        record = state.setdefault('appointment', empty_record())
+        agenerate = rate_limit.alimited(backend.agenerate_json) if model else None
+        try:
+            with telemetry.span("update_appointment_record"):
+                await asyncio.wait_for(
+                    aupdate_appointment_record(record, conversation_history[-3:], agenerate),
+                    DEADLINE_EXTRACTION,
+                )
+        except asyncio.TimeoutError:
+            # Die Regeln sind schon eingetragen, der Rest kommt notfalls bei der Bestätigung
+            telemetry.count("docbot_deadline_exceeded_total", stage="update_record")
+            logger.warning("Datensatz-Update nach %.1fs abgebrochen", DEADLINE_EXTRACTION)
+
+    return _check_turn(backend, user_message, assistant_message, conversation_history, state)
+
+
+def _check_turn(backend, user_message, assistant_message, conversation_history, state):
+    # Check ob wir jetzt genug Infos haben (inkrementell, nur die neue Nachricht)
+    with telemetry.span("check_if_complete"):
+        if state is not None:
+            tracker = SlotTracker.from_dict(state.get('slots')).update(user_message)
+            state['slots'] = tracker.to_dict()
+            is_complete = tracker.is_complete()
+        else:
+            is_complete = check_if_complete(conversation_history)
+    needs_confirmation = "weiterleiten" in assistant_message.lower() or "senden" in assistant_message.lower()
+
+    if is_complete and needs_confirmation:
+        if state is not None:
+            _speculate(backend, conversation_history, state)
+        return assistant_message, conversation_history, True
+
+    # Korrektur statt Bestätigung: alte Spekulation gilt nicht mehr
+    speculation.discard(state)
+    return assistant_message, conversation_history, False
+
+
+def _faq_applicable(user_message, conversation_history, awaiting_confirmation, state):
+    """
+    FAQ-Antworten nur, wenn gerade keine Terminanfrage läuft und die
+    Nachricht selbst keine Termin- oder Patientendaten enthält
+    """
+    if awaiting_confirmation or "termin" in user_message.lower():
+        return False
+    record = state.get('appointment') if state is not None else None
+    if record is not None:
+        if any(record.values()):
+            return False
+    elif conversation_history:
+        return False
+    data = extract_rules([{"role": "user", "content": user_message}])
+    return not (data["patient_name"] or data["patient_email"] or data["patient_phone"])
+
+
+def _faq_answer(user_message, conversation_history, awaiting_confirmation, state):
+    # Feste Antwort ohne Modell; der Turn läuft danach wie jeder andere durch _finish_turn
+    if not _faq_applicable(user_message, conversation_history, awaiting_confirmation, state):
+        return None
+    return faq_cache.lookup(user_message)
+
+
+def _is_harmful(user_message):
+    with telemetry.span("check_harmful_content") as span:
+        harmful = check_harmful_content(user_message)
+        span.set("harmful", harmful)
+    return harmful
+
+
+def _record_llm_tokens(backend, span, messages, response):
+    # Tokens nur zählen, wenn jemand zuschaut (geschätzt wie im Kontextfenster)
+    if telemetry.enabled():
+        prompt_tokens, completion_tokens = count_message_tokens(messages), count_tokens(response)
+        span.set("prompt_tokens", prompt_tokens)
+        span.set("completion_tokens", completion_tokens)
+        telemetry.record_tokens(backend.name, prompt_tokens, completion_tokens)
+
+
+def run_turn(backend, user_message, conversation_history, awaiting_confirmation=False, state=None):
+    """
+    Ein kompletter Chat-Turn: Blacklist, Bestätigung oder normale Antwort.
+    Gibt (antwort, conversation_history, awaiting_confirmation) zurück.
+    """
+    with telemetry.span("chat_turn", backend=backend.name, stream=False) as span:
+        turn = _run_turn(backend, user_message, conversation_history, awaiting_confirmation, state)
+        span.set("awaiting_confirmation", turn[2])
+    return turn
+
+
+def _run_turn(backend, user_message, conversation_history, awaiting_confirmation, state):
+    # Blacklist-Check
+    if _is_harmful(user_message):
+        return HARMFUL_RESPONSE, conversation_history, awaiting_confirmation
+
+    # Check ob User bestätigt
+    if awaiting_confirmation and any(word in user_message.lower() for word in CONFIRMATION_WORDS):
+        with telemetry.span("handle_confirmation"):
+            return _handle_confirmation(backend, conversation_history, state)
+
+    # Öffnungszeiten, Adresse & Co. ohne Modell beantworten
+    faq = _faq_answer(user_message, conversation_history, awaiting_confirmation, state)
+    if faq:
+        telemetry.count("docbot_faq_answers_total")
+        return _finish_turn(backend, user_message, faq, conversation_history, state, model=False)
+
+    # Normale Konversation
+    messages = _build_messages(user_message, conversation_history, state)
+
+    try:
+        with rate_limit.model_slot(), telemetry.span("llm_chat", backend=backend.name) as span:
+            assistant_message = backend.chat(messages, max_tokens=512)
+            _record_llm_tokens(backend, span, messages, assistant_message)
+    except RateLimited:
+        return RATE_LIMITED_RESPONSE, conversation_history, awaiting_confirmation
+    except Exception as e:
+        logger.error("Fehler bei %s: %s", backend.name, e)
+        return API_ERROR_RESPONSE, conversation_history, False
+
+    return _finish_turn(backend, user_message, assistant_message, conversation_history, state)
+
+
+def run_turn_stream(backend, user_message, conversation_history, awaiting_confirmation=False, result=None, state=None):
+    """
+    Wie run_turn, liefert die Antwort aber stückweise (Text-Deltas).
+    Nach dem Ende des Streams stehen response, conversation_history und
+    awaiting_confirmation im übergebenen result-Dict.
+    """
+    if result is None:
+        result = {}
+    # Der Stream wird stückweise (ggf. aus wechselnden Threads) fortgesetzt:
+    # Turn- und Modell-Span daher nicht als aktuellen Span setzen, sondern
+    # explizit als Eltern übergeben und per end() schließen
+    turn_span = telemetry.span("chat_turn", backend=backend.name, stream=True)
+
+    def _done(response, history, confirmation):
+        result['response'] = response
+        result['conversation_history'] = history
+        result['awaiting_confirmation'] = confirmation
+        turn_span.set("awaiting_confirmation", confirmation)
+        turn_span.end()
+
+    # Blacklist-Check
+    with telemetry.span("check_harmful_content", parent=turn_span) as span:
+        harmful = check_harmful_content(user_message)
+        span.set("harmful", harmful)
+    if harmful:
+        _done(HARMFUL_RESPONSE, conversation_history, awaiting_confirmation)
+        yield HARMFUL_RESPONSE
+        return
+
+    # Check ob User bestätigt
+    if awaiting_confirmation and any(word in user_message.lower() for word in CONFIRMATION_WORDS):
+        with telemetry.span("handle_confirmation", parent=turn_span):
+            confirmation = _handle_confirmation(backend, conversation_history, state)
+        _done(*confirmation)
+        yield result['response']
+        return
+
+    # Öffnungszeiten, Adresse & Co. ohne Modell beantworten
+    faq = _faq_answer(user_message, conversation_history, awaiting_confirmation, state)
+    if faq:
+        telemetry.count("docbot_faq_answers_total")
+        with telemetry.span("finish_turn", parent=turn_span):
+            turn = _finish_turn(backend, user_message, faq, conversation_history, state, model=False)
+        _done(*turn)
+        yield faq
+        return
+
+    messages = _build_messages(user_message, conversation_history, state)
+
+    parts = []
+    llm_span = telemetry.span("llm_chat", parent=turn_span, backend=backend.name)
+    try:
+        # Der Platz bleibt belegt, bis der Stream durch ist. Bricht der Client ab,
+        # schließt der Aufrufer diesen Generator (GeneratorExit im yield); das
+        # finally gibt dann Platz und Backend-Stream frei.
+        with rate_limit.model_slot():
+            deltas = backend.chat(messages, max_tokens=512, stream=True)
+            try:
+                for delta in deltas:
+                    parts.append(delta)
+                    yield delta
+            except GeneratorExit:
+                # Client weg: beide Spans trotzdem abschließen, sonst fehlen Turn-Dauer und Trace
+                for span in (llm_span, turn_span):
+                    span.set("status", "cancelled")
+                    span.end()
+                raise
+            finally:
+                close = getattr(deltas, "close", None)
+                if close is not None:
+                    close()
+    except RateLimited as e:
+        llm_span.end(e)
+        _done(RATE_LIMITED_RESPONSE, conversation_history, awaiting_confirmation)
+        yield RATE_LIMITED_RESPONSE
+        return
+    except Exception as e:
+        logger.error("Fehler bei %s: %s", backend.name, e)
+        llm_span.end(e)
+        _done(API_ERROR_RESPONSE, conversation_history, False)
+        # Bereits gestreamten Text nicht mit der Fehlermeldung verkleben
+        yield ("\n\n" if parts else "") + API_ERROR_RESPONSE
+        return
+    _record_llm_tokens(backend, llm_span, messages, "".join(parts))
+    llm_span.end()
+
+    # Completeness-Check erst wenn der Stream komplett ist
+    with telemetry.span("finish_turn", parent=turn_span):
+        turn = _finish_turn(backend, user_message, "".join(parts), conversation_history, state)
+    _done(*turn)
+
+
+def fallback_backend(backend):
+    """
+    Backend für verpasste Fristen (FALLBACK_BACKEND) oder None, wenn es
+    keins gibt, es dasselbe ist oder sich nicht anlegen lässt
+    """
+    if not FALLBACK_BACKEND or FALLBACK_BACKEND == backend.name:
+        return None
+    from llm_backends import get_backend
+
+    try:
+        return get_backend(FALLBACK_BACKEND)
+    except Exception as e:
+        logger.warning("Fallback-Backend %s nicht verfügbar: %s", FALLBACK_BACKEND, e)
+        return None
+
+
+async def _achat_with_fallback(backend, fallback, messages):
+    """
+    (Backend, Antwort) innerhalb von DEADLINE_LLM, sonst vom Fallback
+    innerhalb von DEADLINE_FALLBACK, sonst (None, None)
+    """
+    import asyncio
+
+    for stage, candidate, deadline in (("llm", backend, DEADLINE_LLM), ("fallback", fallback, DEADLINE_FALLBACK)):
+        if candidate is None:
+            continue
+        try:
+            with telemetry.span("llm_chat", backend=candidate.name, stage=stage) as span:
+                # wait_for bricht den Aufruf bei Fristablauf ab, statt ihn weiterlaufen zu lassen
+                assistant_message = await asyncio.wait_for(candidate.achat(messages, max_tokens=512), deadline)
+                _record_llm_tokens(candidate, span, messages, assistant_message)
+            return candidate, assistant_message
+        except asyncio.TimeoutError:
+            telemetry.count("docbot_deadline_exceeded_total", stage=stage)
+            logger.warning("%s hat die Frist von %.1fs verpasst", candidate.name, deadline)
+        except Exception as e:
+            logger.error("Fehler bei %s: %s", candidate.name, e)
+    return None, None
+
+
+async def arun_turn(backend, user_message, conversation_history, awaiting_confirmation=False, state=None,
+                    fallback=None):
+    """
+    Wie run_turn, aber async und mit Fristen pro Stufe. Wird der Task
+    abgebrochen, wird auch der laufende Modell-Aufruf abgebrochen.
+    """
+    with telemetry.span("chat_turn", backend=backend.name, stream=False, mode="async") as span:
+        turn = await _arun_turn(backend, user_message, conversation_history, awaiting_confirmation, state, fallback)
+        span.set("awaiting_confirmation", turn[2])
+    return turn
+
+
+async def _arun_turn(backend, user_message, conversation_history, awaiting_confirmation, state, fallback):
+    if _is_harmful(user_message):
+        return HARMFUL_RESPONSE, conversation_history, awaiting_confirmation
+
+    if awaiting_confirmation and any(word in user_message.lower() for word in CONFIRMATION_WORDS):
+        with telemetry.span("handle_confirmation"):
+            return await _ahandle_confirmation(backend, conversation_history, state)
+
+    faq = _faq_answer(user_message, conversation_history, awaiting_confirmation, state)
+    if faq:
+        telemetry.count("docbot_faq_answers_total")
+        return await _afinish_turn(backend, user_message, faq, conversation_history, state, model=False)
+
+    messages = _build_messages(user_message, conversation_history, state)
+
+    # Hat das Fallback geantwortet, macht es auch die Datensatz-Updates dieses Turns
+    try:
+        async with rate_limit.amodel_slot():
+            responder, assistant_message = await _achat_with_fallback(backend, fallback, messages)
+    except RateLimited:
+        return RATE_LIMITED_RESPONSE, conversation_history, awaiting_confirmation
+    if responder is None:
+        return DEADLINE_RESPONSE, conversation_history, False
+
+    return await _afinish_turn(responder, user_message, assistant_message, conversation_history, state)
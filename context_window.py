@@ -0,0 +1,167 @@
+import math
+import os
+import re
+
+# Begrenzt den Prompt: die letzten CONTEXT_MAX_TURNS Turns bleiben wörtlich,
+# ältere werden in eine kurze Zusammenfassung (die daraus erkannten Angaben)
+# gefaltet. Der ganze Prompt bleibt unter CONTEXT_TOKEN_BUDGET.
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "6"))
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Tokens zählt tiktoken (cl100k, in requirements.txt). Fehlt es, schätzt
+# count_tokens konservativ aus Bytes und Wörtern (eher zu hoch), das Budget
+# hält also auch dann - der Prompt fällt nur etwas kürzer aus als nötig.
+#
+# Gefaltet wird in Blöcken von CONTEXT_FOLD_STEP Turns statt bei jedem Turn
+# einen: so bleibt der Prompt-Präfix mehrere Turns lang gleich und der
+# KV-Cache des Backends kann ihn wiederverwenden.
+#
+# Aufbau: System-Prompt | Zusammenfassung der gefalteten Turns | letzte Turns
+# wörtlich | neue Nachricht. Alles bis zur neuen Nachricht ist byte-gleich zum
+# vorigen Turn (die Zusammenfassung kommt nur aus den gefalteten Turns und
+# ändert sich höchstens beim Falten). Was sich jeden Turn ändern kann - neuere
+# Daten aus dem Termin-Datensatz und der Hinweis auf fehlende Infos - hängt als
+# Notiz in festem Format hinten an der neuen Nachricht.
+CONTEXT_FOLD_STEP = int(os.getenv("CONTEXT_FOLD_STEP", "3"))
+
+# Pro Nachricht zählen Chat-Templates ein paar Steuer-Tokens extra
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_WORD_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+FIELD_LABELS = {
+    "patient_name": "Name",
+    "patient_email": "Email",
+    "patient_phone": "Telefon",
+    "appointment_request": "Terminwunsch",
+    "reason": "Grund",
+    "notes": "Notizen",
+}
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """
+    Tokenanzahl eines Textes. Mit tiktoken exakt für cl100k, sonst eine
+    konservative Schätzung (eher zu hoch als zu niedrig).
+    """
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return _estimate_tokens(text)
+
+
+def _estimate_tokens(text):
+    # Deutsche Texte: grob 3 Bytes pro Token, mindestens ein Token pro Wort/Satzzeichen
+    return max(len(_WORD_RE.findall(text)), math.ceil(len(text.encode("utf-8")) / 3))
+
+
+def count_message_tokens(messages):
+    return sum(count_tokens(msg["content"]) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+
+
+def summarize_record(record):
+    """
+    Kompakte Zusammenfassung der bisher bekannten Daten
+    """
+    parts = [f"{label}: {record[field]}" for field, label in FIELD_LABELS.items() if record and record.get(field)]
+    if not parts:
+        return None
+    return "Bisher vom Patienten bekannt (nicht erneut fragen): " + "; ".join(parts)
+
+
+def _summarize_turns(turns):
+    # Ohne Datensatz: frühere Patientenaussagen gekürzt aufheben
+    said = [msg["content"][:120] for msg in turns if msg["role"] == "user"][-8:]
+    if not said:
+        return None
+    return "Frühere Angaben des Patienten: " + " | ".join(said)
+
+
+def _fit_text(text, max_tokens):
+    # Text so lange kürzen, bis er ins Budget passt
+    while text and count_tokens(text) > max_tokens:
+        text = text[:int(len(text) * 0.8)]
+    return text
+
+
+def _fold_split(n_messages, max_turns, step):
+    # Anzahl der Nachrichten, die in die Zusammenfassung wandern
+    over = n_messages // 2 - max_turns
+    if over <= 0:
+        return 0
+    return 2 * step * math.ceil(over / step)
+
+
+def _with_note(user_message, notes):
+    notes = [note for note in notes if note]
+    if not notes:
+        return user_message
+    return user_message + "\n\n[Notiz für den Assistenten]\n" + "\n".join(notes)
+
+
+def build_context(system_prompt, conversation_history, user_message, record=None,
+                  max_turns=CONTEXT_MAX_TURNS, token_budget=CONTEXT_TOKEN_BUDGET, fold_step=CONTEXT_FOLD_STEP,
+                  hint=None):
+    """
+    Baut die Nachrichtenliste für das Modell:
+    System-Prompt, ggf. Zusammenfassung, die letzten max_turns Turns,
+    neue Nachricht samt Notiz (bekannte Daten, Hinweis z.B. auf fehlende Infos).
+    Garantiert count_message_tokens(messages) <= token_budget.
+    """
+    system = {"role": "system", "content": system_prompt}
+    if count_message_tokens([system]) + MESSAGE_OVERHEAD_TOKENS >= token_budget:
+        # Der System-Prompt wird nie gekürzt
+        raise ValueError(f"Token-Budget {token_budget} ist kleiner als der System-Prompt")
+
+    split = min(len(conversation_history), _fold_split(len(conversation_history), max_turns, max(1, fold_step)))
+    older, recent = conversation_history[:split], list(conversation_history[split:])
+
+    def _fold(folded):
+        # Zusammenfassung nur aus den gefalteten Turns, damit sie bis zum nächsten
+        # Falten gleich bleibt; was der laufende Datensatz darüber hinaus kennt,
+        # kommt in die Notiz
+        if not folded:
+            return None, {"role": "user", "content": _with_note(user_message, [hint])}
+        from extract_info import extract_rules
+
+        frozen = extract_rules(folded)
+        text = summarize_record(frozen) or _summarize_turns(folded)
+        newer = {field: value for field, value in (record or {}).items() if value and value != frozen.get(field)}
+        note = summarize_record(newer)
+        return ({"role": "system", "content": text} if text else None,
+                {"role": "user", "content": _with_note(user_message, [note, hint])})
+
+    summary, user = _fold(older)
+
+    # Älteste Turns in die Zusammenfassung falten, bis das Budget passt
+    while recent:
+        messages = [system] + ([summary] if summary else []) + recent + [user]
+        if count_message_tokens(messages) <= token_budget:
+            return messages
+        drop = 2 if len(recent) >= 2 else 1
+        older, recent = older + recent[:drop], recent[drop:]
+        summary, user = _fold(older)
+
+    if summary:
+        room = token_budget - count_message_tokens([system, user]) - MESSAGE_OVERHEAD_TOKENS
+        text = _fit_text(summary["content"], room) if room > 0 else ""
+        summary = {"role": "system", "content": text} if text else None
+
+    messages = [system] + ([summary] if summary else []) + [user]
+    if count_message_tokens(messages) > token_budget:
+        # Pathologisch lange Nachricht: lieber kürzen als das Budget reißen
+        room = token_budget - count_message_tokens([system]) - MESSAGE_OVERHEAD_TOKENS
+        messages = [system, {"role": "user", "content": _fit_text(user["content"], max(room, 0))}]
+    return messages
@@ -0,0 +1,265 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+import telemetry
+
+# Doppelte Terminanfragen abfangen, bevor sie die Praxis erreichen: ein
+# zweites "ja" nach einem Fehler, ein wiederholter Request des Clients oder
+# ein Rerun soll weder neu extrahieren noch eine zweite Email auslösen.
+#
+# Schlüssel sind der Fingerprint der Konversation (gleiche Historie = gleiche
+# Bestätigung, noch vor der Extraktion prüfbar) und der Fingerprint des
+# normalisierten Datensatzes (Name, Kontakt, Terminwunsch - gleiche Buchung
+# aus einer anderen Session). Eine Anfrage gilt als doppelt, solange die
+# erste noch läuft oder in der Outbox liegt; scheitert die Zustellung
+# endgültig, darf der Patient erneut senden.
+#
+# Der Index liegt im Prozess; mit mehreren API-Workern fängt jeder Worker
+# nur seine eigenen Wiederholungen ab.
+#
+#   DEDUP_ENABLED=0        ausschalten
+#   DEDUP_TTL=3600         Sekunden, so lange gilt eine Buchung als schon gesendet
+#   DEDUP_MAX_ENTRIES      höchstens so viele Buchungen merken (älteste fliegen raus)
+#   DEDUP_WAIT=30          so lange wartet eine Wiederholung auf die noch laufende erste Anfrage
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "1") != "0"
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "3600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_WAIT = float(os.getenv("DEDUP_WAIT", "30"))
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_text(value):
+    value = unicodedata.normalize("NFKC", str(value)).casefold()
+    return " ".join(re.sub(r"[^\w@+]+", " ", value).split())
+
+
+def _normalize_phone(value):
+    digits = re.sub(r"\D", "", str(value))
+    if str(value).strip().startswith("+49") or digits.startswith("0049"):
+        digits = "0" + digits[4 if digits.startswith("0049") else 2:]
+    return digits
+
+
+def record_key(record):
+    """
+    Fingerprint aus Name, Kontakt und Terminwunsch oder None, solange eins fehlt
+    """
+    name = record.get("patient_name")
+    email = record.get("patient_email")
+    phone = record.get("patient_phone")
+    request = record.get("appointment_request")
+    if not (name and (email or phone) and request):
+        return None
+    # E-Mail vor Telefon: wird die Nummer später nachgetragen, bleibt der Schlüssel gleich
+    contact = str(email).strip().casefold() if email else _normalize_phone(phone)
+    data = "\x1f".join((_normalize_text(name), contact, _normalize_text(request)))
+    return "record:" + hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def conversation_key(conversation_history):
+    data = json.dumps(conversation_history, ensure_ascii=False, sort_keys=True)
+    return "conversation:" + hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class _Entry:
+    __slots__ = ("keys", "expires", "done", "outbox_id")
+
+    def __init__(self, keys, expires):
+        self.keys = set(keys)
+        self.expires = expires
+        self.done = threading.Event()
+        self.outbox_id = None
+
+
+class DedupIndex:
+    """
+    Schlüssel -> Buchung (laufend oder in der Outbox), begrenzt und mit Ablaufzeit.
+    claim() reserviert, resolve() trägt die Outbox-id ein, release() gibt frei.
+    """
+
+    def __init__(self, max_entries=DEDUP_MAX_ENTRIES, ttl=DEDUP_TTL, wait=DEDUP_WAIT, clock=time.monotonic,
+                 is_failed=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.wait = wait
+        self.clock = clock
+        # is_failed(outbox_id): endgültig gescheiterte Zustellung gibt die Buchung wieder frei
+        self.is_failed = is_failed
+        self._entries = OrderedDict()  # Schlüssel -> _Entry
+        self._lock = threading.Lock()
+        self.stats = {"claims": 0, "duplicates": 0, "released": 0, "failed_deliveries": 0, "evictions": 0}
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= now:
+            self._drop(entry)
+            return None
+        return entry
+
+    def _drop(self, entry):
+        for key in entry.keys:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _find(self, keys):
+        with self._lock:
+            now = self.clock()
+            for key in keys:
+                entry = self._live(key, now)
+                if entry is not None:
+                    return key, entry
+        return None, None
+
+    def _is_duplicate(self, entry):
+        """
+        Wartet auf eine noch laufende Anfrage; doppelt, wenn sie angekommen ist
+        """
+        if not entry.done.wait(self.wait):
+            # Hängt die erste Anfrage, lieber doppelt senden als gar nicht
+            return False
+        if entry.outbox_id is None:
+            return False
+        if self.is_failed is not None and self.is_failed(entry.outbox_id):
+            with self._lock:
+                self._drop(entry)
+            self.stats["failed_deliveries"] += 1
+            return False
+        return True
+
+    def claim(self, keys):
+        """
+        (claim, None) für eine neue Buchung, (None, outbox_id) für eine doppelte.
+        Schlüssel None werden ignoriert.
+        """
+        keys = [key for key in keys if key]
+        while True:
+            key, entry = self._find(keys)
+            if entry is None:
+                with self._lock:
+                    # Zwischen _find und hier kann ein anderer Thread reserviert haben
+                    now = self.clock()
+                    if any(self._live(other, now) for other in keys):
+                        continue
+                    claim = _Entry(keys, self.clock() + self.ttl)
+                    for claimed in keys:
+                        self._entries[claimed] = claim
+                    self._evict()
+                    self.stats["claims"] += 1
+                return claim, None
+            if self._is_duplicate(entry):
+                self.stats["duplicates"] += 1
+                telemetry.count("docbot_duplicate_bookings_total", key=key.split(":")[0])
+                return None, entry.outbox_id
+            with self._lock:
+                if entry.outbox_id is None:
+                    self._drop(entry)
+
+    def extend(self, claim, key):
+        """
+        Schlüssel nach der Extraktion nachtragen; outbox_id, wenn die Buchung
+        damit schon von einer anderen Konversation kommt, sonst None
+        """
+        if not key or key in claim.keys:
+            return None
+        while True:
+            _, entry = self._find([key])
+            if entry is None or entry is claim:
+                with self._lock:
+                    if self._live(key, self.clock()) not in (None, claim):
+                        continue
+                    claim.keys.add(key)
+                    self._entries[key] = claim
+                    self._evict()
+                return None
+            if self._is_duplicate(entry):
+                self.stats["duplicates"] += 1
+                telemetry.count("docbot_duplicate_bookings_total", key="record")
+                return entry.outbox_id
+            with self._lock:
+                if entry.outbox_id is None:
+                    self._drop(entry)
+
+    def resolve(self, claim, outbox_id):
+        claim.outbox_id = outbox_id
+        claim.done.set()
+
+    def release(self, claim):
+        with self._lock:
+            self._drop(claim)
+            self.stats["released"] += 1
+        claim.done.set()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            _, entry = self._entries.popitem(last=False)
+            self._drop(entry)
+            self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _outbox_failed(outbox_id):
+    from outbox import get_status
+
+    return get_status(outbox_id) == "failed"
+
+
+_enabled = DEDUP_ENABLED
+_index = DedupIndex(is_failed=_outbox_failed)
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    """
+    Zur Laufzeit ein-/ausschalten (Benchmarks)
+    """
+    global _enabled
+    _enabled = flag
+
+
+def get_index():
+    return _index
+
+
+def claim(conversation_history, record):
+    """
+    Vor der Extraktion: (claim, None) oder (None, outbox_id) für eine
+    Buchung, die schon gesendet wird. Ausgeschaltet immer (None, None).
+    """
+    if not _enabled:
+        return None, None
+    return _index.claim([conversation_key(conversation_history), record_key(record)])
+
+
+def extend(claim, record):
+    if claim is None:
+        return None
+    return _index.extend(claim, record_key(record))
+
+
+def resolve(claim, outbox_id):
+    if claim is not None:
+        _index.resolve(claim, outbox_id)
+
+
+def release(claim):
+    if claim is not None:
+        _index.release(claim)
+
+
+def metrics():
+    stats = dict(_index.stats)
+    stats["keys"] = len(_index)
+    return stats
@@ -1,165 +1,331 @@
+import logging
 import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from email.mime.application import MIMEApplication
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from datetime import datetime
 import os
 from dotenv import load_dotenv
 
+import telemetry
+from email_templates import render_appointment, render_attachment, render_digest
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
 
-def send_appointment_email(appointment_data, conversation_history):
+# SMTP-Server (Default Gmail). Fuer lokale Tests z.B. mit
+# "python -m aiosmtpd -n -l localhost:1025":
+# SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
+SMTP_STARTTLS = os.getenv('SMTP_STARTTLS', '1') != '0'
+
+# Connection-Pool: Sessions bleiben eingeloggt und werden wiederverwendet
+SMTP_POOL_SIZE = int(os.getenv('SMTP_POOL_SIZE', '2'))
+SMTP_KEEPALIVE_INTERVAL = float(os.getenv('SMTP_KEEPALIVE_INTERVAL', '60'))
+SMTP_MAX_IDLE = float(os.getenv('SMTP_MAX_IDLE', '240'))
+
+# Anhaenge der Digest-Email, kommagetrennt aus csv, ics, json (leer: keine)
+DIGEST_ATTACHMENTS = [fmt.strip() for fmt in os.getenv('DIGEST_ATTACHMENTS', 'csv').split(',') if fmt.strip()]
+
+
+class SMTPPool:
     """
-    Sendet Email via Gmail SMTP (kein SSL-Problem!)
+    Haelt eingeloggte SMTP-Sessions offen (NOOP-Keepalive) und
+    verbindet neu, wenn eine Session eingeschlafen ist
     """
 
-    sender_email = os.getenv('GMAIL_ADDRESS')
-    sender_password = os.getenv('GMAIL_APP_PASSWORD')
-    receiver_email = os.getenv('PRAXIS_EMAIL')
+    def __init__(self, host=None, port=None, starttls=None, username=None, password=None,
+                 max_size=SMTP_POOL_SIZE, keepalive_interval=SMTP_KEEPALIVE_INTERVAL, max_idle=SMTP_MAX_IDLE):
+        self.host = host or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.starttls = SMTP_STARTTLS if starttls is None else starttls
+        self.username = username
+        self.password = password
+        self.max_size = max_size
+        self.keepalive_interval = keepalive_interval
+        self.max_idle = max_idle
+        self._idle = []  # [(server, last_used)]
+        self._lock = threading.Lock()
+        self.stats = {"connects": 0, "reuses": 0, "failures": 0, "keepalives": 0, "stale": 0}
+
+    def _connect(self):
+        logger.debug("Verbinde mit %s:%s", self.host, self.port)
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        server.set_debuglevel(0)
+        try:
+            if self.starttls:
+                logger.debug("Starte TLS")
+                server.starttls()
+
+            # Lokale Test-Server brauchen keinen Login
+            if self.password:
+                logger.debug("Login als %s", self.username)
+                server.login(self.username, self.password)
+        except Exception:
+            _close(server)
+            raise
+        self.stats["connects"] += 1
+        telemetry.count("docbot_smtp_connects_total")
+        return server
+
+    def _is_alive(self, server):
+        try:
+            self.stats["keepalives"] += 1
+            return server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def _take(self):
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                server, last_used = self._idle.pop()
+            idle_for = now - last_used
+            if idle_for <= self.max_idle and (idle_for < self.keepalive_interval or self._is_alive(server)):
+                self.stats["reuses"] += 1
+                return server
+            self.stats["stale"] += 1
+            _close(server)
+
+    def _release(self, server):
+        with self._lock:
+            if len(self._idle) < self.max_size:
+                self._idle.append((server, time.monotonic()))
+                return
+        _close(server)
+
+    @contextmanager
+    def connection(self, fresh=False):
+        """
+        Liefert eine eingeloggte Session. Bei einem Fehler wird sie verworfen
+        statt zurueck in den Pool gelegt.
+        """
+        server = (None if fresh else self._take()) or self._connect()
+        try:
+            yield server
+        except Exception:
+            self.stats["failures"] += 1
+            _close(server)
+            raise
+        self._release(server)
+
+    def keepalive(self):
+        """
+        NOOP fuer Sessions, die laenger als keepalive_interval ungenutzt sind;
+        tote oder zu alte Sessions werden geschlossen
+        """
+        now = time.monotonic()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        keep = []
+        for server, last_used in idle:
+            idle_for = now - last_used
+            if idle_for > self.max_idle:
+                self.stats["stale"] += 1
+                _close(server)
+            elif idle_for < self.keepalive_interval:
+                keep.append((server, last_used))
+            elif self._is_alive(server):
+                keep.append((server, now))
+            else:
+                self.stats["stale"] += 1
+                _close(server)
+        with self._lock:
+            self._idle.extend(keep)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for server, _ in idle:
+            _close(server)
+
+
+def _close(server):
+    try:
+        server.quit()
+    except (smtplib.SMTPException, OSError):
+        server.close()
 
-    # HTML Email (schön formatiert)
-    html_content = f"""
-    <html>
-    <head>
-        <style>
-            body {{ 
-                font-family: Arial, sans-serif; 
-                line-height: 1.6; 
-                color: #333;
-            }}
-            .header {{ 
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white; 
-                padding: 20px; 
-                border-radius: 8px 8px 0 0;
-            }}
-            .content {{ 
-                padding: 20px; 
-                background: #ffffff;
-            }}
-            .info-box {{ 
-                background: #f5f5f5; 
-                padding: 15px; 
-                margin: 10px 0; 
-                border-left: 4px solid #667eea; 
-                border-radius: 4px;
-            }}
-            .label {{ 
-                font-weight: bold; 
-                color: #667eea; 
-            }}
-            .footer {{
-                margin-top: 30px;
-                padding-top: 20px;
-                border-top: 1px solid #ddd;
-                color: #666;
-                font-size: 12px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h2>Neue Terminanfrage</h2>
-            <p>Eingegangen am {datetime.now().strftime('%d.%m.%Y um %H:%M Uhr')}</p>
-        </div>
-
-        <div class="content">
-            <h3>Patienteninformationen:</h3>
-            <div class="info-box">
-                <p><span class="label">Name:</span> {appointment_data.get('patient_name') or 'Nicht angegeben'}</p>
-                <p><span class="label">Email:</span> {appointment_data.get('patient_email') or 'Nicht angegeben'}</p>
-                <p><span class="label">Telefon:</span> {appointment_data.get('patient_phone') or 'Nicht angegeben'}</p>
-            </div>
-
-            <h3>Termindetails:</h3>
-            <div class="info-box">
-                <p><span class="label">Terminwunsch:</span> {appointment_data.get('appointment_request') or 'Nicht spezifiziert'}</p>
-                <p><span class="label">Grund:</span> {appointment_data.get('reason') or 'Nicht angegeben'}</p>
-            </div>
-
-            {f'<h3>Zusätzliche Notizen:</h3><div class="info-box"><p>{appointment_data.get("notes")}</p></div>' if appointment_data.get('notes') else ''}
-
-            <div class="footer">
-                <p>Diese Anfrage wurde automatisch vom virtuellen Praxis-Assistenten erstellt.</p>
-                <p>Bitte kontaktieren Sie den Patienten zeitnah.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
-
-    # Plain-Text Fallback
-    text_content = f"""
-NEUE TERMINANFRAGE - {datetime.now().strftime('%d.%m.%Y %H:%M Uhr')}
-
-PATIENTENINFORMATIONEN:
-Name: {appointment_data.get('patient_name') or 'Nicht angegeben'}
-Email: {appointment_data.get('patient_email') or 'Nicht angegeben'}
-Telefon: {appointment_data.get('patient_phone') or 'Nicht angegeben'}
-
-TERMINDETAILS:
-Terminwunsch: {appointment_data.get('appointment_request') or 'Nicht spezifiziert'}
-Grund: {appointment_data.get('reason') or 'Nicht angegeben'}
-Notizen: {appointment_data.get('notes') or 'Keine'}
-
----
-Automatisch erstellt vom Praxis-Assistenten
-Bitte kontaktieren Sie den Patienten zeitnah
-    """
-
-    # Email zusammenbauen
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Gemeinsamer Pool pro Prozess (Zugangsdaten aus .env)
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SMTPPool(username=os.getenv('GMAIL_ADDRESS'), password=os.getenv('GMAIL_APP_PASSWORD'))
+    return _pool
+
+
+def _mime_message(subject, text_content, html_content, sender_email, receiver_email):
     message = MIMEMultipart("alternative")
-    message["Subject"] = f"Terminanfrage: {appointment_data.get('patient_name', 'Neuer Patient')}"
+    message["Subject"] = subject
     message["From"] = f"Praxis-Assistent <{sender_email}>"
     message["To"] = receiver_email
 
     # Text und HTML anhängen
-    part1 = MIMEText(text_content, "plain", "utf-8")
-    part2 = MIMEText(html_content, "html", "utf-8")
-    message.attach(part1)
-    message.attach(part2)
+    message.attach(MIMEText(text_content, "plain", "utf-8"))
+    message.attach(MIMEText(html_content, "html", "utf-8"))
+    return message
 
-    # Email senden
-    try:
-        print("Verbinde mit Gmail...")
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.set_debuglevel(0)
 
-        print("Starte TLS...")
-        server.starttls()
+def build_appointment_message(appointment_data, sender_email, receiver_email):
+    """
+    Baut die MIME-Nachricht (Text + HTML) fuer eine Terminanfrage
+    """
+    return _mime_message(*render_appointment(appointment_data), sender_email, receiver_email)
 
-        print("Login...")
-        server.login(sender_email, sender_password)
 
-        print("Sende Email...")
-        server.sendmail(sender_email, receiver_email, message.as_string())
+def build_digest_message(appointments, sender_email, receiver_email, attachments=None):
+    """
+    Eine MIME-Nachricht mit einer Tabelle aller uebergebenen Terminanfragen
+    und denselben Daten als Anhang (attachments: Formate, Default DIGEST_ATTACHMENTS)
+    """
+    now = datetime.now()
+    attachments = DIGEST_ATTACHMENTS if attachments is None else attachments
+    body = _mime_message(*render_digest(appointments, now), sender_email, receiver_email)
+    if not attachments:
+        return body
+
+    message = MIMEMultipart("mixed")
+    for header in ("Subject", "From", "To"):
+        message[header] = body[header]
+        del body[header]
+    message.attach(body)
+    for fmt in attachments:
+        filename, maintype, subtype, content = render_attachment(appointments, fmt, now)
+        if maintype == "text":
+            part = MIMEText(content, subtype, "utf-8")
+        else:
+            part = MIMEApplication(content.encode("utf-8"), subtype)
+        part.add_header("Content-Disposition", "attachment", filename=filename)
+        message.attach(part)
+    return message
+
+
+def _error_result(e):
+    if isinstance(e, smtplib.SMTPAuthenticationError):
+        error_msg = "Gmail Login fehlgeschlagen. Checke GMAIL_ADDRESS und GMAIL_APP_PASSWORD in .env"
+        logger.error(error_msg)
+        return {"success": False, "error": error_msg}
 
-        print("Verbindung geschlossen.")
-        server.quit()
+    logger.error("Fehler beim Email-Versand: %s", e)
+    return {
+        "success": False,
+        "error": str(e),
+        "message": "Email konnte nicht versendet werden"
+    }
 
-        print("Email erfolgreich versendet!")
 
-        return {
-            "success": True,
-            "message": "Email erfolgreich versendet"
-        }
+def _send_messages(messages, pool, span):
+    """
+    Sendet die MIME-Nachrichten ueber eine gemeinsame SMTP-Session,
+    ein Ergebnis-Dict pro Nachricht
+    """
+    sender_email = os.getenv('GMAIL_ADDRESS')
+    receiver_email = os.getenv('PRAXIS_EMAIL')
 
-    except smtplib.SMTPAuthenticationError:
-        error_msg = "Gmail Login fehlgeschlagen. Checke GMAIL_ADDRESS und GMAIL_APP_PASSWORD in .env"
-        print(f"FEHLER: {error_msg}")
-        return {"success": False, "error": error_msg}
+    results = [None] * len(messages)
+    pending = list(range(len(messages)))
+    # Eine eingeschlafene Session bricht erst beim Senden ab: dann einmal neu verbinden
+    for attempt in range(2):
+        if attempt:
+            span.set("retries", attempt)
+            telemetry.count("docbot_smtp_retries_total")
+        try:
+            with pool.connection(fresh=attempt > 0) as server:
+                while pending:
+                    i = pending[0]
+                    try:
+                        logger.debug("Sende Email an %s", receiver_email)
+                        server.sendmail(sender_email, receiver_email, messages[i].as_string())
+                        results[i] = {"success": True, "message": "Email erfolgreich versendet"}
+                    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                        # Fehler nur fuer diese Nachricht, Session bleibt nutzbar
+                        pool.stats["failures"] += 1
+                        results[i] = _error_result(e)
+                    pending.pop(0)
+            break
+        except smtplib.SMTPServerDisconnected as e:
+            if attempt == 1:
+                for i in pending:
+                    results[i] = _error_result(e)
+        except Exception as e:
+            for i in pending:
+                results[i] = _error_result(e)
+            break
+
+    sent = sum(1 for r in results if r["success"])
+    span.set("sent", sent)
+    telemetry.count("docbot_emails_sent_total", sent)
+    return results
+
+
+def send_appointment_emails(batch, pool=None):
+    """
+    Sendet mehrere Terminanfragen ueber eine gemeinsame SMTP-Session.
+    batch: Liste von (appointment_data, conversation_history).
+    Gibt pro Eintrag ein Ergebnis-Dict zurueck.
+    """
+    pool = pool or get_pool()
+    sender_email = os.getenv('GMAIL_ADDRESS')
+    receiver_email = os.getenv('PRAXIS_EMAIL')
 
-    except Exception as e:
-        print(f"FEHLER beim Email-Versand: {e}")
-        return {
-            "success": False,
-            "error": str(e),
-            "message": "Email konnte nicht versendet werden"
-        }
+    with telemetry.span("send_appointment_email", batch_size=len(batch)) as span:
+        messages = [
+            build_appointment_message(appointment_data, sender_email, receiver_email)
+            for appointment_data, _ in batch
+        ]
+        results = _send_messages(messages, pool, span)
+    sent = sum(1 for r in results if r["success"])
+    if sent:
+        logger.info("%d von %d Emails erfolgreich versendet", sent, len(batch))
+    return results
+
+
+def send_appointment_digest(batch, pool=None):
+    """
+    Sendet alle Terminanfragen aus batch als eine Digest-Email.
+    Gleiche Schnittstelle wie send_appointment_emails: ein Ergebnis pro
+    Eintrag, alle mit dem Ergebnis der einen Nachricht.
+    """
+    pool = pool or get_pool()
+    sender_email = os.getenv('GMAIL_ADDRESS')
+    receiver_email = os.getenv('PRAXIS_EMAIL')
+
+    with telemetry.span("send_appointment_digest", batch_size=len(batch)) as span:
+        message = build_digest_message([appointment_data for appointment_data, _ in batch], sender_email,
+                                       receiver_email)
+        result = _send_messages([message], pool, span)[0]
+    if result["success"]:
+        telemetry.count("docbot_email_digests_total")
+        logger.info("Digest mit %d Terminanfragen versendet", len(batch))
+    return [result] * len(batch)
+
+
+def send_appointment_email(appointment_data, conversation_history):
+    """
+    Sendet Email via Gmail SMTP (kein SSL-Problem!)
+    """
+    return send_appointment_emails([(appointment_data, conversation_history)])[0]
 
 
 # Test-Funktion
 if __name__ == "__main__":
+    telemetry.configure_logging()
+
     print("=" * 60)
     print("TESTE GMAIL SMTP EMAIL-VERSAND")
     print("=" * 60 + "\n")
@@ -0,0 +1,339 @@
+import csv
+import hashlib
+import html
+import io
+import json
+import re
+from datetime import datetime, timezone
+from string import Template
+
+# Vorlagen fuer die Praxis-Emails. Jede Vorlage wird beim Import einmal in
+# feste Textstuecke und Platzhalter zerlegt; pro Email werden nur noch die
+# (HTML-escapten) Werte eingesetzt und alles mit einem join zusammengefuegt.
+# Einzel-Anfrage und Digest (viele Anfragen in einer Email) teilen sich Layout
+# und CSS. Der Digest bekommt zusaetzlich einen maschinenlesbaren Anhang
+# (CSV, ICS oder JSON) fuer die Praxis-Software.
+
+NOT_GIVEN = "Nicht angegeben"
+NOT_SPECIFIED = "Nicht spezifiziert"
+
+STYLE = """
+body { font-family: Arial, sans-serif; line-height: 1.6; color: #333; }
+.header { background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 20px;
+          border-radius: 8px 8px 0 0; }
+.content { padding: 20px; background: #ffffff; }
+.info-box { background: #f5f5f5; padding: 15px; margin: 10px 0; border-left: 4px solid #667eea; border-radius: 4px; }
+.label { font-weight: bold; color: #667eea; }
+.footer { margin-top: 30px; padding-top: 20px; border-top: 1px solid #ddd; color: #666; font-size: 12px; }
+table.digest { border-collapse: collapse; width: 100%; font-size: 14px; }
+table.digest th { background: #667eea; color: white; text-align: left; padding: 6px 8px; }
+table.digest td { border-bottom: 1px solid #ddd; padding: 6px 8px; vertical-align: top; }
+"""
+
+FOOTER_HTML = """
+<div class="footer">
+    <p>Diese Anfrage wurde automatisch vom virtuellen Praxis-Assistenten erstellt.</p>
+    <p>Bitte kontaktieren Sie den Patienten zeitnah.</p>
+</div>"""
+
+APPOINTMENT_HTML = """<html>
+<head><style>${style}</style></head>
+<body>
+    <div class="header">
+        <h2>Neue Terminanfrage</h2>
+        <p>Eingegangen am ${received}</p>
+    </div>
+
+    <div class="content">
+        <h3>Patienteninformationen:</h3>
+        <div class="info-box">
+            <p><span class="label">Name:</span> ${patient_name}</p>
+            <p><span class="label">Email:</span> ${patient_email}</p>
+            <p><span class="label">Telefon:</span> ${patient_phone}</p>
+        </div>
+
+        <h3>Termindetails:</h3>
+        <div class="info-box">
+            <p><span class="label">Terminwunsch:</span> ${appointment_request}</p>
+            <p><span class="label">Grund:</span> ${reason}</p>
+        </div>
+${notes_block}${footer}
+    </div>
+</body>
+</html>
+"""
+
+NOTES_HTML = """
+        <h3>Zusätzliche Notizen:</h3>
+        <div class="info-box"><p>${notes}</p></div>
+"""
+
+APPOINTMENT_TEXT = """
+NEUE TERMINANFRAGE - ${received}
+
+PATIENTENINFORMATIONEN:
+Name: ${patient_name}
+Email: ${patient_email}
+Telefon: ${patient_phone}
+
+TERMINDETAILS:
+Terminwunsch: ${appointment_request}
+Grund: ${reason}
+Notizen: ${notes}
+
+---
+Automatisch erstellt vom Praxis-Assistenten
+Bitte kontaktieren Sie den Patienten zeitnah
+"""
+
+DIGEST_HTML = """<html>
+<head><style>${style}</style></head>
+<body>
+    <div class="header">
+        <h2>${title}</h2>
+        <p>Zusammengefasst am ${received}</p>
+    </div>
+
+    <div class="content">
+        <table class="digest">
+            <tr><th>#</th><th>Name</th><th>Kontakt</th><th>Terminwunsch</th><th>Grund</th><th>Notizen</th></tr>
+${rows}
+        </table>
+${footer}
+    </div>
+</body>
+</html>
+"""
+
+DIGEST_ROW_HTML = (
+    "            <tr><td>${index}</td><td>${patient_name}</td><td>${contact}</td>"
+    "<td>${appointment_request}</td><td>${reason}</td><td>${notes}</td></tr>\n"
+)
+
+DIGEST_TEXT = """
+${title_upper} - ${received}
+
+${rows}
+---
+Automatisch erstellt vom Praxis-Assistenten
+Bitte kontaktieren Sie die Patienten zeitnah
+"""
+
+DIGEST_ROW_TEXT = """${index}. ${patient_name}
+   Kontakt: ${contact}
+   Terminwunsch: ${appointment_request}
+   Grund: ${reason}
+   Notizen: ${notes}
+"""
+
+
+class CompiledTemplate:
+    """
+    string.Template-Syntax ($name / ${name}), aber nur einmal geparst:
+    render() setzt die Werte in eine vorbereitete Liste und joint sie
+    """
+
+    __slots__ = ("parts", "slots")
+
+    def __init__(self, source, **constants):
+        self.parts = []
+        self.slots = []  # (Index in parts, Name)
+        literal = []
+        position = 0
+        for match in Template.pattern.finditer(source):
+            literal.append(source[position:match.start()])
+            position = match.end()
+            if match.group("escaped") is not None:
+                literal.append("$")
+                continue
+            name = match.group("named") or match.group("braced")
+            if name is None:
+                raise ValueError(f"Ungueltiger Platzhalter in Vorlage: {match.group(0)!r}")
+            if name in constants:
+                # Feste Werte (CSS, Footer) schon beim Kompilieren einsetzen
+                literal.append(constants[name])
+                continue
+            self.parts.append("".join(literal))
+            literal = []
+            self.slots.append((len(self.parts), name))
+            self.parts.append(None)
+        literal.append(source[position:])
+        self.parts.append("".join(literal))
+
+    def render(self, values):
+        parts = list(self.parts)
+        for index, name in self.slots:
+            parts[index] = values[name]
+        return "".join(parts)
+
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_STYLE = _WHITESPACE_RE.sub(" ", STYLE).strip()
+
+appointment_html = CompiledTemplate(APPOINTMENT_HTML, style=_STYLE, footer=FOOTER_HTML)
+appointment_text = CompiledTemplate(APPOINTMENT_TEXT)
+notes_html = CompiledTemplate(NOTES_HTML)
+digest_html = CompiledTemplate(DIGEST_HTML, style=_STYLE, footer=FOOTER_HTML)
+digest_row_html = CompiledTemplate(DIGEST_ROW_HTML)
+digest_text = CompiledTemplate(DIGEST_TEXT)
+digest_row_text = CompiledTemplate(DIGEST_ROW_TEXT)
+
+
+def _text(value):
+    # Felder kommen aus JSON/LLM-Ausgabe: auch None oder Zahlen (z.B. Telefon)
+    return "" if value is None else str(value)
+
+
+def _escape(value):
+    return html.escape(_text(value), quote=True)
+
+
+def appointment_values(appointment_data):
+    """
+    Anzeige-Werte mit Platzhaltern fuer fehlende Angaben (noch nicht escaped)
+    """
+    email = _text(appointment_data.get('patient_email'))
+    phone = _text(appointment_data.get('patient_phone'))
+    return {
+        "patient_name": _text(appointment_data.get('patient_name')) or NOT_GIVEN,
+        "patient_email": email or NOT_GIVEN,
+        "patient_phone": phone or NOT_GIVEN,
+        "contact": " / ".join(value for value in (email, phone) if value) or NOT_GIVEN,
+        "appointment_request": _text(appointment_data.get('appointment_request')) or NOT_SPECIFIED,
+        "reason": _text(appointment_data.get('reason')) or NOT_GIVEN,
+        "notes": _text(appointment_data.get('notes')),
+    }
+
+
+def subject_for(appointment_data):
+    # Header vertragen keine Zeilenumbrueche (Header-Injection)
+    name = _WHITESPACE_RE.sub(" ", _text(appointment_data.get('patient_name')) or "Neuer Patient").strip()
+    return f"Terminanfrage: {name}"
+
+
+def render_appointment(appointment_data, now=None):
+    """
+    (subject, text, html) fuer eine einzelne Terminanfrage
+    """
+    values = appointment_values(appointment_data)
+    now = now or datetime.now()
+
+    text_values = dict(values, received=now.strftime('%d.%m.%Y %H:%M Uhr'), notes=values["notes"] or "Keine")
+    html_values = {key: _escape(value) for key, value in values.items()}
+    html_values["received"] = now.strftime('%d.%m.%Y um %H:%M Uhr')
+    html_values["notes_block"] = notes_html.render(html_values) if values["notes"] else ""
+
+    return subject_for(appointment_data), appointment_text.render(text_values), appointment_html.render(html_values)
+
+
+def render_digest(appointments, now=None):
+    """
+    (subject, text, html) fuer mehrere Terminanfragen in einer Email
+    """
+    now = now or datetime.now()
+    html_rows, text_rows = [], []
+    for index, appointment_data in enumerate(appointments, 1):
+        values = appointment_values(appointment_data)
+        values["index"] = str(index)
+        values["notes"] = values["notes"] or "-"
+        text_rows.append(digest_row_text.render(values))
+        html_rows.append(digest_row_html.render({key: _escape(value) for key, value in values.items()}))
+
+    title = f"{len(appointments)} neue Terminanfrage{'' if len(appointments) == 1 else 'n'}"
+    received = now.strftime('%d.%m.%Y %H:%M Uhr')
+    subject = f"{title} ({received})"
+    text = digest_text.render({"title_upper": title.upper(), "received": received, "rows": "\n".join(text_rows)})
+    html_content = digest_html.render({"title": title, "received": received, "rows": "".join(html_rows)})
+    return subject, text, html_content
+
+
+# Felder im Anhang, in dieser Reihenfolge
+ATTACHMENT_FIELDS = ("patient_name", "patient_email", "patient_phone", "appointment_request", "reason", "notes")
+ATTACHMENT_FORMATS = ("csv", "ics", "json")
+
+
+_CSV_FORMULA_START = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    # Patientenangaben, die mit =, +, -, @ beginnen, fuehrt Excel als Formel aus
+    # (CSV-Injection); ein vorangestelltes ' macht daraus Text
+    text = _text(value)
+    return "'" + text if text.startswith(_CSV_FORMULA_START) else text
+
+
+def _attachment_csv(appointments, now):
+    out = io.StringIO()
+    writer = csv.writer(out, delimiter=";", lineterminator="\r\n")  # Semikolon: deutsches Excel
+    writer.writerow(ATTACHMENT_FIELDS)
+    for appointment_data in appointments:
+        writer.writerow([_csv_cell(appointment_data.get(field)) for field in ATTACHMENT_FIELDS])
+    return out.getvalue()
+
+
+def _attachment_json(appointments, now):
+    records = [{field: appointment_data.get(field) for field in ATTACHMENT_FIELDS} for appointment_data in appointments]
+    return json.dumps(records, ensure_ascii=False, indent=2)
+
+
+def _ics_text(value):
+    return (value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _ics_fold(line):
+    # RFC 5545: hoechstens 75 Oktette pro Zeile, Fortsetzung mit fuehrendem Leerzeichen
+    lines, current, size = [], [], 0
+    for char in line:
+        length = len(char.encode("utf-8"))
+        if size + length > 75:
+            lines.append("".join(current))
+            current, size = [" "], 1
+        current.append(char)
+        size += length
+    lines.append("".join(current))
+    return "\r\n".join(lines)
+
+
+def _attachment_ics(appointments, now):
+    # Der Terminwunsch ist Freitext ("Dienstag 15 Uhr"), daher VTODO ohne Startzeit
+    stamp = now.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//DocBot//Terminanfragen//DE"]
+    for appointment_data in appointments:
+        values = appointment_values(appointment_data)
+        uid = hashlib.sha1(json.dumps(appointment_data, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        description = "\n".join(
+            f"{label}: {values[key]}" for label, key in (
+                ("Kontakt", "contact"), ("Terminwunsch", "appointment_request"), ("Grund", "reason"),
+                ("Notizen", "notes"),
+            ) if values[key]
+        )
+        lines += [
+            "BEGIN:VTODO",
+            f"UID:{uid.hexdigest()}@docbot",
+            f"DTSTAMP:{stamp}",
+            f"SUMMARY:{_ics_text('Terminanfrage: ' + values['patient_name'])}",
+            f"DESCRIPTION:{_ics_text(description)}",
+            "STATUS:NEEDS-ACTION",
+            "END:VTODO",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_ics_fold(line) for line in lines) + "\r\n"
+
+
+_ATTACHMENTS = {
+    "csv": ("text", "csv", _attachment_csv),
+    "ics": ("text", "calendar", _attachment_ics),
+    "json": ("application", "json", _attachment_json),
+}
+
+
+def render_attachment(appointments, fmt, now=None):
+    """
+    (Dateiname, Haupttyp, Untertyp, Inhalt) des Digest-Anhangs im Format fmt
+    """
+    if fmt not in _ATTACHMENTS:
+        raise ValueError(f"Unbekanntes Anhang-Format: {fmt!r} (erlaubt: {', '.join(ATTACHMENT_FORMATS)})")
+    now = now or datetime.now()
+    maintype, subtype, render = _ATTACHMENTS[fmt]
+    return f"terminanfragen_{now.strftime('%Y%m%d_%H%M')}.{fmt}", maintype, subtype, render(appointments, now)
@@ -1,5 +1,13 @@
-import ollama
 import json
+import logging
+import os
+import re
+import threading
+
+import telemetry
+from llm_backends import get_backend
+
+logger = logging.getLogger(__name__)
 
 EXTRACTION_PROMPT = """
 Analysiere diese Konversation zwischen Patient und Zahnarztpraxis-Assistent.
@@ -29,46 +37,538 @@ Antworte NUR mit einem JSON-Objekt in diesem Format:
 Wenn eine Information nicht in der Konversation vorhanden ist, nutze null.
 """
 
+# Kurzer Prompt fuer das laufende Update nach jedem Turn: nur die neuen
+# Nachrichten + der bisherige Stand, Antwort ist nur das Delta.
+DELTA_PROMPT = """
+Bisher bekannte Daten zur Terminanfrage (JSON):
+{record}
 
-def extract_appointment_info(conversation_history):
-    """
-    Extrahiert strukturierte Daten aus der Konversation
-    """
-    # Konversation formatieren
-    conversation_text = "\n".join([
+Neue Nachrichten:
+{conversation}
+
+Welche Felder (patient_name, patient_email, patient_phone, appointment_request,
+reason, notes) sind durch die neuen Nachrichten neu oder geändert?
+Antworte NUR mit einem JSON-Objekt, das genau diese Felder enthält, z.B.
+{{"patient_name": "Max Mustermann"}}. Wenn nichts Neues dabei ist: {{}}
+"""
+
+# Kleiner Prompt fuer die Felder, die der Regel-Extraktor nicht gefunden hat
+FIELDS_PROMPT = """
+Analysiere diese Konversation zwischen Patient und Zahnarztpraxis-Assistent.
+
+KONVERSATION:
+{conversation}
+
+Extrahiere NUR diese Felder (falls vorhanden):
+{fields}
+
+Antworte NUR mit einem JSON-Objekt mit genau diesen Schlüsseln.
+Wenn eine Information nicht in der Konversation vorhanden ist, nutze null.
+"""
+
+FIELD_DESCRIPTIONS = {
+    "patient_name": "Vollständiger Name des Patienten",
+    "patient_email": "Email-Adresse",
+    "patient_phone": "Telefonnummer",
+    "appointment_request": "Gewünschter Termin oder Zeitraum",
+    "reason": "Grund des Besuchs (z.B. Zahnreinigung, Schmerzen, Kontrolle)",
+    "notes": "Andere wichtige Details",
+}
+
+APPOINTMENT_FIELDS = [
+    "patient_name",
+    "patient_email",
+    "patient_phone",
+    "appointment_request",
+    "reason",
+    "notes",
+]
+
+
+def empty_record():
+    return {field: None for field in APPOINTMENT_FIELDS}
+
+
+def format_conversation(conversation_history):
+    return "\n".join([
         f"{'Patient' if msg['role'] == 'user' else 'Assistent'}: {msg['content']}"
         for msg in conversation_history
-        if msg['role'] in ['user', 'model']
+        if msg['role'] in ['user', 'model', 'assistant']
     ])
 
-    prompt = EXTRACTION_PROMPT.format(conversation=conversation_text)
 
+# ---------- Schema, JSON-Reparatur und Validierung ----------
+
+# Backends, die es können (Ollama format=<schema>, OpenAI-kompatible
+# json_schema), erzeugen damit nur noch gültiges JSON mit genau diesen Feldern.
+# Für alle anderen repariert repair_json abgeschnittene oder verpackte Antworten,
+# und nur ungültige Felder werden noch einmal nachgefragt.
+EXTRACTION_RETRIES = int(os.getenv("EXTRACTION_RETRIES", "1"))
+
+FIELD_MAX_LENGTH = 200
+NOTES_MAX_LENGTH = 500
+
+
+def appointment_schema(fields=APPOINTMENT_FIELDS, required=True):
+    """
+    JSON-Schema für (einen Teil der) Termindaten: jedes Feld String oder null
+    """
+    return {
+        "type": "object",
+        "properties": {field: {"type": ["string", "null"]} for field in fields},
+        "required": list(fields) if required else [],
+        "additionalProperties": False,
+    }
+
+
+APPOINTMENT_SCHEMA = appointment_schema()
+DELTA_SCHEMA = appointment_schema(required=False)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "responses": 0,       # Modellantworten mit JSON-Erwartung
+    "parsed": 0,          # direkt gültiges JSON
+    "repaired": 0,        # erst nach repair_json lesbar
+    "unparseable": 0,     # auch repariert kein JSON-Objekt
+    "invalid_fields": 0,  # Felder mit falschem Typ/Format oder abgeschnitten
+    "retries": 0,         # Nachfragen nur für ungültige Felder
+    "retried_fields": 0,
+    "unresolved_fields": 0,
+}
+
+
+def _count(key, value=1):
+    with _stats_lock:
+        _stats[key] += value
+
+
+def extraction_stats():
+    """
+    Zähler seit Prozessstart plus Parse-Fehlerquote (vor/nach Reparatur)
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    responses = stats["responses"] or 1
+    stats["raw_failure_rate"] = round((stats["repaired"] + stats["unparseable"]) / responses, 4)
+    stats["failure_rate"] = round(stats["unparseable"] / responses, 4)
+    return stats
+
+
+def reset_extraction_stats():
+    with _stats_lock:
+        for key in _stats:
+            _stats[key] = 0
+
+
+_TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+_DANGLING_RE = re.compile(r'(?:([{,])\s*"(?:[^"\\]|\\.)*"\s*:?|,|:)\s*$')
+
+
+def repair_json(text):
+    """
+    Liest ein JSON-Objekt aus einer Modellantwort, auch mit ```json-Block,
+    Text drumherum, Komma am Ende oder abgeschnitten (max_tokens).
+    Gibt (dict, repariert) zurück; ein abgeschnittener letzter Wert fliegt
+    raus, statt halb übernommen zu werden. ValueError wenn nichts zu retten ist.
+    """
+    start = text.find("{")
+    if start == -1:
+        raise ValueError("Kein JSON-Objekt in der Antwort")
+    end = text.rfind("}")
+    if end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+            if isinstance(data, dict):
+                return data, start > 0 or end < len(text.rstrip()) - 1
+        except ValueError:
+            pass
+
+    # Klammern und Strings mitzählen und am Ende sauber schließen
+    fragment = text[start:]
+    stack, in_string, escaped, last_string_start = [], False, False, 0
+    for i, char in enumerate(fragment):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string, last_string_start = True, i
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+            if not stack:
+                fragment = fragment[:i + 1]
+                break
+
+    if in_string:
+        # Abgeschnittener String: bis vor den Anfang dieses Strings zurück
+        fragment = fragment[:last_string_start]
+    # Hängende Kommas und Schlüssel ohne Wert entfernen
+    previous = None
+    while previous != fragment:
+        previous = fragment
+        fragment = _DANGLING_RE.sub(r"\1", fragment.rstrip())
+    fragment = _TRAILING_COMMA_RE.sub(r"\1", fragment + "".join(reversed(stack)))
     try:
-        response = ollama.generate(
-            model="gemma3:4b",
-            prompt=prompt,
-            format="json"
-        )
+        data = json.loads(fragment)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        # Letzter Versuch: einzelne "feld": "wert"-Paare
+        data = {
+            key: json.loads(value)
+            for key, value in re.findall(r'"(\w+)"\s*:\s*("(?:[^"\\]|\\.)*"|null)', text[start:])
+        }
+        if not data:
+            raise ValueError("JSON nicht reparierbar")
+    return data, True
+
+
+def _valid_value(field, value):
+    if field == "patient_email":
+        return bool(EMAIL_RE.fullmatch(value))
+    if field == "patient_phone":
+        return sum(char.isdigit() for char in value) >= 6 and not EMAIL_RE.search(value)
+    return len(value) <= (NOTES_MAX_LENGTH if field == "notes" else FIELD_MAX_LENGTH)
+
+
+def validate_fields(data, fields):
+    """
+    Prüft die angefragten Felder gegen das Schema.
+    Gibt (gültige Werte, Namen der fehlenden/ungültigen Felder) zurück.
+    """
+    valid, invalid = {}, []
+    for field in fields:
+        if field not in data:
+            invalid.append(field)
+            continue
+        value = data[field]
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and field == "patient_phone":
+            value = str(value)
+        if value is None or (isinstance(value, str) and value.strip().lower() in ("", "null", "none")):
+            valid[field] = None
+        elif isinstance(value, str) and _valid_value(field, value.strip()):
+            valid[field] = value.strip()
+        else:
+            invalid.append(field)
+    return valid, invalid
+
+
+def parse_fields(text, fields):
+    """
+    Modellantwort -> (gültige Felder, ungültige Felder), zählt Parse-Statistik
+    """
+    _count("responses")
+    try:
+        data, repaired = repair_json(text)
+    except ValueError:
+        _count("unparseable")
+        telemetry.count("docbot_extraction_parse_total", result="failed")
+        return {}, list(fields)
+    _count("repaired" if repaired else "parsed")
+    telemetry.count("docbot_extraction_parse_total", result="repaired" if repaired else "parsed")
+    valid, invalid = validate_fields(data, fields)
+    # Felder, die das Modell gar nicht geliefert hat, zählen erst beim Nachfragen
+    _count("invalid_fields", sum(1 for field in invalid if field in data))
+    return valid, invalid
+
+
+def parse_delta(text):
+    """
+    Liest das JSON-Delta aus der Modellantwort (auch mit ```json-Block drumherum
+    oder abgeschnitten). Ungültige Felder werden verworfen.
+    """
+    try:
+        data, _ = repair_json(text)
+    except ValueError:
+        return {}
+    valid, _ = validate_fields(data, [field for field in APPOINTMENT_FIELDS if field in data])
+    return {key: value for key, value in valid.items() if value is not None}
+
 
-        # JSON parsen
-        data = json.loads(response['response'])
-        return data
+def apply_delta(record, delta):
+    for key, value in delta.items():
+        if key == "notes" and record.get("notes") and value not in record["notes"]:
+            record["notes"] = f"{record['notes']}; {value}"
+        else:
+            record[key] = value
+    return record
 
+
+def record_has_core_fields(record):
+    """
+    Name, Kontakt und Terminwunsch vorhanden - dann reicht der laufende Stand
+    """
+    return bool(
+        record.get("patient_name")
+        and (record.get("patient_email") or record.get("patient_phone"))
+        and record.get("appointment_request")
+    )
+
+
+# ---------- Regel-basierte Extraktion (ohne LLM) ----------
+
+_NAME_PART = r'[A-ZÄÖÜ][a-zäöüß]+(?:-[A-ZÄÖÜ][a-zäöüß]+)?'
+
+EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+# Satzzeichen am Ende ("0521 123456.") gehören nicht zur Nummer, ".5" oder ":30" schon
+PHONE_RE = re.compile(r'(?<![\w.])(?:\+49|0049|0)\s*[/-]?\s*\(?\d{2,5}\)?(?:\s*[/-]?\s*\d{2,}){1,4}(?![\w:]|\.\d)')
+NAME_INTRO_RE = re.compile(
+    r'(?i:ich hei(?:ß|ss)e|mein name ist|mein name:|name:|ich bin)\s+(' + _NAME_PART + r'(?:\s+' + _NAME_PART + r'){0,2})'
+)
+BARE_NAME_RE = re.compile(r'^\s*(' + _NAME_PART + r'(?:\s+' + _NAME_PART + r'){1,2})\s*[.!]?\s*$')
+TIME_RE = re.compile(
+    r'(?:(?:am|um|ab|gegen|diese|nächste[nr]?|naechste[nr]?|kommende[nr]?|woche|'
+    r'montag|dienstag|mittwoch|donnerstag|freitag|samstag|'
+    r'übermorgen|uebermorgen|(?<!guten )morgen|heute|vormittags?|nachmittags?|abends?|früh|'
+    r'\d{1,2}[:.]\d{2}(?:\s?uhr)?|\d{1,2}\s?uhr|\d{1,2}\.\d{1,2}\.(?:\d{2,4})?)(?:[\s,]+|[.!?;]+(?:\s+|$)|$))+',
+    re.IGNORECASE,
+)
+TIME_DATE_END_RE = re.compile(r'\d{1,2}\.\d{1,2}\.$')
+# Mindestens ein "echtes" Zeitwort, sonst ist "am" oder "um" allein kein Terminwunsch
+TIME_ANCHOR_RE = re.compile(
+    r'montag|dienstag|mittwoch|donnerstag|freitag|samstag|morgen|heute|woche|vormittag|nachmittag|abend|\d',
+    re.IGNORECASE,
+)
+
+REASON_PATTERNS = [
+    (re.compile(r'zahnreinigung|prophylaxe|pzr\b', re.IGNORECASE), "Zahnreinigung"),
+    (re.compile(r'schmerz|tut weh|zahnweh', re.IGNORECASE), "Schmerzen"),
+    (re.compile(r'kontrolle|vorsorge|check-?up|untersuchung', re.IGNORECASE), "Kontrolle"),
+    (re.compile(r'füllung|fuellung|karies|plombe|loch im zahn', re.IGNORECASE), "Füllung"),
+    (re.compile(r'abgebrochen|ausgebrochen', re.IGNORECASE), "Zahn abgebrochen"),
+    (re.compile(r'weisheitsz', re.IGNORECASE), "Weisheitszahn"),
+    (re.compile(r'zahnfleisch', re.IGNORECASE), "Zahnfleischprobleme"),
+    (re.compile(r'krone', re.IGNORECASE), "Krone"),
+    (re.compile(r'implantat', re.IGNORECASE), "Implantat"),
+    (re.compile(r'bleaching|aufhellung', re.IGNORECASE), "Bleaching"),
+]
+
+# Woerter, die wie ein Name aussehen, aber keiner sind
+_NOT_NAMES = {
+    "hallo", "guten", "tag", "morgen", "abend", "danke", "bitte", "ja", "nein", "gerne", "okay",
+    "montag", "dienstag", "mittwoch", "donnerstag", "freitag", "samstag", "sonntag",
+    "nächste", "naechste", "woche", "zahnreinigung", "kontrolle", "schmerzen", "termin",
+}
+
+
+def _extract_name(message, previous_assistant):
+    match = NAME_INTRO_RE.search(message)
+    if match:
+        words = match.group(1).split()
+    else:
+        # Nackte Antwort "Max Mustermann" nur, wenn vorher nach dem Namen gefragt wurde
+        match = BARE_NAME_RE.match(message)
+        if not match or "name" not in previous_assistant.lower():
+            return None
+        words = match.group(1).split()
+    words = [w for w in words if w.lower() not in _NOT_NAMES]
+    return " ".join(words) if words else None
+
+
+def _clean_time(text):
+    # Satzende abschneiden, den Punkt eines Datums ("am 12.03.") aber stehen lassen
+    text = text.strip().rstrip(" ,!?;")
+    if text.endswith(".") and not TIME_DATE_END_RE.search(text):
+        text = text.rstrip(".")
+    return text
+
+
+def extract_rules(conversation_history):
+    """
+    Schnelle, deterministische Extraktion per Regex. Füllt nur was eindeutig
+    erkennbar ist, alles andere bleibt None. Spätere Nachrichten überschreiben
+    frühere (Korrekturen des Patienten).
+    """
+    record = empty_record()
+    previous_assistant = ""
+
+    for msg in conversation_history:
+        if msg['role'] != 'user':
+            previous_assistant = msg['content']
+            continue
+        text = msg['content']
+
+        name = _extract_name(text, previous_assistant)
+        if name:
+            record["patient_name"] = name
+
+        email = EMAIL_RE.search(text)
+        if email:
+            record["patient_email"] = email.group(0).rstrip(".")
+
+        # Emails vor der Telefonsuche entfernen (Ziffern im Local-Part)
+        phone = PHONE_RE.search(EMAIL_RE.sub(" ", text))
+        if phone:
+            record["patient_phone"] = phone.group(0).strip()
+
+        times = [_clean_time(m.group(0)) for m in TIME_RE.finditer(text) if TIME_ANCHOR_RE.search(m.group(0))]
+        if times:
+            record["appointment_request"] = max(times, key=len)
+
+        for pattern, reason in REASON_PATTERNS:
+            if pattern.search(text):
+                record["reason"] = reason
+                break
+
+    return record
+
+
+def missing_fields(record):
+    """
+    Felder, die noch ein LLM brauchen. Email/Telefon gelten als ein Kontakt-Slot.
+    """
+    missing = [
+        field for field in ("patient_name", "appointment_request", "reason")
+        if not record.get(field)
+    ]
+    if not record.get("patient_email") and not record.get("patient_phone"):
+        missing += ["patient_email", "patient_phone"]
+    return missing
+
+
+def _delta_prompt(record, new_messages):
+    """
+    Regeln anwenden; Prompt für den LLM-Aufruf oder None, wenn nichts mehr fehlt
+    """
+    rules = extract_rules(new_messages)
+    apply_delta(record, {key: value for key, value in rules.items() if value})
+    if not missing_fields(record):
+        return None
+    return DELTA_PROMPT.format(
+        record=json.dumps(record, ensure_ascii=False),
+        conversation=format_conversation(new_messages),
+    )
+
+
+def update_appointment_record(record, new_messages, generate):
+    """
+    Aktualisiert den laufenden Datensatz: erst per Regeln, dann nur falls noch
+    etwas fehlt mit einem kleinen LLM-Aufruf.
+    generate(prompt, schema=...) muss den Antworttext (JSON) zurückgeben;
+    ohne generate nur die Regeln.
+    """
+    prompt = _delta_prompt(record, new_messages)
+    if prompt is None or generate is None:
+        return record
+
+    try:
+        with telemetry.span("llm_generate_json", prompt="delta"):
+            delta = parse_delta(generate(prompt, schema=DELTA_SCHEMA))
     except Exception as e:
-        print(f"FEHLER beim Extrahieren: {e}")
-        # Fallback: Rohe Konversation als Notiz
-        return {
-            "patient_name": None,
-            "patient_email": None,
-            "patient_phone": None,
-            "appointment_request": None,
-            "reason": None,
-            "notes": conversation_text[:500]
-        }
+        logger.warning("Fehler beim Aktualisieren der Termindaten: %s", e)
+        return record
+
+    return apply_delta(record, delta)
+
+
+async def aupdate_appointment_record(record, new_messages, agenerate):
+    """
+    Wie update_appointment_record mit agenerate (z.B. backend.agenerate_json).
+    Wird der Aufruf abgebrochen, bleibt der Stand nach den Regeln.
+    """
+    prompt = _delta_prompt(record, new_messages)
+    if prompt is None or agenerate is None:
+        return record
+
+    try:
+        with telemetry.span("llm_generate_json", prompt="delta"):
+            delta = parse_delta(await agenerate(prompt, schema=DELTA_SCHEMA))
+    except Exception as e:
+        logger.warning("Fehler beim Aktualisieren der Termindaten: %s", e)
+        return record
+
+    return apply_delta(record, delta)
+
+
+def _fields_prompt(conversation_text, fields):
+    return FIELDS_PROMPT.format(
+        conversation=conversation_text,
+        fields="\n".join(f"- {field}: {FIELD_DESCRIPTIONS[field]}" for field in fields),
+    )
+
+
+def _extract_llm(conversation_text, fields=None, backend=None, retries=None):
+    """
+    LLM-Extraktion. Ohne fields der volle EXTRACTION_PROMPT, sonst nur die
+    angegebenen Felder mit dem kleinen FIELDS_PROMPT. Ungültige Felder werden
+    einzeln nachgefragt; ValueError, wenn am Ende gar nichts gültig ist.
+    """
+    backend = backend or get_backend()
+    retries = EXTRACTION_RETRIES if retries is None else retries
+    requested = APPOINTMENT_FIELDS if fields is None else list(fields)
+    if fields is None:
+        prompt = EXTRACTION_PROMPT.format(conversation=conversation_text)
+    else:
+        prompt = _fields_prompt(conversation_text, requested)
+
+    with telemetry.span("llm_generate_json", backend=backend.name, prompt="full" if fields is None else "fields"):
+        data, invalid = parse_fields(
+            backend.generate_json(prompt, max_tokens=512, schema=appointment_schema(requested)), requested
+        )
+
+    for _ in range(retries):
+        if not invalid:
+            break
+        _count("retries")
+        _count("retried_fields", len(invalid))
+        telemetry.count("docbot_extraction_retries_total")
+        with telemetry.span("llm_generate_json", backend=backend.name, prompt="retry", fields=len(invalid)):
+            retry_data, invalid = parse_fields(
+                backend.generate_json(_fields_prompt(conversation_text, invalid), max_tokens=256,
+                                      schema=appointment_schema(invalid)),
+                invalid,
+            )
+        data.update(retry_data)
+
+    if invalid:
+        _count("unresolved_fields", len(invalid))
+        if not data:
+            raise ValueError(f"Keine gültige Extraktion, ungültig: {', '.join(invalid)}")
+        logger.warning("Felder nach Nachfrage weiter ungültig: %s", ", ".join(invalid))
+    return data
+
+
+def extract_appointment_info(conversation_history, use_rules=True, backend=None, strict=False):
+    """
+    Extrahiert strukturierte Daten aus der Konversation.
+    Regeln zuerst, das LLM nur noch für die Felder, die dann noch fehlen.
+    Ohne backend wird LLM_BACKEND aus der .env genutzt (Default Ollama).
+    strict=True wirft bei Fehlern, statt auf die Notiz-Variante auszuweichen.
+    """
+    # Konversation formatieren
+    conversation_text = format_conversation(conversation_history)
+
+    data = extract_rules(conversation_history) if use_rules else empty_record()
+    with telemetry.span("extract_appointment_info", turns=len(conversation_history)):
+        try:
+            missing = missing_fields(data) if use_rules else APPOINTMENT_FIELDS
+            if not missing:
+                return data
+
+            llm_data = _extract_llm(conversation_text, missing + ["notes"] if use_rules else None, backend)
+            for field, value in llm_data.items():
+                if value:
+                    data[field] = value
+            return data
+
+        except Exception as e:
+            logger.error("Fehler beim Extrahieren: %s", e)
+            telemetry.count("docbot_extraction_failures_total")
+            if strict:
+                raise
+            # Fallback: was die Regeln gefunden haben plus rohe Konversation als Notiz
+            data["notes"] = conversation_text[:500]
+            return data
 
 
 # Test-Funktion
 if __name__ == "__main__":
+    telemetry.configure_logging()
     # Test mit Beispiel-Konversation
     test_history = [
         {"role": "user", "content": "Hallo ich brauche einen Termin"},
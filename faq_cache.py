@@ -0,0 +1,166 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Antworten auf Standardfragen (Öffnungszeiten, Adresse, Telefon, Notfall)
+# ohne LLM-Aufruf. Zwei Stufen:
+#   1. Intent-Matcher mit festen Antworten aus den PRAXIS-INFOS
+#   2. Cache der erkannten Fragen (exakter Schlüssel, dann Ähnlichkeit), damit
+#      Umformulierungen, die die Muster verpassen, dieselbe feste Antwort bekommen
+# Modell-Antworten kommen nie in den Cache: sie können persönliche Daten
+# enthalten und dürfen nicht an andere Patienten gehen.
+FAQ_CACHE_SIZE = int(os.getenv("FAQ_CACHE_SIZE", "256"))
+FAQ_CACHE_TTL = float(os.getenv("FAQ_CACHE_TTL", "3600"))
+FAQ_SIMILARITY = float(os.getenv("FAQ_SIMILARITY", "0.8"))
+
+FAQ_ANSWERS = {
+    "oeffnungszeiten": (
+        "Unsere Öffnungszeiten: Mo-Fr 8-12 Uhr und 14-18 Uhr, Mittwochnachmittag ist geschlossen. "
+        "Möchten Sie einen Termin vereinbaren?"
+    ),
+    "adresse": (
+        "Sie finden uns in der Musterstraße 123, 33602 Lüneburg. "
+        "Möchten Sie einen Termin vereinbaren?"
+    ),
+    "telefon": (
+        "Sie erreichen die Praxis telefonisch unter 0521-12345678. "
+        "Gerne kann ich auch hier eine Terminanfrage für Sie aufnehmen."
+    ),
+    "notfall": (
+        "Bei einem Notfall rufen Sie bitte sofort die 112 an. "
+        "Während der Öffnungszeiten erreichen Sie die Praxis unter 0521-12345678."
+    ),
+}
+
+# Notfall zuerst: "Notfall, wann haben Sie offen?" soll die 112 bekommen.
+# Die Muster sind bewusst eng: eine feste Antwort überspringt das Modell, also
+# nur bei eindeutigen Fragen an die Praxis. Symptome ("geschwollen"), Rückruf-
+# wünsche ("rufen Sie mich an") oder "wo liegt das Problem" gehen ans Modell.
+FAQ_INTENTS = [
+    ("notfall", re.compile(r'(?<!\bkein )(?<!\bkeinen )\bnot(?:fall|dienst)', re.IGNORECASE)),
+    ("oeffnungszeiten", re.compile(
+        r'öffnungszeit|oeffnungszeit|sprechzeit|geöffnet|geoeffnet|\bgeschlossen\b|'
+        r'\b(?:haben|sind) sie (?:\w+ ){0,2}(?:offen|auf)\b',
+        re.IGNORECASE,
+    )),
+    ("adresse", re.compile(
+        r'\b(?:ihre|eure|die) (?:adresse|anschrift)\b|\bpraxisadresse|(?:adresse|anschrift) der praxis|'
+        r'\banfahrt|wo (?:ist|liegt|finde ich) (?:ihre|die|eure) praxis|wie komme ich zu (?:ihnen|euch|der praxis)|'
+        r'\bparkpl',
+        re.IGNORECASE,
+    )),
+    ("telefon", re.compile(
+        r'\b(?:ihre|eure) (?:telefon)?nummer|(?:telefon)?nummer der praxis|\bpraxisnummer|'
+        r'wie (?:erreiche ich|kann ich) (?:sie|euch|die praxis)(?: telefonisch)?(?: erreichen)?\b',
+        re.IGNORECASE,
+    )),
+]
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+
+
+def normalize(text):
+    """
+    Cache-Schlüssel: klein, ohne Umlaute und Satzzeichen, einfache Leerzeichen
+    """
+    return " ".join(_NON_WORD_RE.sub(" ", text.lower().translate(_UMLAUTS)).split())
+
+
+def match_intent(text):
+    for intent, pattern in FAQ_INTENTS:
+        if pattern.search(text):
+            return intent
+    return None
+
+
+class ResponseCache:
+    """
+    LRU-Cache mit TTL. Treffer zuerst über den exakten normalisierten
+    Schlüssel, dann über Wort-Ähnlichkeit (Jaccard) zu den gecachten Fragen.
+    """
+
+    def __init__(self, maxsize=FAQ_CACHE_SIZE, ttl=FAQ_CACHE_TTL, similarity=FAQ_SIMILARITY, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.similarity = similarity
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (answer, words, expires_at)
+        self._lock = threading.Lock()
+        self.stats = {"hits_exact": 0, "hits_similar": 0, "hits_intent": 0, "misses": 0, "evictions": 0}
+
+    def get(self, text):
+        key = normalize(text)
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[2] > now:
+                self._entries.move_to_end(key)
+                self.stats["hits_exact"] += 1
+                return entry[0]
+
+            words = set(key.split())
+            best, best_score = None, self.similarity
+            for other, (answer, other_words, expires_at) in list(self._entries.items()):
+                if expires_at <= now:
+                    del self._entries[other]
+                    self.stats["evictions"] += 1
+                    continue
+                union = len(words | other_words)
+                score = len(words & other_words) / union if union else 0.0
+                if score >= best_score:
+                    best, best_score = other, score
+            if best is not None:
+                self._entries.move_to_end(best)
+                self.stats["hits_similar"] += 1
+                return self._entries[best][0]
+        return None
+
+    def put(self, text, answer):
+        key = normalize(text)
+        with self._lock:
+            self._entries[key] = (answer, set(key.split()), self.clock() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = ResponseCache()
+
+
+def get_cache():
+    return _cache
+
+
+def lookup(text, cache=None):
+    """
+    Antwort ohne LLM oder None. Intent vor Cache, damit feste Antworten
+    immer aktuell sind.
+    """
+    cache = cache or _cache
+    intent = match_intent(text)
+    if intent:
+        cache.stats["hits_intent"] += 1
+        cache.put(text, FAQ_ANSWERS[intent])
+        return FAQ_ANSWERS[intent]
+
+    answer = cache.get(text)
+    if answer is None:
+        cache.stats["misses"] += 1
+    return answer
+
+
+def metrics(cache=None):
+    cache = cache or _cache
+    stats = dict(cache.stats)
+    hits = stats["hits_exact"] + stats["hits_similar"] + stats["hits_intent"]
+    total = hits + stats["misses"]
+    stats["size"] = len(cache)
+    stats["hit_rate"] = round(hits / total, 3) if total else 0.0
+    return stats
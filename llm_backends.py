@@ -0,0 +1,379 @@
+import json
+import os
+import random
+import threading
+import time
+
+# Gemeinsame LLM-Schicht fuer Chat und Extraktion. Jedes Backend haelt
+# seinen HTTP-Client (Connection-Pool) selbst, get_backend() cached die
+# Instanzen pro Prozess, damit Verbindungen ueber Turns und Sessions
+# hinweg wiederverwendet werden. Client-Bibliotheken (ollama, huggingface_hub,
+# httpx, asyncio) werden erst beim ersten Anlegen/Aufruf importiert.
+#
+# Auswahl per .env:
+#   LLM_BACKEND=ollama|hf|openai|fake|router
+#   OLLAMA_HOST, OLLAMA_MODEL, OLLAMA_KEEP_ALIVE, OLLAMA_NUM_CTX
+#   HUGGINGFACE_API_KEY, HF_MODEL
+#   OPENAI_BASE_URL, OPENAI_MODEL, OPENAI_API_KEY   (vLLM, llama.cpp-Server, ...)
+#   FAKE_LATENCY, FAKE_JITTER                       (Sekunden)
+#   ROUTER_BACKENDS=ollama,hf                       (Router mit Hedging, siehe router.py)
+
+DEFAULT_BACKEND = "ollama"
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+# Modell zwischen Patienten im Speicher halten, sonst ist der Prompt-Cache weg
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+# Feste Kontextgröße fuer alle Aufrufe: ein abweichendes num_ctx laedt das Modell neu
+OLLAMA_NUM_CTX = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+HF_MODEL = os.getenv("HF_MODEL", "meta-llama/Llama-3.2-3B-Instruct")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+
+def normalize_messages(messages, system_role="system"):
+    """
+    Einheitliche Rollen: "model" wird zu "assistant", der System-Prompt
+    bekommt die Rolle, die das Backend erwartet
+    """
+    normalized = []
+    for msg in messages:
+        role = msg["role"]
+        if role in ("model", "assistant"):
+            role = "assistant"
+        elif role == "system":
+            role = system_role
+        else:
+            role = "user"
+        normalized.append({"role": role, "content": msg["content"]})
+    return normalized
+
+
+class OllamaBackend:
+    """
+    Ollama mit stabilem Prompt-Praefix: echter System-Prompt als erste
+    Nachricht (byte-identisch bei jedem Turn), Historie nur angehaengt,
+    Modell per keep_alive gepinnt. Der Runner kann dann den KV-Cache des
+    gemeinsamen Praefixes wiederverwenden und wertet nur die neuen Turns aus.
+    """
+    name = "ollama"
+
+    def __init__(self, model=None, host=None, system_role="system", keep_alive=None):
+        import ollama
+
+        self.model = model or OLLAMA_MODEL
+        self.host = host or os.getenv("OLLAMA_HOST")
+        self.system_role = system_role
+        self.keep_alive = OLLAMA_KEEP_ALIVE if keep_alive is None else keep_alive
+        self.client = ollama.Client(host=self.host, timeout=LLM_TIMEOUT)
+        self._aclient = None
+        # prompt_eval_count/-duration etc. des letzten Aufrufs (fuer Benchmarks)
+        self.last_stats = {}
+
+    @property
+    def aclient(self):
+        # AsyncClient erst im laufenden Event-Loop anlegen
+        if self._aclient is None:
+            import ollama
+            self._aclient = ollama.AsyncClient(host=self.host, timeout=LLM_TIMEOUT)
+        return self._aclient
+
+    def _options(self, max_tokens):
+        return {"num_predict": max_tokens, "num_ctx": OLLAMA_NUM_CTX}
+
+    def _record_stats(self, response):
+        self.last_stats = {
+            key: response.get(key)
+            for key in ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration", "load_duration")
+        }
+
+    def chat(self, messages, max_tokens=512, stream=False):
+        messages = normalize_messages(messages, self.system_role)
+        if stream:
+            return self._stream(messages, max_tokens)
+        response = self.client.chat(model=self.model, messages=messages, options=self._options(max_tokens),
+                                    keep_alive=self.keep_alive)
+        self._record_stats(response)
+        return response['message']['content']
+
+    def _stream(self, messages, max_tokens):
+        for chunk in self.client.chat(model=self.model, messages=messages, options=self._options(max_tokens),
+                                      keep_alive=self.keep_alive, stream=True):
+            if chunk.get('done'):
+                self._record_stats(chunk)
+            delta = chunk['message']['content']
+            if delta:
+                yield delta
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        # Mit Schema erzwingt Ollama per Grammatik genau diese Struktur
+        response = self.client.generate(model=self.model, prompt=prompt, format=schema or "json",
+                                        options=self._options(max_tokens), keep_alive=self.keep_alive)
+        return response['response']
+
+    def warmup(self, system_prompt):
+        """
+        Laedt das Modell und rechnet den System-Prompt einmal vor
+        """
+        self.chat([{"role": "system", "content": system_prompt}], max_tokens=1)
+
+    async def achat(self, messages, max_tokens=512):
+        response = await self.aclient.chat(model=self.model, messages=normalize_messages(messages, self.system_role),
+                                           options=self._options(max_tokens), keep_alive=self.keep_alive)
+        self._record_stats(response)
+        return response['message']['content']
+
+    async def agenerate_json(self, prompt, max_tokens=256, schema=None):
+        response = await self.aclient.generate(model=self.model, prompt=prompt, format=schema or "json",
+                                               options=self._options(max_tokens), keep_alive=self.keep_alive)
+        return response['response']
+
+
+class HFInferenceBackend:
+    name = "hf"
+
+    def __init__(self, model=None, api_key=None):
+        from huggingface_hub import InferenceClient
+
+        self.model = model or HF_MODEL
+        self.api_key = api_key or os.getenv("HUGGINGFACE_API_KEY")
+        self.client = InferenceClient(api_key=self.api_key, timeout=LLM_TIMEOUT)
+        self._aclient = None
+
+    @property
+    def aclient(self):
+        if self._aclient is None:
+            from huggingface_hub import AsyncInferenceClient
+            self._aclient = AsyncInferenceClient(api_key=self.api_key, timeout=LLM_TIMEOUT)
+        return self._aclient
+
+    def chat(self, messages, max_tokens=512, stream=False):
+        messages = normalize_messages(messages)
+        if stream:
+            return self._stream(messages, max_tokens)
+        response = self.client.chat.completions.create(model=self.model, messages=messages, max_tokens=max_tokens)
+        return response.choices[0].message.content
+
+    def _stream(self, messages, max_tokens):
+        for chunk in self.client.chat.completions.create(model=self.model, messages=messages,
+                                                         max_tokens=max_tokens, stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+    def _json_format(self, schema):
+        # TGI-Grammatik; ohne Schema entscheidet nur der Prompt ueber das Format
+        return {"response_format": {"type": "json", "value": schema}} if schema else {}
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0,
+            **self._json_format(schema),
+        )
+        return response.choices[0].message.content
+
+    async def achat(self, messages, max_tokens=512):
+        response = await self.aclient.chat.completions.create(
+            model=self.model, messages=normalize_messages(messages), max_tokens=max_tokens
+        )
+        return response.choices[0].message.content
+
+    async def agenerate_json(self, prompt, max_tokens=256, schema=None):
+        response = await self.aclient.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=max_tokens,
+            temperature=0,
+            **self._json_format(schema),
+        )
+        return response.choices[0].message.content
+
+
+class OpenAICompatBackend:
+    """
+    Jeder Server mit /v1/chat/completions (vLLM, llama.cpp, LM Studio, ...)
+    """
+    name = "openai"
+
+    def __init__(self, base_url=None, model=None, api_key=None):
+        import httpx
+
+        self.base_url = (base_url or os.getenv("OPENAI_BASE_URL", "http://localhost:8000/v1")).rstrip("/")
+        self.model = model or os.getenv("OPENAI_MODEL", "default")
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self.client = httpx.Client(base_url=self.base_url, headers=self.headers, timeout=LLM_TIMEOUT)
+        self._aclient = None
+
+    @property
+    def aclient(self):
+        if self._aclient is None:
+            import httpx
+            self._aclient = httpx.AsyncClient(base_url=self.base_url, headers=self.headers, timeout=LLM_TIMEOUT)
+        return self._aclient
+
+    def _payload(self, messages, max_tokens, **extra):
+        return {"model": self.model, "messages": normalize_messages(messages), "max_tokens": max_tokens, **extra}
+
+    def chat(self, messages, max_tokens=512, stream=False):
+        if stream:
+            return self._stream(messages, max_tokens)
+        response = self.client.post("/chat/completions", json=self._payload(messages, max_tokens))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    def _stream(self, messages, max_tokens):
+        with self.client.stream("POST", "/chat/completions",
+                                json=self._payload(messages, max_tokens, stream=True)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line.startswith("data: ") or line == "data: [DONE]":
+                    continue
+                choices = json.loads(line[6:]).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    def _json_payload(self, prompt, max_tokens, schema):
+        if schema:
+            response_format = {"type": "json_schema", "json_schema": {"name": "appointment", "schema": schema}}
+        else:
+            response_format = {"type": "json_object"}
+        return self._payload([{"role": "user", "content": prompt}], max_tokens,
+                             temperature=0, response_format=response_format)
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        payload = self._json_payload(prompt, max_tokens, schema)
+        response = self.client.post("/chat/completions", json=payload)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def achat(self, messages, max_tokens=512):
+        response = await self.aclient.post("/chat/completions", json=self._payload(messages, max_tokens))
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+    async def agenerate_json(self, prompt, max_tokens=256, schema=None):
+        payload = self._json_payload(prompt, max_tokens, schema)
+        response = await self.aclient.post("/chat/completions", json=payload)
+        response.raise_for_status()
+        return response.json()["choices"][0]["message"]["content"]
+
+
+class FakeBackend:
+    """
+    Deterministisches Backend fuer Tests und Benchmarks. Fragt wie der echte
+    Assistent nach fehlenden Infos (per Regel-Extraktor) und fasst am Ende
+    mit "Soll ich diese Anfrage weiterleiten?" zusammen.
+    """
+    name = "fake"
+
+    QUESTIONS = {
+        "patient_name": "Gerne! Wie ist Ihr Name?",
+        "patient_email": "Wie können wir Sie erreichen, per Email oder Telefon?",
+        "appointment_request": "Wann hätten Sie Zeit?",
+        "reason": "Worum geht es bei dem Termin?",
+    }
+
+    def __init__(self, latency=None, jitter=None, seed=0, fail_rate=0.0):
+        self.latency = float(os.getenv("FAKE_LATENCY", "0")) if latency is None else latency
+        self.jitter = float(os.getenv("FAKE_JITTER", "0")) if jitter is None else jitter
+        self.fail_rate = fail_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _delay(self):
+        with self._lock:
+            self.calls += 1
+            delay = self.latency + self._rng.uniform(0, self.jitter)
+            fail = self._rng.random() < self.fail_rate
+        return delay, fail
+
+    def _reply(self, messages):
+        from extract_info import extract_rules, missing_fields
+
+        history = [msg for msg in messages if msg["role"] != "system"]
+        record = extract_rules(history)
+        missing = missing_fields(record)
+        # Gleiche Reihenfolge wie im SYSTEM_PROMPT: Name, Kontakt, Termin, Grund
+        for field, question in self.QUESTIONS.items():
+            if field in missing:
+                return question
+        contact = record["patient_email"] or record["patient_phone"]
+        return (
+            f"Vielen Dank! Zusammenfassung: {record['patient_name']}, {contact}, "
+            f"Terminwunsch {record['appointment_request']}, Grund: {record['reason']}. "
+            "Soll ich diese Anfrage weiterleiten?"
+        )
+
+    def chat(self, messages, max_tokens=512, stream=False):
+        delay, fail = self._delay()
+        if stream:
+            return self._stream(messages, delay, fail)
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("FakeBackend: simulierter Fehler")
+        return self._reply(messages)
+
+    def _stream(self, messages, delay, fail):
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("FakeBackend: simulierter Fehler")
+        for word in self._reply(messages).split(" "):
+            yield word + " "
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        delay, fail = self._delay()
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("FakeBackend: simulierter Fehler")
+        return "{}"
+
+    async def achat(self, messages, max_tokens=512):
+        import asyncio
+
+        delay, fail = self._delay()
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("FakeBackend: simulierter Fehler")
+        return self._reply(messages)
+
+    async def agenerate_json(self, prompt, max_tokens=256, schema=None):
+        import asyncio
+
+        delay, fail = self._delay()
+        await asyncio.sleep(delay)
+        if fail:
+            raise RuntimeError("FakeBackend: simulierter Fehler")
+        return "{}"
+
+
+def _router_backend():
+    from router import RouterBackend
+    return RouterBackend()
+
+
+BACKENDS = {
+    "ollama": OllamaBackend,
+    "hf": HFInferenceBackend,
+    "openai": OpenAICompatBackend,
+    "fake": FakeBackend,
+    "router": _router_backend,
+}
+
+_instances = {}
+# RLock: der Router legt seine Backends innerhalb von get_backend an
+_instances_lock = threading.RLock()
+
+
+def get_backend(name=None):
+    """
+    Liefert das (gecachte) Backend. Ohne Namen aus LLM_BACKEND in der .env.
+    """
+    name = name or os.getenv("LLM_BACKEND", DEFAULT_BACKEND)
+    with _instances_lock:
+        if name not in _instances:
+            if name not in BACKENDS:
+                raise ValueError(f"Unbekanntes LLM-Backend: {name} (moeglich: {', '.join(BACKENDS)})")
+            _instances[name] = BACKENDS[name]()
+        return _instances[name]
@@ -0,0 +1,118 @@
+import os
+import re
+
+# Inhaltsfilter für Patientennachrichten. Die Begriffsliste wird einmal beim
+# Import normalisiert und in Hash-Sets abgelegt; pro Nachricht kostet der
+# Check dann nur O(Länge der Nachricht), egal wie viele Begriffe geladen sind.
+#
+# Begriffe matchen nur ganze Wörter (plus übliche Endungen wie "Drogen",
+# "Waffen"), damit "hack" nicht in "Hackfleisch" anschlägt. Ein "*" am Ende
+# macht einen Begriff zum Präfix für Komposita ("selbstmord*" trifft auch
+# "Selbstmordgedanken").
+#
+# Weitere Begriffe: MODERATION_TERMS_FILE=pfad/zur/liste.txt
+# (ein Begriff pro Zeile, "#" leitet Kommentare ein)
+
+BLACKLIST_KEYWORDS = [
+    'crack', 'kokain', 'droge', 'waffe', 'bombe',
+    'mord', 'töten', 'selbstmord*', 'terror*',
+    'hack', 'illegal', 'betrug'
+]
+
+# Endungen, die an einen Begriff angehängt noch als derselbe Begriff gelten
+SUFFIXES = ("", "e", "n", "s", "en", "er", "es", "ern", "st", "t")
+
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_LEET = str.maketrans({"0": "o", "1": "i", "3": "e", "4": "a", "5": "s", "7": "t", "@": "a", "$": "s"})
+_TOKEN_RE = re.compile(r'[\w@$]+')
+_HAS_LETTER_RE = re.compile(r'[^\W\d_]')
+
+
+def _leet(token):
+    # Leetspeak nur in Wörtern mit Buchstaben, Telefonnummern bleiben Zahlen
+    if token.isalpha() or not _HAS_LETTER_RE.search(token):
+        return token
+    return token.translate(_LEET).replace("_", "")
+
+
+def tokenize(text):
+    return [_leet(token) for token in _TOKEN_RE.findall(text.lower().translate(_UMLAUTS))]
+
+
+class TermMatcher:
+    """
+    Vorkompilierter Multi-Begriff-Matcher: ganze Wörter, Präfixe und
+    Mehrwort-Begriffe, alles über Set-Lookups statt einer Schleife pro Begriff
+    """
+
+    def __init__(self, terms):
+        self.words = {}  # Wort inkl. aller Endungen -> Begriff
+        self.prefixes = set()
+        self.prefix_lengths = []
+        self.phrases = {}  # erstes Wort -> [(restliche Wörter, Begriff)]
+        for term in terms:
+            self.add(term)
+
+    def add(self, term):
+        term = term.strip()
+        if not term:
+            return
+        is_prefix = term.endswith("*")
+        words = tokenize(term.rstrip("*"))
+        if not words:
+            return
+        if len(words) > 1:
+            self.phrases.setdefault(words[0], []).append((tuple(words[1:]), term))
+        elif is_prefix:
+            self.prefixes.add(words[0])
+            if len(words[0]) not in self.prefix_lengths:
+                self.prefix_lengths = sorted(self.prefix_lengths + [len(words[0])])
+        else:
+            # Endungen schon beim Aufbau ausmultiplizieren: pro Token ein Lookup
+            for suffix in SUFFIXES:
+                self.words.setdefault(words[0] + suffix, words[0])
+
+    def _word_hit(self, token):
+        hit = self.words.get(token)
+        if hit:
+            return hit
+        for length in self.prefix_lengths:
+            if length > len(token):
+                break
+            if token[:length] in self.prefixes:
+                return token[:length]
+        return None
+
+    def find(self, text):
+        """
+        Erster gefundener Begriff oder None
+        """
+        tokens = tokenize(text)
+        for i, token in enumerate(tokens):
+            hit = self._word_hit(token)
+            if hit:
+                return hit
+            for rest, term in self.phrases.get(token, ()):
+                if tuple(tokens[i + 1:i + 1 + len(rest)]) == rest:
+                    return term
+        return None
+
+
+def load_terms(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+
+
+def build_matcher(extra_terms_file=None):
+    terms = list(BLACKLIST_KEYWORDS)
+    path = extra_terms_file or os.getenv("MODERATION_TERMS_FILE")
+    if path:
+        terms += load_terms(path)
+    return TermMatcher(terms)
+
+
+_matcher = build_matcher()
+
+
+def check_harmful_content(text):
+    return _matcher.find(text) is not None
@@ -0,0 +1,315 @@
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import telemetry
+
+# Lokale Warteschlange fuer Praxis-Emails. Der Chat-Turn schreibt nur in die
+# SQLite-Datei und ist sofort fertig, ein Hintergrund-Thread verschickt.
+# email_sender (smtplib, ssl, email.mime) wird erst im Worker importiert.
+OUTBOX_PATH = os.getenv('OUTBOX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'outbox.sqlite3'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '8'))
+OUTBOX_BACKOFF_BASE = float(os.getenv('OUTBOX_BACKOFF_BASE', '5'))
+OUTBOX_BACKOFF_MAX = float(os.getenv('OUTBOX_BACKOFF_MAX', '900'))
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '2'))
+# Ein beanspruchter Eintrag gehoert dem Prozess, der ihn verschickt. Erst wenn
+# der Anspruch aelter als OUTBOX_CLAIM_LEASE Sekunden ist (Prozess abgestuerzt),
+# darf ein anderer Worker ihn erneut versuchen - laenger als der laengste
+# SMTP-Versand eines Batches waehlen.
+OUTBOX_CLAIM_LEASE = float(os.getenv('OUTBOX_CLAIM_LEASE', '600'))
+
+# Zustellung an die Praxis:
+#   OUTBOX_DELIVERY=immediate  eine Email pro Buchung, sobald sie in der Outbox liegt (Default)
+#   OUTBOX_DELIVERY=digest     eine Sammel-Email, sobald die aelteste wartende Buchung
+#                              DIGEST_WINDOW Sekunden alt ist oder DIGEST_MAX_SIZE Buchungen warten
+OUTBOX_DELIVERY = os.getenv('OUTBOX_DELIVERY', 'immediate')
+DIGEST_WINDOW = float(os.getenv('DIGEST_WINDOW', '300'))
+DIGEST_MAX_SIZE = int(os.getenv('DIGEST_MAX_SIZE', '20'))
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    appointment_data TEXT NOT NULL,
+    conversation_history TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    claimed_by TEXT,
+    claimed_at REAL
+)
+"""
+
+# Eindeutig pro Prozess (PIDs wiederholen sich ueber Container hinweg)
+_OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# "with conn" beendet nur die Transaktion, schliesst aber nicht - deshalb eine
+# offene Verbindung pro Thread und Datei; Schema und Migration nur einmal pro Datei
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+_prepared = set()
+
+_worker = None
+_worker_lock = threading.Lock()
+_wakeup = threading.Event()
+
+
+def _prepare(conn, path):
+    if path in _prepared:
+        return
+    with _connections_lock:
+        if path in _prepared:
+            return
+        conn.execute(_SCHEMA)
+        # Outbox-Dateien von vor den Anspruechen nachruesten
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(outbox)")}
+        with conn:
+            for column, kind in (("claimed_by", "TEXT"), ("claimed_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE outbox ADD COLUMN {column} {kind}")
+        _prepared.add(path)
+
+
+def _connect(path=None):
+    path = path or OUTBOX_PATH
+    connections = getattr(_local, "connections", None)
+    if connections is None:
+        connections = _local.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        connections[path] = conn
+        with _connections_lock:
+            _connections.append(conn)
+    _prepare(conn, path)
+    return conn
+
+
+def close():
+    """
+    Alle Outbox-Verbindungen schliessen (Shutdown, Tests, Benchmarks)
+    """
+    global _local
+    with _connections_lock:
+        connections = list(_connections)
+        del _connections[:]
+        _prepared.clear()
+        _local = threading.local()
+    for conn in connections:
+        conn.close()
+
+
+def enqueue_appointment_email(appointment_data, conversation_history, path=None):
+    """
+    Legt die Terminanfrage in die Outbox und kehrt sofort zurueck
+    """
+    now = time.time()
+    try:
+        with _connect(path) as conn:
+            cursor = conn.execute(
+                "INSERT INTO outbox (created_at, appointment_data, conversation_history, next_attempt_at) "
+                "VALUES (?, ?, ?, ?)",
+                (now, json.dumps(appointment_data, ensure_ascii=False),
+                 json.dumps(conversation_history, ensure_ascii=False), now),
+            )
+            outbox_id = cursor.lastrowid
+    except sqlite3.Error as e:
+        logger.error("Fehler beim Schreiben in die Outbox: %s", e)
+        return {"success": False, "error": str(e), "message": "Anfrage konnte nicht gespeichert werden"}
+
+    _wakeup.set()
+    return {"success": True, "id": outbox_id, "message": "Anfrage in Outbox gespeichert"}
+
+
+def get_status(outbox_id, path=None):
+    """
+    pending, sending, sent oder failed; None, wenn es den Eintrag nicht gibt
+    """
+    row = _connect(path).execute("SELECT status FROM outbox WHERE id = ?", (outbox_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _backoff(attempts):
+    return min(OUTBOX_BACKOFF_BASE * (2 ** (attempts - 1)), OUTBOX_BACKOFF_MAX)
+
+
+def _digest_due(conn, now, window, max_size):
+    count, oldest = conn.execute(
+        "SELECT COUNT(*), MIN(created_at) FROM outbox WHERE status = 'pending' AND next_attempt_at <= ?",
+        (now,),
+    ).fetchone()
+    return count >= max_size or (count > 0 and oldest <= now - window)
+
+
+def process_pending(path=None, send_batch=None, limit=None, delivery=None, window=None, max_size=None):
+    """
+    Verschickt alle faelligen Eintraege einmal, gesammelt ueber eine
+    SMTP-Session. Gibt die Anzahl der erfolgreich zugestellten Buchungen zurueck.
+    Im Digest-Modus wird erst versendet, wenn das Fenster voll oder abgelaufen ist.
+    """
+    from email_sender import send_appointment_digest, send_appointment_emails
+
+    delivery = delivery or OUTBOX_DELIVERY
+    if delivery == 'digest':
+        send_batch = send_batch or send_appointment_digest
+        max_size = max_size or DIGEST_MAX_SIZE
+        limit = limit or max_size
+    else:
+        send_batch = send_batch or send_appointment_emails
+        limit = limit or 20
+
+    conn = _connect(path)
+    now = time.time()
+    if delivery == 'digest' and not _digest_due(
+            conn, now, DIGEST_WINDOW if window is None else window, max_size):
+        return 0
+
+    rows = conn.execute(
+        "SELECT id, appointment_data, conversation_history, attempts FROM outbox "
+        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?",
+        (now, limit),
+    ).fetchall()
+
+    # Eintraege exklusiv beanspruchen (mehrere Prozesse koennen dieselbe Outbox leeren)
+    claimed = []
+    with conn:
+        for row in rows:
+            if conn.execute(
+                "UPDATE outbox SET status = 'sending', claimed_by = ?, claimed_at = ? "
+                "WHERE id = ? AND status = 'pending'",
+                (_OWNER, time.time(), row[0]),
+            ).rowcount:
+                claimed.append(row)
+    if not claimed:
+        return 0
+
+    batch = [(json.loads(data), json.loads(history)) for _, data, history, _ in claimed]
+    try:
+        results = send_batch(batch)
+    except Exception as e:
+        results = [{"success": False, "error": str(e)}] * len(batch)
+
+    sent = 0
+    with conn:
+        for (outbox_id, _, _, attempts), result in zip(claimed, results):
+            attempts += 1
+            if result['success']:
+                conn.execute(
+                    "UPDATE outbox SET status = 'sent', attempts = ?, last_error = NULL, claimed_by = NULL "
+                    "WHERE id = ?",
+                    (attempts, outbox_id),
+                )
+                sent += 1
+            elif attempts >= OUTBOX_MAX_ATTEMPTS:
+                logger.error("Outbox-Eintrag %s nach %d Versuchen aufgegeben", outbox_id, attempts)
+                telemetry.count("docbot_outbox_failed_total")
+                conn.execute(
+                    "UPDATE outbox SET status = 'failed', attempts = ?, last_error = ?, claimed_by = NULL "
+                    "WHERE id = ?",
+                    (attempts, result.get('error', 'Unbekannt'), outbox_id),
+                )
+            else:
+                logger.warning("Outbox-Eintrag %s: Versuch %d fehlgeschlagen, neuer Versuch in %.0fs",
+                               outbox_id, attempts, _backoff(attempts))
+                telemetry.count("docbot_outbox_retries_total")
+                conn.execute(
+                    "UPDATE outbox SET status = 'pending', attempts = ?, last_error = ?, "
+                    "next_attempt_at = ?, claimed_by = NULL WHERE id = ?",
+                    (attempts, result.get('error', 'Unbekannt'), time.time() + _backoff(attempts), outbox_id),
+                )
+
+    return sent
+
+
+def _recover(path=None, lease=None):
+    """
+    Nach einem Absturz mitten im Versand erneut versuchen (lieber doppelt als
+    gar nicht) - aber nur Ansprueche, deren Lease abgelaufen ist. Was ein
+    anderer Worker gerade sendet, bleibt liegen.
+    """
+    lease = OUTBOX_CLAIM_LEASE if lease is None else lease
+    conn = _connect(path)
+    with conn:
+        recovered = conn.execute(
+            "UPDATE outbox SET status = 'pending', claimed_by = NULL "
+            "WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)",
+            (time.time() - lease,),
+        ).rowcount
+    if recovered:
+        logger.warning("%d haengende Outbox-Eintraege wieder freigegeben", recovered)
+    return recovered
+
+
+class OutboxWorker(threading.Thread):
+    """
+    Hintergrund-Thread, der die Outbox mit Retries und Backoff leert
+    """
+
+    def __init__(self, path=None, send_batch=None, poll_interval=OUTBOX_POLL_INTERVAL, delivery=None):
+        super().__init__(name="outbox-worker", daemon=True)
+        self.path = path
+        self.send_batch = send_batch
+        self.poll_interval = poll_interval
+        self.delivery = delivery
+        self._stop_event = threading.Event()
+
+    def run(self):
+        from email_sender import get_pool
+
+        while not self._stop_event.is_set():
+            try:
+                # Auch zur Laufzeit: Ansprueche abgestuerzter Worker laufen irgendwann ab
+                _recover(self.path)
+                process_pending(self.path, self.send_batch, delivery=self.delivery)
+                # Offene SMTP-Sessions zwischen den Buchungen am Leben halten
+                get_pool().keepalive()
+            except Exception as e:
+                logger.exception("Fehler im Outbox-Worker: %s", e)
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        _wakeup.set()
+        self.join(timeout)
+
+
+def start_worker():
+    """
+    Startet den Outbox-Worker einmal pro Prozess
+    """
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = OutboxWorker()
+            _worker.start()
+    return _worker
+
+
+# Test-Funktion
+if __name__ == "__main__":
+    telemetry.configure_logging()
+    # Lokaler SMTP-Stand-in:
+    #   python -m aiosmtpd -n -l localhost:1025
+    #   SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0 python outbox.py
+    test_data = {
+        "patient_name": "Emma Test Schmidt",
+        "patient_email": "emma.test@example.com",
+        "patient_phone": None,
+        "appointment_request": "Dienstag 15:00 Uhr",
+        "reason": "Zahnreinigung",
+        "notes": "Outbox-Test"
+    }
+
+    print(enqueue_appointment_email(test_data, []))
+    print(f"Versendet: {process_pending()}")
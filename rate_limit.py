@@ -0,0 +1,395 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import telemetry
+
+# Zugangskontrolle vor dem Modell:
+#   1. Token-Bucket pro Session und pro IP (RATE_LIMIT_*): ein Skript oder ein
+#      einzelner Nutzer kann nicht mehr als seinen Anteil anfragen.
+#   2. Globale Obergrenze gleichzeitiger Modell-Aufrufe (MODEL_MAX_CONCURRENCY)
+#      mit begrenzter, fairer (FIFO) Warteschlange. Ist die Schlange voll oder
+#      dauert das Warten länger als MODEL_QUEUE_TIMEOUT, wird sofort abgelehnt.
+# Abgelehnte Anfragen bekommen RATE_LIMITED_RESPONSE statt eines Fehlers.
+#
+#   RATE_LIMIT_ENABLED=0            alles aus
+#   RATE_LIMIT_SESSION_RATE=0.2     Nachrichten pro Sekunde und Session (Nachfüllrate)
+#   RATE_LIMIT_SESSION_BURST=5      so viele Nachrichten direkt hintereinander
+#   RATE_LIMIT_IP_RATE=1.0 / RATE_LIMIT_IP_BURST=20
+#   RATE_LIMIT_MAX_KEYS=10000       gemerkte Sessions/IPs (älteste fliegen raus)
+#   RATE_LIMIT_TRUST_FORWARDED=0    IP aus X-Forwarded-For (nur hinter eigenem Proxy/Frontend)
+#   MODEL_MAX_CONCURRENCY=8         gleichzeitige Modell-Aufrufe
+#   MODEL_QUEUE_SIZE=32             wartende Aufrufe höchstens
+#   MODEL_QUEUE_TIMEOUT=10          Sekunden in der Schlange höchstens
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") != "0"
+RATE_LIMIT_SESSION_RATE = float(os.getenv("RATE_LIMIT_SESSION_RATE", "0.2"))
+RATE_LIMIT_SESSION_BURST = float(os.getenv("RATE_LIMIT_SESSION_BURST", "5"))
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "1.0"))
+RATE_LIMIT_IP_BURST = float(os.getenv("RATE_LIMIT_IP_BURST", "20"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0") != "0"
+MODEL_MAX_CONCURRENCY = int(os.getenv("MODEL_MAX_CONCURRENCY", "8"))
+MODEL_QUEUE_SIZE = int(os.getenv("MODEL_QUEUE_SIZE", "32"))
+MODEL_QUEUE_TIMEOUT = float(os.getenv("MODEL_QUEUE_TIMEOUT", "10"))
+
+RATE_LIMITED_RESPONSE = (
+    "Entschuldigung, gerade kommen sehr viele Anfragen auf einmal. "
+    "Bitte versuchen Sie es später erneut oder rufen Sie uns an: 0521-12345678"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimited(Exception):
+    """
+    Anfrage abgelehnt. reason: session, ip, queue_full oder queue_timeout
+    """
+
+    def __init__(self, reason, retry_after=None):
+        super().__init__(f"Rate-Limit ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    burst Tokens, füllt sich mit rate Tokens pro Sekunde wieder auf
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now, cost=1.0):
+        """
+        0.0 wenn erlaubt, sonst Sekunden bis genug Tokens da sind
+        """
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class KeyedLimiter:
+    """
+    Ein Token-Bucket pro Schlüssel (Session-ID, IP), höchstens max_keys
+    Buckets; volle Buckets werden beim Verdrängen zuerst geopfert
+    """
+
+    def __init__(self, rate, burst, max_keys=RATE_LIMIT_MAX_KEYS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """
+        0.0 wenn erlaubt, sonst Wartezeit in Sekunden
+        """
+        now = self.clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_keys:
+                    self._evict(now)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+    def _evict(self, now):
+        # Ein voller Bucket ist wie ein neuer: verlustfrei löschbar
+        for key, bucket in self._buckets.items():
+            if bucket.full(now):
+                del self._buckets[key]
+                return
+        self._buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class _Waiter:
+    """
+    Wartender Aufruf: sync über ein Event, async über ein Future seines Loops
+    """
+
+    __slots__ = ("event", "loop", "future", "granted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.event = threading.Event() if loop is None else None
+        self.future = loop.create_future() if loop is not None else None
+        self.granted = False
+
+    def wake(self):
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class ConcurrencyLimiter:
+    """
+    Höchstens max_concurrency gleichzeitige Aufrufe, dahinter eine
+    FIFO-Schlange mit max_queue Plätzen. Ein freier Platz geht direkt an den
+    ältesten Wartenden, damit sich niemand vordrängeln kann.
+    """
+
+    def __init__(self, max_concurrency=MODEL_MAX_CONCURRENCY, max_queue=MODEL_QUEUE_SIZE,
+                 timeout=MODEL_QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self.stats = {"admitted": 0, "queued": 0, "queue_full": 0, "queue_timeout": 0, "max_queue_depth": 0}
+
+    def _enqueue(self, loop=None):
+        """
+        (True, None) bei sofortigem Platz, (False, waiter) zum Warten;
+        RateLimited, wenn die Schlange voll ist
+        """
+        with self._lock:
+            if self.active < self.max_concurrency and not self._queue:
+                self.active += 1
+                self.stats["admitted"] += 1
+                self._gauges()
+                return True, None
+            if len(self._queue) >= self.max_queue:
+                self.stats["queue_full"] += 1
+                raise RateLimited("queue_full", self.timeout)
+            waiter = _Waiter(loop)
+            self._queue.append(waiter)
+            self.stats["queued"] += 1
+            self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], len(self._queue))
+            self._gauges()
+            return False, waiter
+
+    def _abandon(self, waiter):
+        """
+        Wartender gibt auf. True, wenn er den Platz doch noch bekommen hat.
+        """
+        with self._lock:
+            if waiter.granted:
+                return True
+            self._queue.remove(waiter)
+            self.stats["queue_timeout"] += 1
+            self._gauges()
+            return False
+
+    def acquire(self, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        admitted, waiter = self._enqueue()
+        if not admitted:
+            if not waiter.event.wait(timeout) and not self._abandon(waiter):
+                raise RateLimited("queue_timeout", timeout)
+        telemetry.observe("docbot_model_queue_wait_seconds", time.perf_counter() - start)
+
+    async def aacquire(self, timeout=None):
+        """
+        Wie acquire, ohne den Event-Loop zu blockieren; Abbruch gibt den Platz frei
+        """
+        import asyncio
+
+        timeout = self.timeout if timeout is None else timeout
+        start = time.perf_counter()
+        admitted, waiter = self._enqueue(asyncio.get_running_loop())
+        if not admitted:
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout)
+            except asyncio.TimeoutError:
+                if not self._abandon(waiter):
+                    raise RateLimited("queue_timeout", timeout)
+            except BaseException:
+                # Abgebrochen: einen schon zugeteilten Platz weitergeben
+                if self._abandon(waiter):
+                    self.release()
+                raise
+        telemetry.observe("docbot_model_queue_wait_seconds", time.perf_counter() - start)
+
+    def release(self):
+        with self._lock:
+            if self._queue:
+                # Platz direkt weiterreichen, active bleibt gleich
+                waiter = self._queue.popleft()
+                waiter.granted = True
+                self.stats["admitted"] += 1
+                waiter.wake()
+            else:
+                self.active -= 1
+            self._gauges()
+
+    def _gauges(self):
+        telemetry.gauge("docbot_model_active_calls", self.active)
+        telemetry.gauge("docbot_model_queue_depth", len(self._queue))
+
+    @contextmanager
+    def slot(self, timeout=None):
+        self.acquire(timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def queue_depth(self):
+        return len(self._queue)
+
+
+_enabled = RATE_LIMIT_ENABLED
+_session_limiter = KeyedLimiter(RATE_LIMIT_SESSION_RATE, RATE_LIMIT_SESSION_BURST)
+_ip_limiter = KeyedLimiter(RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST)
+_model_limiter = ConcurrencyLimiter()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    """
+    Zur Laufzeit ein-/ausschalten (Benchmarks)
+    """
+    global _enabled
+    _enabled = flag
+
+
+def _reject(reason, retry_after):
+    telemetry.count("docbot_rate_limited_total", reason=reason)
+    logger.info("Anfrage abgelehnt (%s), erneut in %.1fs", reason, retry_after)
+    raise RateLimited(reason, retry_after)
+
+
+def client_ip(headers, peer=None):
+    """
+    IP für das Limit: der direkte Gegenüber oder, bei vertrauenswürdigem
+    Proxy, der erste Eintrag aus X-Forwarded-For
+    """
+    if RATE_LIMIT_TRUST_FORWARDED and headers:
+        forwarded = headers.get("x-forwarded-for") or headers.get("X-Forwarded-For")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return peer
+
+
+def admit(session_id=None, ip=None):
+    """
+    Prüft die Buckets für Session und IP; RateLimited, wenn einer leer ist.
+    Ohne Schlüssel wird nichts begrenzt.
+    """
+    if not _enabled:
+        return
+    if ip:
+        retry_after = _ip_limiter.check(ip)
+        if retry_after:
+            _reject("ip", retry_after)
+    if session_id:
+        retry_after = _session_limiter.check(session_id)
+        if retry_after:
+            _reject("session", retry_after)
+
+
+@contextmanager
+def model_slot():
+    """
+    with model_slot(): backend.chat(...) - RateLimited bei voller oder zu langer Schlange
+    """
+    if not _enabled:
+        yield
+        return
+    try:
+        _model_limiter.acquire()
+    except RateLimited as e:
+        telemetry.count("docbot_rate_limited_total", reason=e.reason)
+        raise
+    try:
+        yield
+    finally:
+        _model_limiter.release()
+
+
+class _AsyncModelSlot:
+    async def __aenter__(self):
+        if _enabled:
+            try:
+                await _model_limiter.aacquire()
+            except RateLimited as e:
+                telemetry.count("docbot_rate_limited_total", reason=e.reason)
+                raise
+            self.held = True
+        else:
+            self.held = False
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.held:
+            _model_limiter.release()
+        return False
+
+
+def amodel_slot():
+    """
+    async with amodel_slot(): await backend.achat(...)
+    """
+    return _AsyncModelSlot()
+
+
+def limited(function):
+    """
+    function im Modell-Slot aufrufen, z.B. limited(backend.generate_json)
+    """
+    def call(*args, **kwargs):
+        with model_slot():
+            return function(*args, **kwargs)
+
+    return call
+
+
+def alimited(function):
+    """
+    Wie limited für Coroutine-Funktionen (backend.agenerate_json)
+    """
+    async def call(*args, **kwargs):
+        async with amodel_slot():
+            return await function(*args, **kwargs)
+
+    return call
+
+
+def get_model_limiter():
+    return _model_limiter
+
+
+def metrics():
+    return {
+        **_model_limiter.stats,
+        "active": _model_limiter.active,
+        "queue_depth": _model_limiter.queue_depth(),
+        "tracked_sessions": len(_session_limiter),
+        "tracked_ips": len(_ip_limiter),
+    }
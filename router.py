@@ -0,0 +1,381 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import telemetry
+
+# Router über mehrere LLM-Backends (LLM_BACKEND=router). Pro Backend werden
+# die letzten Latenzen und Fehler mitgeschrieben; jede Anfrage geht an das
+# schnellste gesunde Backend. Ist nach dessen p95 noch keine Antwort da, geht
+# dieselbe Anfrage zusätzlich an das nächste (Hedging), die erste Antwort
+# gewinnt. Fehler schalten sofort auf das nächste Backend um.
+#
+# Circuit Breaker: nach ROUTER_BREAKER_FAILURES Fehlern in Folge ist ein
+# Backend ROUTER_BREAKER_COOLDOWN Sekunden raus, danach darf genau eine
+# Probe-Anfrage durch (half-open). Klappt sie, ist es wieder drin.
+#
+#   ROUTER_BACKENDS=ollama,hf       Kandidaten (Namen aus llm_backends.BACKENDS)
+#   ROUTER_WINDOW=100               Latenzen/Ergebnisse pro Backend im Fenster
+#   ROUTER_HEDGE=1                  Hedging an/aus
+#   ROUTER_HEDGE_DELAY=2.0          Hedge-Schwelle in s, solange noch keine p95 bekannt ist
+#   ROUTER_MIN_SAMPLES=20           ab so vielen Messungen gilt die p95
+#   ROUTER_MAX_ERROR_RATE=0.5       darüber nur noch, wenn kein anderes Backend da ist
+#   ROUTER_THREADS=64               Threads für synchrone Aufrufe (alle gleichzeitigen Turns)
+ROUTER_BACKENDS = os.getenv("ROUTER_BACKENDS", "ollama,hf")
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "100"))
+ROUTER_HEDGE = os.getenv("ROUTER_HEDGE", "1") != "0"
+ROUTER_HEDGE_DELAY = float(os.getenv("ROUTER_HEDGE_DELAY", "2.0"))
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "20"))
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_BREAKER_FAILURES = int(os.getenv("ROUTER_BREAKER_FAILURES", "5"))
+ROUTER_BREAKER_COOLDOWN = float(os.getenv("ROUTER_BREAKER_COOLDOWN", "30"))
+ROUTER_THREADS = int(os.getenv("ROUTER_THREADS", "64"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+logger = logging.getLogger(__name__)
+
+
+class BackendStats:
+    """
+    Rollierende Latenzen (pro Aufruf-Art) und Fehler eines Backends plus
+    Zustand des Circuit Breakers
+    """
+
+    def __init__(self, label, window=ROUTER_WINDOW, failures=ROUTER_BREAKER_FAILURES,
+                 cooldown=ROUTER_BREAKER_COOLDOWN, clock=time.monotonic):
+        self.label = label
+        self.window = window
+        self.failure_threshold = failures
+        self.cooldown = cooldown
+        self.clock = clock
+        self.latencies = {}  # "chat"/"json" -> deque
+        self.outcomes = deque(maxlen=window)  # True = Erfolg
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Darf eine Anfrage an dieses Backend? Nach der Abkühlzeit genau eine Probe.
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                return True
+            return False
+
+    def available(self):
+        with self._lock:
+            return self.state == CLOSED or (self.state == OPEN and self.clock() - self.opened_at >= self.cooldown)
+
+    def success(self, kind=None, latency=None):
+        with self._lock:
+            if kind is not None:
+                self.latencies.setdefault(kind, deque(maxlen=self.window)).append(latency)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                logger.info("Backend %s wieder in Rotation", self.label)
+            self.state = CLOSED
+
+    def failure(self):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.consecutive_failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logger.warning("Backend %s nach %d Fehlern aus der Rotation", self.label,
+                                   self.consecutive_failures)
+                    telemetry.count("docbot_router_breaker_open_total", backend=self.label)
+                self.state = OPEN
+                self.opened_at = self.clock()
+
+    def release(self):
+        # Abgebrochene Probe (verlorenes Hedge-Rennen): nächste Anfrage darf wieder proben
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.state = OPEN
+
+    def percentile(self, kind, q):
+        with self._lock:
+            values = sorted(self.latencies.get(kind, ()))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(len(values) * q))]
+
+    def samples(self, kind):
+        return len(self.latencies.get(kind, ()))
+
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self):
+        return {
+            "state": self.state,
+            "error_rate": round(self.error_rate(), 3),
+            "consecutive_failures": self.consecutive_failures,
+            **{
+                f"{kind}_{name}_ms": round(value * 1000, 1)
+                for kind in sorted(self.latencies)
+                for name, value in (("p50", self.percentile(kind, 0.5)), ("p95", self.percentile(kind, 0.95)))
+                if value is not None
+            },
+        }
+
+
+class RouterBackend:
+    """
+    Backend-Schnittstelle wie in llm_backends, verteilt auf mehrere Backends.
+    backends: Namen (get_backend) oder fertige Backend-Objekte, z.B. FakeBackends.
+    """
+    name = "router"
+
+    def __init__(self, backends=None, hedge=ROUTER_HEDGE, hedge_delay=ROUTER_HEDGE_DELAY,
+                 min_samples=ROUTER_MIN_SAMPLES, max_error_rate=ROUTER_MAX_ERROR_RATE, clock=time.monotonic,
+                 **stats_options):
+        from llm_backends import get_backend
+
+        if backends is None:
+            backends = [name.strip() for name in ROUTER_BACKENDS.split(",") if name.strip()]
+        self.backends = []
+        self.stats = {}
+        for backend in backends:
+            if isinstance(backend, str):
+                try:
+                    backend = get_backend(backend)
+                except Exception as e:
+                    # Z.B. Client-Bibliothek fehlt: ohne dieses Backend weiter
+                    logger.warning("Router: Backend %s nicht verfügbar: %s", backend, e)
+                    continue
+            label = backend.name
+            if label in self.stats:
+                label = f"{backend.name}#{len(self.backends) + 1}"
+            self.backends.append((label, backend))
+            self.stats[label] = BackendStats(label, clock=clock, **stats_options)
+        if not self.backends:
+            raise ValueError("Router ohne Backends (ROUTER_BACKENDS)")
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.counters = {"requests": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0}
+        # Gehedgte Verlierer laufen zu Ende (sync nicht abbrechbar) und liefern noch Messwerte
+        self._pool = ThreadPoolExecutor(max_workers=ROUTER_THREADS, thread_name_prefix="router")
+
+    def _ranked(self, kind):
+        """
+        Verfügbare Backends, schnellstes (p50) zuerst; unbekannte vorn, damit
+        sie Messwerte bekommen, fehleranfällige hinten
+        """
+        def _key(item):
+            stats = self.stats[item[0]]
+            p50 = stats.percentile(kind, 0.5)
+            return (stats.error_rate() > self.max_error_rate, p50 is not None, p50 or 0.0)
+
+        return sorted((item for item in self.backends if self.stats[item[0]].available()), key=_key)
+
+    def _hedge_after(self, label, kind):
+        stats = self.stats[label]
+        if stats.samples(kind) < self.min_samples:
+            return self.hedge_delay
+        return stats.percentile(kind, 0.95)
+
+    def _timed(self, label, kind, call):
+        stats = self.stats[label]
+        start = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            stats.failure()
+            telemetry.count("docbot_router_requests_total", backend=label, result="error")
+            raise
+        stats.success(kind, time.perf_counter() - start)
+        telemetry.count("docbot_router_requests_total", backend=label, result="ok")
+        return result
+
+    def _route(self, kind, method, *args, **kwargs):
+        self.counters["requests"] += 1
+        remaining = self._ranked(kind)
+        if not remaining:
+            raise RuntimeError("Router: alle Backends gesperrt (Circuit Breaker)")
+        pending = {}
+        first_label = remaining[0][0]
+        started = time.perf_counter()
+        hedged = False
+        error = None
+
+        def _launch():
+            while remaining:
+                label, backend = remaining.pop(0)
+                if self.stats[label].acquire():
+                    call = getattr(backend, method)
+                    pending[self._pool.submit(self._timed, label, kind, lambda: call(*args, **kwargs))] = label
+                    return True
+            return False
+
+        _launch()
+        while pending:
+            timeout = None
+            if self.hedge and not hedged and remaining:
+                timeout = max(0.0, self._hedge_after(first_label, kind) - (time.perf_counter() - started))
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # p95 überschritten: dieselbe Anfrage zusätzlich ans nächste Backend
+                hedged = True
+                if _launch():
+                    self.counters["hedges"] += 1
+                    telemetry.count("docbot_router_hedges_total", backend=first_label)
+                continue
+            for future in done:
+                label = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning("Backend %s fehlgeschlagen: %s", label, e)
+                    error = e
+                    continue
+                if label != first_label and hedged:
+                    self.counters["hedge_wins"] += 1
+                return result
+            if not pending and _launch():
+                self.counters["failovers"] += 1
+        raise error or RuntimeError("Router: kein Backend verfügbar")
+
+    def chat(self, messages, max_tokens=512, stream=False):
+        if stream:
+            return self._stream(messages, max_tokens)
+        return self._route("chat", "chat", messages, max_tokens=max_tokens)
+
+    def _stream(self, messages, max_tokens):
+        # Streams nicht hedgen: Umschalten nur, solange noch kein Text geflossen ist
+        error = None
+        for label, backend in self._ranked("chat"):
+            stats = self.stats[label]
+            if not stats.acquire():
+                continue
+            started = settled = False
+            try:
+                for delta in backend.chat(messages, max_tokens=max_tokens, stream=True):
+                    started = True
+                    yield delta
+                # Stream-Dauer hängt an der Antwortlänge, zählt daher nicht zur Latenz
+                settled = True
+                stats.success()
+                return
+            except Exception as e:
+                settled = True
+                stats.failure()
+                if started:
+                    raise
+                logger.warning("Backend %s fehlgeschlagen: %s", label, e)
+                error = e
+                continue
+            finally:
+                # Vorzeitig geschlossen (Client weg, Frist): ohne Ergebnis, eine
+                # halb offene Probe darf aber nicht für immer hängen bleiben
+                if not settled:
+                    stats.release()
+        raise error or RuntimeError("Router: kein Backend verfügbar")
+
+    def generate_json(self, prompt, max_tokens=256, schema=None):
+        return self._route("json", "generate_json", prompt, max_tokens=max_tokens, schema=schema)
+
+    def warmup(self, system_prompt):
+        for label, backend in self.backends:
+            if hasattr(backend, "warmup"):
+                try:
+                    backend.warmup(system_prompt)
+                except Exception as e:
+                    logger.warning("Warmup von %s fehlgeschlagen: %s", label, e)
+
+    async def _aroute(self, kind, method, *args, **kwargs):
+        import asyncio
+
+        self.counters["requests"] += 1
+        remaining = self._ranked(kind)
+        if not remaining:
+            raise RuntimeError("Router: alle Backends gesperrt (Circuit Breaker)")
+        pending = {}
+        first_label = remaining[0][0]
+        started = time.perf_counter()
+        hedged = False
+        error = None
+
+        async def _timed(label, call):
+            stats = self.stats[label]
+            start = time.perf_counter()
+            try:
+                result = await call
+            except asyncio.CancelledError:
+                stats.release()
+                raise
+            except Exception:
+                stats.failure()
+                telemetry.count("docbot_router_requests_total", backend=label, result="error")
+                raise
+            stats.success(kind, time.perf_counter() - start)
+            telemetry.count("docbot_router_requests_total", backend=label, result="ok")
+            return result
+
+        def _launch():
+            while remaining:
+                label, backend = remaining.pop(0)
+                if self.stats[label].acquire():
+                    call = getattr(backend, method)(*args, **kwargs)
+                    pending[asyncio.ensure_future(_timed(label, call))] = label
+                    return True
+            return False
+
+        _launch()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge and not hedged and remaining:
+                    timeout = max(0.0, self._hedge_after(first_label, kind) - (time.perf_counter() - started))
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    if _launch():
+                        self.counters["hedges"] += 1
+                        telemetry.count("docbot_router_hedges_total", backend=first_label)
+                    continue
+                for task in done:
+                    label = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.warning("Backend %s fehlgeschlagen: %s", label, e)
+                        error = e
+                        continue
+                    if label != first_label and hedged:
+                        self.counters["hedge_wins"] += 1
+                    return result
+                if not pending and _launch():
+                    self.counters["failovers"] += 1
+        finally:
+            # Async lässt sich der Verlierer abbrechen
+            for task in pending:
+                task.cancel()
+        raise error or RuntimeError("Router: kein Backend verfügbar")
+
+    async def achat(self, messages, max_tokens=512):
+        return await self._aroute("chat", "achat", messages, max_tokens=max_tokens)
+
+    async def agenerate_json(self, prompt, max_tokens=256, schema=None):
+        return await self._aroute("json", "agenerate_json", prompt, max_tokens=max_tokens, schema=schema)
+
+    def snapshot(self):
+        """
+        Zustand pro Backend und Zähler (für Benchmarks und Logs)
+        """
+        return {"backends": {label: stats.snapshot() for label, stats in self.stats.items()}, **self.counters}
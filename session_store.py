@@ -0,0 +1,282 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Serverseitiger Speicher für laufende Chats. Pro Session gibt es genau eine
+# Liste von Turns (Anzeige und Modell-Historie in einem) plus den state mit
+# Termin-Datensatz und Slots. Inaktive Sessions laufen nach SESSION_TTL ab.
+#
+#   SESSION_STORE=memory   LRU im Prozess (Default, max. SESSION_MAX_SESSIONS)
+#   SESSION_STORE=sqlite   SQLite-Datei, von mehreren Prozessen nutzbar
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_TTL = float(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+# Abgelaufene Sessions beim Speichern aufräumen, höchstens alle SESSION_PURGE_INTERVAL Sekunden
+SESSION_PURGE_INTERVAL = float(os.getenv("SESSION_PURGE_INTERVAL", "60"))
+SESSION_DB_PATH = os.getenv(
+    "SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.sqlite3")
+)
+
+_ROLES = ("user", "assistant")
+
+
+class _PeriodicPurge:
+    """
+    purge_expired() aus save() heraus, aber nur alle purge_interval Sekunden
+    """
+
+    def _maybe_purge(self):
+        now = self.clock()
+        with self._purge_lock:
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        self.purge_expired()
+
+
+class Turn:
+    """
+    Eine Nachricht. context=False: nur angezeigt, nicht ans Modell
+    (Begrüßung, abgelehnte Nachrichten, Fehlermeldungen)
+    """
+
+    __slots__ = ("role", "content", "context")
+
+    def __init__(self, role, content, context=True):
+        self.role = role
+        self.content = content
+        self.context = context
+
+    def to_list(self):
+        return [_ROLES.index(self.role), self.content, int(self.context)]
+
+    @classmethod
+    def from_list(cls, data):
+        return cls(_ROLES[data[0]], data[1], bool(data[2]))
+
+
+class Session:
+    __slots__ = ("session_id", "turns", "context_start", "awaiting_confirmation", "state", "updated_at")
+
+    def __init__(self, session_id, turns=None, context_start=0, awaiting_confirmation=False, state=None,
+                 updated_at=None):
+        self.session_id = session_id
+        self.turns = turns if turns is not None else []
+        # Ab diesem Turn zählt die Historie fürs Modell (nach dem Versand neu)
+        self.context_start = context_start
+        self.awaiting_confirmation = awaiting_confirmation
+        self.state = state if state is not None else {}
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    def add(self, role, content, context=True):
+        self.turns.append(Turn(role, content, context))
+
+    def history(self):
+        """
+        conversation_history für chat/chat_cloud, jedes Mal eine neue Liste
+        """
+        return [
+            {"role": turn.role, "content": turn.content}
+            for turn in self.turns[self.context_start:] if turn.context
+        ]
+
+    def record_turn(self, user_message, response, new_history, awaiting_confirmation):
+        """
+        Übernimmt das Ergebnis eines Chat-Turns
+        """
+        # Nur wenn der Chat den Turn an die Historie gehängt hat, sieht ihn das Modell wieder
+        in_context = len(new_history) == len(self.history()) + 2
+        self.add("user", user_message, in_context)
+        self.add("assistant", response, in_context)
+        if not new_history:
+            # Anfrage versendet: das Modell fängt neu an, die Anzeige bleibt
+            self.context_start = len(self.turns)
+        self.awaiting_confirmation = awaiting_confirmation
+
+    def to_dict(self):
+        return {
+            "turns": [turn.to_list() for turn in self.turns],
+            "context_start": self.context_start,
+            "awaiting_confirmation": self.awaiting_confirmation,
+            "state": self.state,
+        }
+
+    @classmethod
+    def from_dict(cls, session_id, data, updated_at=None):
+        return cls(
+            session_id,
+            [Turn.from_list(turn) for turn in data.get("turns", ())],
+            data.get("context_start", 0),
+            data.get("awaiting_confirmation", False),
+            data.get("state") or {},
+            updated_at,
+        )
+
+
+class MemorySessionStore(_PeriodicPurge):
+    """
+    LRU mit TTL im Prozess-Speicher
+    """
+
+    def __init__(self, maxsize=SESSION_MAX_SESSIONS, ttl=SESSION_TTL, clock=time.time,
+                 purge_interval=SESSION_PURGE_INTERVAL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.purge_interval = purge_interval
+        self._next_purge = clock() + purge_interval
+        self._purge_lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def get(self, session_id):
+        now = self.clock()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                self.stats["misses"] += 1
+                return None
+            if session.updated_at + self.ttl <= now:
+                del self._sessions[session_id]
+                self.stats["expired"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.stats["hits"] += 1
+            return session
+
+    def save(self, session):
+        session.updated_at = self.clock()
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self._sessions.move_to_end(session.session_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                self.stats["evictions"] += 1
+        self._maybe_purge()
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def purge_expired(self):
+        cutoff = self.clock() - self.ttl
+        with self._lock:
+            # Älteste zuerst, also abbrechen sobald eine Session noch frisch ist
+            expired = []
+            for session_id, session in self._sessions.items():
+                if session.updated_at > cutoff:
+                    break
+                expired.append(session_id)
+            for session_id in expired:
+                del self._sessions[session_id]
+            self.stats["expired"] += len(expired)
+        return len(expired)
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore(_PeriodicPurge):
+    """
+    Sessions als kompaktes JSON in SQLite, überlebt Neustarts.
+    Eine Verbindung pro Thread, wiederverwendet bis close().
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions ("
+        "id TEXT PRIMARY KEY, updated_at REAL NOT NULL, data TEXT NOT NULL)"
+    )
+
+    def __init__(self, path=SESSION_DB_PATH, ttl=SESSION_TTL, clock=time.time,
+                 purge_interval=SESSION_PURGE_INTERVAL):
+        self.path = path
+        self.ttl = ttl
+        self.clock = clock
+        self.purge_interval = purge_interval
+        self._next_purge = clock() + purge_interval
+        self._purge_lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(self._SCHEMA)
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated_at)")
+
+    def _connect(self):
+        # "with conn" beendet nur die Transaktion, schließt aber nicht -
+        # deshalb pro Thread eine offene Verbindung statt einer neuen je Aufruf
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def close(self):
+        """
+        Alle Verbindungen schließen (Shutdown, Benchmarks)
+        """
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def get(self, session_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT updated_at, data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if row[0] + self.ttl <= self.clock():
+                conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+                self.stats["expired"] += 1
+                return None
+        self.stats["hits"] += 1
+        return Session.from_dict(session_id, json.loads(row[1]), row[0])
+
+    def save(self, session):
+        session.updated_at = self.clock()
+        data = json.dumps(session.to_dict(), ensure_ascii=False, separators=(",", ":"))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO sessions (id, updated_at, data) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET updated_at = excluded.updated_at, data = excluded.data",
+                (session.session_id, session.updated_at, data),
+            )
+        self._maybe_purge()
+
+    def delete(self, session_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    def purge_expired(self):
+        with self._connect() as conn:
+            deleted = conn.execute(
+                "DELETE FROM sessions WHERE updated_at <= ?", (self.clock() - self.ttl,)
+            ).rowcount
+        self.stats["expired"] += deleted
+        return deleted
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_session_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SQLiteSessionStore() if SESSION_STORE == "sqlite" else MemorySessionStore()
+        return _store
@@ -0,0 +1,91 @@
+import re
+
+from extract_info import REASON_PATTERNS
+
+# Welche der 4 Infos (Name, Kontakt, Termin, Grund) hat der Patient schon
+# genannt? Statt bei jedem Turn die ganze Konversation neu zu verketten und
+# zu durchsuchen, wird nur die neueste Nachricht gescannt; der Stand lebt
+# als kleines Dict in der Session.
+
+NAME_RE = re.compile(r'\b[A-ZÄÖÜ][a-zäöüß]+\s+[A-ZÄÖÜ][a-zäöüß]+')
+CONTACT_RE = re.compile(r'(@|\.de|\.com|\d{4,})')
+TIME_RE = re.compile(
+    r'(montag|dienstag|mittwoch|donnerstag|freitag|samstag|sonntag|\d{1,2}:\d{2}|\d{1,2}\s?uhr|vormittag|nachmittag|morgen|heute)'
+)
+
+SLOTS = ("name", "contact", "time", "reason")
+
+SLOT_LABELS = {
+    "name": "Name des Patienten",
+    "contact": "Email oder Telefonnummer",
+    "time": "Terminwunsch (Tag/Uhrzeit)",
+    "reason": "Grund des Besuchs",
+}
+
+
+class SlotTracker:
+    """
+    Inkrementeller Ersatz für check_if_complete
+    """
+
+    __slots__ = ("filled", "tail")
+
+    def __init__(self, filled=None, tail=""):
+        self.filled = set(filled or ())
+        # Letztes Wort der vorigen Nachricht: "Max" + "Mustermann" über zwei
+        # Nachrichten zählt wie früher beim Verketten als Name
+        self.tail = tail
+
+    def update(self, user_message):
+        text = f"{self.tail} {user_message}" if self.tail else user_message
+        lower = text.lower()
+
+        if "name" not in self.filled and NAME_RE.search(text):
+            self.filled.add("name")
+        if "contact" not in self.filled and CONTACT_RE.search(text):
+            self.filled.add("contact")
+        if "time" not in self.filled and TIME_RE.search(lower):
+            self.filled.add("time")
+        if "reason" not in self.filled and any(pattern.search(user_message) for pattern, _ in REASON_PATTERNS):
+            self.filled.add("reason")
+
+        words = user_message.split()
+        self.tail = words[-1] if words else self.tail
+        return self
+
+    def is_complete(self):
+        # Wie bisher: Name, Kontakt und Termin reichen für die Bestätigung
+        return {"name", "contact", "time"} <= self.filled
+
+    def missing(self):
+        return [slot for slot in SLOTS if slot not in self.filled]
+
+    def to_dict(self):
+        return {"filled": sorted(self.filled), "tail": self.tail}
+
+    @classmethod
+    def from_dict(cls, data):
+        if not data:
+            return cls()
+        return cls(data.get("filled"), data.get("tail", ""))
+
+
+def missing_slots_hint(missing):
+    """
+    Kurzer Hinweis fürs Modell, wonach es als Nächstes fragen soll
+    """
+    if not missing:
+        return None
+    labels = ", ".join(SLOT_LABELS[slot] for slot in missing)
+    return f"Noch fehlende Informationen: {labels}. Frage als Nächstes nur nach: {SLOT_LABELS[missing[0]]}."
+
+
+def check_if_complete(conversation_history):
+    """
+    Prüft ob wir alle nötigen Infos haben
+    """
+    tracker = SlotTracker()
+    for msg in conversation_history:
+        if msg['role'] == 'user':
+            tracker.update(msg['content'])
+    return tracker.is_complete()
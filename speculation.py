@@ -0,0 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import telemetry
+
+# Spekulative Arbeit zwischen Zusammenfassung und "ja": sobald der Chat auf
+# die Bestätigung wartet, läuft die teure Vervollständigung des Datensatzes
+# (Extraktion über die ganze Konversation) schon im Hintergrund. Der
+# Bestätigungs-Turn holt nur noch das fertige Ergebnis ab; hat der laufende
+# Datensatz schon Name, Kontakt und Termin, wartet er nicht auf eine noch
+# laufende Spekulation.
+#
+# Im state steht nur ein Token; das Ergebnis liegt hier im Prozess. Gültig ist
+# es nur, solange Historie und Datensatz unverändert sind (Fingerprint) -
+# korrigiert der Patient etwas, wird die Spekulation verworfen. Landet die
+# Bestätigung in einem anderen Prozess, läuft der normale Weg.
+#
+#   SPECULATION_ENABLED=0      ausschalten
+#   SPECULATION_WORKERS=2      Hintergrund-Threads
+#   SPECULATION_MAX_PENDING    höchstens so viele offene Spekulationen (älteste fliegen raus)
+#   SPECULATION_TTL            Sekunden, danach wird nicht mehr abgeholt
+#   SPECULATION_WAIT           so lange wartet die Bestätigung auf eine noch laufende Spekulation
+SPECULATION_ENABLED = os.getenv("SPECULATION_ENABLED", "1") != "0"
+SPECULATION_WORKERS = int(os.getenv("SPECULATION_WORKERS", "2"))
+SPECULATION_MAX_PENDING = int(os.getenv("SPECULATION_MAX_PENDING", "256"))
+SPECULATION_TTL = float(os.getenv("SPECULATION_TTL", "1800"))
+SPECULATION_WAIT = float(os.getenv("SPECULATION_WAIT", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+def fingerprint(conversation_history, record):
+    data = json.dumps([conversation_history, record], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class Speculator:
+    """
+    Offene Spekulationen: Token -> (Fingerprint, Future, Ablaufzeit)
+    """
+
+    def __init__(self, workers=SPECULATION_WORKERS, max_pending=SPECULATION_MAX_PENDING, ttl=SPECULATION_TTL,
+                 wait=SPECULATION_WAIT, clock=time.monotonic):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.wait = wait
+        self.clock = clock
+        self._pending = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self.stats = {"started": 0, "hits": 0, "misses": 0, "invalidated": 0, "failed": 0, "evictions": 0}
+
+    def _submit(self, function, args):
+        # Threads erst bei der ersten Spekulation starten
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="speculation")
+        return self._executor.submit(function, *args)
+
+    def start(self, key, function, *args):
+        """
+        Startet function(*args) im Hintergrund, gültig für den Fingerprint key.
+        Gibt das Token für den state zurück.
+        """
+        token = uuid.uuid4().hex
+        with self._lock:
+            future = self._submit(function, args)
+            self._pending[token] = (key, future, self.clock() + self.ttl)
+            while len(self._pending) > self.max_pending:
+                _, (_, old, _) = self._pending.popitem(last=False)
+                old.cancel()
+                self.stats["evictions"] += 1
+            self.stats["started"] += 1
+        telemetry.count("docbot_speculation_total", result="started")
+        return token
+
+    def discard(self, token):
+        with self._lock:
+            entry = self._pending.pop(token, None)
+            if entry is None:
+                return
+            # Noch nicht angefangen: gar nicht erst laufen lassen
+            entry[1].cancel()
+            self.stats["invalidated"] += 1
+        telemetry.count("docbot_speculation_total", result="invalidated")
+
+    def take(self, token, key, wait=None):
+        """
+        Ergebnis der Spekulation oder None, wenn es keine gültige gibt.
+        Wartet höchstens wait (Default self.wait) Sekunden auf eine noch laufende.
+        """
+        wait = self.wait if wait is None else wait
+        with self._lock:
+            entry = self._pending.pop(token, None)
+        if entry is None or entry[0] != key or entry[2] <= self.clock() or (wait <= 0 and not entry[1].done()):
+            if entry is not None:
+                entry[1].cancel()
+            self.stats["misses"] += 1
+            telemetry.count("docbot_speculation_total", result="miss")
+            return None
+        try:
+            result = entry[1].result(timeout=wait)
+        except Exception as e:
+            logger.warning("Spekulation fehlgeschlagen: %r", e)
+            self.stats["failed"] += 1
+            telemetry.count("docbot_speculation_total", result="failed")
+            return None
+        self.stats["hits"] += 1
+        telemetry.count("docbot_speculation_total", result="hit")
+        return result
+
+    def __len__(self):
+        return len(self._pending)
+
+
+_enabled = SPECULATION_ENABLED
+_speculator = Speculator()
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True):
+    """
+    Zur Laufzeit ein-/ausschalten (Benchmarks)
+    """
+    global _enabled
+    _enabled = flag
+
+
+def get_speculator():
+    return _speculator
+
+
+def start(state, conversation_history, record, function, *args):
+    """
+    Spekulation für den aktuellen Stand starten; eine ältere wird verworfen
+    """
+    discard(state)
+    if _enabled and state is not None:
+        state['speculation'] = _speculator.start(fingerprint(conversation_history, record), function, *args)
+
+
+def discard(state):
+    token = state.pop('speculation', None) if state is not None else None
+    if token:
+        _speculator.discard(token)
+
+
+def take(state, conversation_history, record, wait=None):
+    """
+    Fertiges Ergebnis, falls für genau diesen Stand spekuliert wurde, sonst None.
+    wait=0: nur ein schon fertiges Ergebnis abholen, nicht warten.
+    """
+    token = state.pop('speculation', None) if state is not None else None
+    if not token:
+        return None
+    return _speculator.take(token, fingerprint(conversation_history, record), wait)
+
+
+def metrics():
+    stats = dict(_speculator.stats)
+    stats["pending"] = len(_speculator)
+    return stats
@@ -0,0 +1,292 @@
+import atexit
+import bisect
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+# Messpunkte pro Chat-Turn: Spans um jede Stufe (Inhaltsfilter, Modell,
+# Slot-Check, Extraktion, Outbox, SMTP) plus Zähler für Tokens und Retries.
+#
+#   TELEMETRY_ENABLED=1                 Spans und Metriken einschalten (Default aus)
+#   TELEMETRY_SPANS_FILE=spans.jsonl    Spans als OTLP-artiges JSON, eine Zeile pro Span
+#   TELEMETRY_METRICS_FILE=docbot.prom  Metriken im Prometheus-Textformat (beim Beenden)
+#   LOG_LEVEL=DEBUG|INFO|WARNING        Log-Level für configure_logging()
+#
+# Ausgeschaltet liefert span() ein geteiltes No-op-Objekt: kein Zeitstempel,
+# keine Allokation, kein Lock.
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "0") != "0"
+TELEMETRY_SPANS_FILE = os.getenv("TELEMETRY_SPANS_FILE")
+TELEMETRY_METRICS_FILE = os.getenv("TELEMETRY_METRICS_FILE")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_enabled = TELEMETRY_ENABLED
+_current = contextvars.ContextVar("docbot_span", default=None)
+
+
+def configure_logging(level=None):
+    """
+    Einheitliches Log-Format für App, API und Kommandozeile
+    """
+    logging.basicConfig(
+        level=(level or LOG_LEVEL).upper(),
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+
+
+class Metrics:
+    """
+    Zähler, Gauges und Histogramme mit Labels, Ausgabe im Prometheus-Textformat
+    """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> Wert
+        self.gauges = {}      # (name, labels) -> aktueller Wert
+        self.histograms = {}  # (name, labels) -> [Anzahl pro Bucket..., +Inf, Summe]
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            counts = self.histograms.get(key)
+            if counts is None:
+                counts = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, list(counts)) for key, counts in self.histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), value in gauges:
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        for (name, labels), counts in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {round(counts[-1], 6)}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class SpanExporter:
+    """
+    Schreibt fertige Spans als JSON-Zeilen mit den Feldnamen aus OTLP/JSON
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span, end_ns, error):
+        record = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "startTimeUnixNano": span.start_ns,
+            "endTimeUnixNano": end_ns,
+            "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": repr(error)} if error else {"code": 1},
+        }
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock:
+            # Daemon-Threads (Outbox) können nach dem Schließen noch Spans liefern
+            if not self._file.closed:
+                self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class Span:
+    """
+    Zeitmessung einer Stufe. Als Kontextmanager wird der Span zum Elternteil
+    aller darin geöffneten Spans; ohne with mit end() abschließen.
+    """
+
+    __slots__ = ("name", "attributes", "trace_id", "span_id", "parent_id", "start", "start_ns", "_token", "_ended")
+
+    def __init__(self, name, parent=None, attributes=None):
+        parent = parent if isinstance(parent, Span) else _current.get()
+        self.name = name
+        self.attributes = attributes or {}
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.perf_counter()
+        self.start_ns = time.time_ns()
+        self._token = None
+        self._ended = False
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, error=None):
+        if self._ended:
+            return
+        self._ended = True
+        duration = time.perf_counter() - self.start
+        _metrics.observe("docbot_stage_duration_seconds", duration, stage=self.name)
+        if error is not None:
+            _metrics.inc("docbot_stage_errors_total", stage=self.name)
+        if _exporter is not None:
+            _exporter.export(self, self.start_ns + int(duration * 1e9), error)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self._token)
+        self.end(exc)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_metrics = Metrics()
+_exporter = SpanExporter(TELEMETRY_SPANS_FILE) if TELEMETRY_ENABLED and TELEMETRY_SPANS_FILE else None
+
+
+def enabled():
+    return _enabled
+
+
+def enable(flag=True, spans_file=None):
+    """
+    Zur Laufzeit ein-/ausschalten (Benchmarks, Tests)
+    """
+    global _enabled, _exporter
+    _enabled = flag
+    if spans_file:
+        if _exporter is not None:
+            _exporter.close()
+        _exporter = SpanExporter(spans_file)
+
+
+def span(name, parent=None, **attributes):
+    """
+    with span("check_harmful_content"): ...
+    Ohne parent hängt der Span unter dem gerade offenen Span.
+    """
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, parent, attributes)
+
+
+def count(name, value=1, **labels):
+    if _enabled:
+        _metrics.inc(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    if _enabled:
+        _metrics.set(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if _enabled:
+        _metrics.observe(name, value, **labels)
+
+
+def record_tokens(backend, prompt_tokens, completion_tokens):
+    if _enabled:
+        _metrics.inc("docbot_llm_tokens_total", prompt_tokens, backend=backend, kind="prompt")
+        _metrics.inc("docbot_llm_tokens_total", completion_tokens, backend=backend, kind="completion")
+
+
+def get_metrics():
+    return _metrics
+
+
+def render_prometheus():
+    return _metrics.render()
+
+
+def write_metrics(path=None):
+    path = path or TELEMETRY_METRICS_FILE
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(render_prometheus())
+
+
+@atexit.register
+def _shutdown():
+    if _enabled and TELEMETRY_METRICS_FILE:
+        write_metrics()
+    if _exporter is not None:
+        _exporter.close()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Flache Module im Repo-Root importierbar machen
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
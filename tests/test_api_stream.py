@@ -0,0 +1,71 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+import api
+import chat_core
+import rate_limit
+import telemetry
+from llm_backends import FakeBackend
+
+
+class SlowStreamBackend(FakeBackend):
+    """
+    Liefert die Antwort Wort für Wort mit Pause dazwischen
+    """
+
+    def __init__(self, pause):
+        super().__init__(latency=0)
+        self.pause = pause
+        self.closed = False
+
+    def _stream(self, messages, delay, fail):
+        try:
+            for word in "Gerne! Wie ist Ihr Name bitte?".split(" "):
+                time.sleep(self.pause)
+                yield word + " "
+        finally:
+            self.closed = True
+
+
+def test_disconnect_mid_token_releases_model_slot():
+    rate_limit.enable(True)
+    limiter = rate_limit.get_model_limiter()
+    backend = SlowStreamBackend(pause=0.2)
+    stream = chat_core.run_turn_stream(backend, "Ich möchte einen Termin", [], False, {}, {})
+
+    async def _client():
+        async for _ in api._iterate_closing(stream):
+            pass
+
+    async def _main():
+        task = asyncio.create_task(_client())
+        # Mitten im zweiten Token: next() hängt im Worker-Thread
+        await asyncio.sleep(0.3)
+        assert limiter.active == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(_main())
+    assert limiter.active == 0
+    assert backend.closed
+
+
+def test_closed_stream_ends_turn_span(tmp_path, monkeypatch):
+    spans_file = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(telemetry, "_enabled", True)
+    monkeypatch.setattr(telemetry, "_exporter", telemetry.SpanExporter(str(spans_file)))
+    stream = chat_core.run_turn_stream(SlowStreamBackend(pause=0), "Ich möchte einen Termin", [], False, {}, {})
+    next(stream)
+    stream.close()
+    telemetry._exporter.close()
+
+    spans = {span["name"]: span for span in map(json.loads, spans_file.read_text().splitlines())}
+    for name in ("chat_turn", "llm_chat"):
+        assert {"key": "status", "value": {"stringValue": "cancelled"}} in spans[name]["attributes"]
+    assert spans["llm_chat"]["parentSpanId"] == spans["chat_turn"]["spanId"]
+    histograms = telemetry.get_metrics().histograms
+    assert ("docbot_stage_duration_seconds", (("stage", "chat_turn"),)) in histograms
@@ -0,0 +1,47 @@
+import pytest
+
+import context_window
+from chat_core import SYSTEM_PROMPT
+from context_window import build_context, count_message_tokens
+
+RAMBLING = [
+    "Ach, und ich wollte noch sagen, dass mein Nachbar auch bei Ihnen in Behandlung war.",
+    "Letzte Woche war ich im Urlaub an der Ostsee, da hat es die ganze Zeit geregnet.",
+    "Meine Tochter meinte, ich solle unbedingt mal wieder zur Kontrolle gehen.",
+    "Übrigens: Ich kann nur vormittags, nachmittags arbeite ich in der Bäckerei.",
+]
+
+
+def _long_history(turns):
+    history = [
+        {"role": "user", "content": "Hallo, mein Name ist Max Mustermann, Telefon 0171 1234567."},
+        {"role": "assistant", "content": "Guten Tag Herr Mustermann! Wann hätten Sie Zeit?"},
+    ]
+    for i in range(turns):
+        history.append({"role": "user", "content": RAMBLING[i % len(RAMBLING)] + f" ({i})"})
+        history.append({"role": "assistant", "content": "Verstehe. Darf ich noch etwas fragen?"})
+    return history
+
+
+@pytest.mark.parametrize("budget", [600, 1000, context_window.CONTEXT_TOKEN_BUDGET])
+def test_prompt_stays_within_budget(budget):
+    history = _long_history(80)
+    record = {"patient_name": "Max Mustermann", "patient_phone": "0171 1234567"}
+    for end in range(0, len(history), 2):
+        messages = build_context(SYSTEM_PROMPT, history[:end], "Wann haben Sie Zeit?", record,
+                                 token_budget=budget, hint="Noch fehlende Informationen: Terminwunsch.")
+        assert count_message_tokens(messages) <= budget
+        assert messages[0] == {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def test_overlong_message_is_truncated_to_budget():
+    messages = build_context(SYSTEM_PROMPT, _long_history(10), "Zahnschmerzen " * 2000, token_budget=800)
+    assert count_message_tokens(messages) <= 800
+    assert messages[-1]["role"] == "user"
+
+
+def test_estimate_is_not_below_tiktoken():
+    tiktoken = pytest.importorskip("tiktoken")
+    encoding = tiktoken.get_encoding("cl100k_base")
+    for text in [SYSTEM_PROMPT] + RAMBLING:
+        assert context_window._estimate_tokens(text) >= len(encoding.encode(text))
@@ -0,0 +1,92 @@
+import asyncio
+import time
+import uuid
+
+import pytest
+
+import chat_core
+import dedup
+import rate_limit
+from extract_info import empty_record
+from llm_backends import FakeBackend
+
+
+@pytest.fixture
+def outbox(monkeypatch):
+    """
+    Outbox im Speicher: eingereihte Datensätze statt SQLite und Worker
+    """
+    queued = []
+
+    def _enqueue(appointment_data, conversation_history):
+        queued.append(appointment_data)
+        return {"success": True, "id": len(queued)}
+
+    monkeypatch.setattr(chat_core, "enqueue_appointment_email", _enqueue)
+    monkeypatch.setattr(chat_core, "start_worker", lambda: None)
+    rate_limit.enable(True)
+    return queued
+
+
+def _confirmation():
+    # Eigene Historie pro Test, sonst greift die Dedup-Schicht
+    history = [
+        {"role": "user", "content": f"hier ist max mustermann, Fall {uuid.uuid4().hex}"},
+        {"role": "assistant", "content": "Soll ich diese Anfrage weiterleiten?"},
+    ]
+    # Name fehlt: die Bestätigung muss noch extrahieren
+    record = dict(empty_record(), patient_phone="0171 1234567", appointment_request="Montag 10 Uhr")
+    return history, {"appointment": record}
+
+
+def test_model_deadline_returns_canned_reply(outbox, monkeypatch):
+    monkeypatch.setattr(chat_core, "DEADLINE_LLM", 0.05)
+    start = time.perf_counter()
+    response, history, awaiting = asyncio.run(
+        chat_core.arun_turn(FakeBackend(latency=2.0), "Ich brauche einen Termin", [], False, {})
+    )
+    assert response == chat_core.DEADLINE_RESPONSE
+    assert history == [] and awaiting is False
+    assert time.perf_counter() - start < 1.0
+    assert rate_limit.get_model_limiter().active == 0
+
+
+def test_model_deadline_uses_fallback(outbox, monkeypatch):
+    monkeypatch.setattr(chat_core, "DEADLINE_LLM", 0.05)
+    response, history, _ = asyncio.run(chat_core.arun_turn(
+        FakeBackend(latency=2.0), "Ich brauche einen Termin", [], False, {}, FakeBackend(latency=0)
+    ))
+    assert response == FakeBackend.QUESTIONS["patient_name"]
+    assert history[-1] == {"role": "assistant", "content": response}
+
+
+def test_extraction_deadline_sends_record_as_is(outbox, monkeypatch):
+    monkeypatch.setattr(chat_core, "DEADLINE_EXTRACTION", 0.05)
+    history, state = _confirmation()
+    record = dict(state["appointment"])
+    start = time.perf_counter()
+    response, _, awaiting = asyncio.run(chat_core.arun_turn(FakeBackend(latency=2.0), "Ja", history, True, state))
+    assert time.perf_counter() - start < 1.0
+    assert response.startswith("Perfekt!") and awaiting is False
+    assert outbox == [record]
+    assert rate_limit.get_model_limiter().active == 0
+
+
+def test_cancel_releases_dedup_claim_and_model_slot(outbox):
+    history, state = _confirmation()
+    limiter = rate_limit.get_model_limiter()
+
+    async def _main():
+        task = asyncio.create_task(chat_core.arun_turn(FakeBackend(latency=2.0), "Ja", history, True, state))
+        await asyncio.sleep(0.2)
+        # Extraktion läuft: Buchung reserviert, Modell-Platz belegt
+        assert dedup.conversation_key(history) in dedup.get_index()._entries
+        assert limiter.active == 1
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(_main())
+    assert dedup.conversation_key(history) not in dedup.get_index()._entries
+    assert limiter.active == 0
+    assert outbox == []
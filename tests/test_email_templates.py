@@ -0,0 +1,21 @@
+import csv
+import io
+
+import pytest
+
+from email_templates import render_attachment
+
+
+@pytest.mark.parametrize("value", ["=HYPERLINK(\"http://x\")", "+49 171 1234567", "-1+1", "@SUM(A1)", "\t=1+1"])
+def test_csv_attachment_neutralizes_formulas(value):
+    data = {"patient_name": value, "patient_phone": value, "reason": value}
+    _, _, _, content = render_attachment([data], "csv")
+    row = list(csv.reader(io.StringIO(content), delimiter=";"))[1]
+    assert row[0] == row[2] == row[4] == "'" + value
+
+
+def test_csv_attachment_keeps_plain_values():
+    data = {"patient_name": "Max Mustermann", "patient_phone": 1711234567, "notes": None}
+    _, _, _, content = render_attachment([data], "csv")
+    row = list(csv.reader(io.StringIO(content), delimiter=";"))[1]
+    assert row == ["Max Mustermann", "", "1711234567", "", "", ""]
@@ -0,0 +1,41 @@
+import pytest
+
+import faq_cache
+
+POSITIVE = [
+    ("Ich habe einen Notfall!", "notfall"),
+    ("Gibt es am Wochenende einen Notdienst?", "notfall"),
+    ("Notfall, wann haben Sie offen?", "notfall"),
+    ("Wie sind Ihre Öffnungszeiten?", "oeffnungszeiten"),
+    ("Haben Sie am Samstag offen?", "oeffnungszeiten"),
+    ("Ist die Praxis mittwochs geschlossen?", "oeffnungszeiten"),
+    ("Wie ist Ihre Adresse?", "adresse"),
+    ("Wo finde ich Ihre Praxis?", "adresse"),
+    ("Wie ist die Anfahrt mit dem Bus?", "adresse"),
+    ("Gibt es Parkplätze?", "adresse"),
+    ("Was ist Ihre Telefonnummer?", "telefon"),
+    ("Wie erreiche ich die Praxis telefonisch?", "telefon"),
+]
+
+NEGATIVE = [
+    "Mein Zahnfleisch ist geschwollen, was soll ich tun?",
+    "Ich hatte einen Fahrradunfall und brauche einen Termin",
+    "Es ist kein Notfall, ich hätte gern einen Termin",
+    "Können Sie mich bitte anrufen?",
+    "Ich würde mich gern anrufen lassen",
+    "Wo liegt das Problem, wenn mein Zahn beim Kauen weh tut?",
+    "Wann haben Sie einen Termin frei?",
+    "Meine Adresse ist Hauptstraße 5",
+    "Meine Telefonnummer ist 0171 1234567",
+]
+
+
+@pytest.mark.parametrize("text, intent", POSITIVE)
+def test_intent_matches(text, intent):
+    assert faq_cache.match_intent(text) == intent
+
+
+@pytest.mark.parametrize("text", NEGATIVE)
+def test_no_canned_answer(text):
+    assert faq_cache.match_intent(text) is None
+    assert faq_cache.lookup(text, faq_cache.ResponseCache()) is None
@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+
+import pytest
+
+import outbox
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "outbox.sqlite3")
+    outbox.close()
+
+
+def test_connection_reused_per_thread(path):
+    first = outbox.enqueue_appointment_email({"patient_name": "A"}, [], path=path)
+    second = outbox.enqueue_appointment_email({"patient_name": "B"}, [], path=path)
+    assert outbox.get_status(first["id"], path) == "pending"
+    assert outbox.get_status(second["id"], path) == "pending"
+    assert len(outbox._connections) == 1
+
+    thread = threading.Thread(target=outbox.get_status, args=(first["id"], path))
+    thread.start()
+    thread.join()
+    assert len(outbox._connections) == 2
+
+    connections = list(outbox._connections)
+    outbox.close()
+    assert outbox._connections == []
+    with pytest.raises(sqlite3.ProgrammingError):
+        connections[0].execute("SELECT 1")
+
+
+def test_old_schema_is_migrated_once(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, "
+        "appointment_data TEXT NOT NULL, conversation_history TEXT NOT NULL, "
+        "status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, "
+        "next_attempt_at REAL NOT NULL, last_error TEXT)"
+    )
+    conn.close()
+    result = outbox.enqueue_appointment_email({"patient_name": "A"}, [], path=path)
+    assert result["success"]
+    assert path in outbox._prepared
+    columns = {row[1] for row in outbox._connect(path).execute("PRAGMA table_info(outbox)")}
+    assert {"claimed_by", "claimed_at"} <= columns
+
+
+def test_recover_only_expired_claims(path):
+    ids = [outbox.enqueue_appointment_email({"patient_name": name}, [], path=path)["id"] for name in "AB"]
+    conn = outbox._connect(path)
+    with conn:
+        conn.execute("UPDATE outbox SET status = 'sending', claimed_by = 'other', claimed_at = 0 WHERE id = ?",
+                     (ids[0],))
+        conn.execute("UPDATE outbox SET status = 'sending', claimed_by = 'other', claimed_at = strftime('%s','now') "
+                     "WHERE id = ?", (ids[1],))
+    assert outbox._recover(path, lease=60) == 1
+    assert outbox.get_status(ids[0], path) == "pending"
+    assert outbox.get_status(ids[1], path) == "sending"
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import rate_limit
+from rate_limit import ConcurrencyLimiter, KeyedLimiter, RateLimited
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Bedingung nicht erreicht"
+        time.sleep(0.005)
+
+
+def test_bucket_refill_and_retry_after():
+    clock = FakeClock()
+    limiter = KeyedLimiter(rate=0.5, burst=2, clock=clock)
+    assert limiter.check("a") == 0.0
+    assert limiter.check("a") == 0.0
+    # Leer: ein Token braucht 1 / 0.5 Sekunden
+    assert limiter.check("a") == pytest.approx(2.0)
+    # Andere Schlüssel haben ihren eigenen Bucket
+    assert limiter.check("b") == 0.0
+    clock.now = 1.0
+    assert limiter.check("a") == pytest.approx(1.0)
+    clock.now = 2.0
+    assert limiter.check("a") == 0.0
+    # Nie mehr als burst Tokens, auch nach langer Pause
+    clock.now = 100.0
+    assert limiter.check("a") == 0.0
+    assert limiter.check("a") == 0.0
+    assert limiter.check("a") > 0
+
+
+def test_admit_rejects_with_retry_after(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "_session_limiter", KeyedLimiter(rate=0.2, burst=1, clock=clock))
+    monkeypatch.setattr(rate_limit, "_enabled", True)
+    rate_limit.admit(session_id="s1")
+    with pytest.raises(RateLimited) as error:
+        rate_limit.admit(session_id="s1")
+    assert error.value.reason == "session"
+    assert error.value.retry_after == pytest.approx(5.0)
+    clock.now = 5.0
+    rate_limit.admit(session_id="s1")
+
+
+def test_queue_full():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=1, timeout=2.0)
+    limiter.acquire()
+    waiting = threading.Thread(target=limiter.acquire)
+    waiting.start()
+    _wait_for(lambda: limiter.queue_depth() == 1)
+    with pytest.raises(RateLimited) as error:
+        limiter.acquire()
+    assert error.value.reason == "queue_full"
+    limiter.release()
+    waiting.join()
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_queue_timeout():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=4, timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(RateLimited) as error:
+        limiter.acquire()
+    assert error.value.reason == "queue_timeout"
+    assert limiter.queue_depth() == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+def test_fifo_order():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=8, timeout=2.0)
+    order = []
+
+    def _call(index):
+        with limiter.slot():
+            order.append(index)
+
+    limiter.acquire()
+    threads = []
+    for index in range(5):
+        thread = threading.Thread(target=_call, args=(index,))
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: limiter.queue_depth() == index + 1)
+    limiter.release()
+    for thread in threads:
+        thread.join()
+    assert order == list(range(5))
+    assert limiter.active == 0
+
+
+def test_cancelled_async_waiter_passes_slot_on():
+    limiter = ConcurrencyLimiter(max_concurrency=1, max_queue=8, timeout=2.0)
+
+    async def _holder(name, acquired):
+        await limiter.aacquire()
+        acquired.append(name)
+        await asyncio.sleep(0.01)
+        limiter.release()
+
+    async def _main():
+        acquired = []
+        await limiter.aacquire()
+        first = asyncio.create_task(_holder("first", acquired))
+        second = asyncio.create_task(_holder("second", acquired))
+        third = asyncio.create_task(_holder("third", acquired))
+        await asyncio.sleep(0.01)
+        assert limiter.queue_depth() == 3
+        # Abbruch vor der Zuteilung: verlässt einfach die Schlange
+        first.cancel()
+        await asyncio.sleep(0.01)
+        assert limiter.queue_depth() == 2
+        # Abbruch nach der Zuteilung, bevor der Wartende weiterläuft:
+        # der Platz geht direkt an den nächsten
+        limiter.release()
+        second.cancel()
+        await asyncio.gather(first, second, third, return_exceptions=True)
+        assert first.cancelled() and second.cancelled()
+        assert acquired == ["third"]
+
+    asyncio.run(_main())
+    assert limiter.active == 0
+    assert limiter.queue_depth() == 0